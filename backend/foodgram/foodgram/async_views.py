@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import URLPattern, URLResolver
+
+from .connections import check_connections
+
+ASYNC_ROUTES = {
+    'recipes-list',
+    'recipes-detail',
+    'tags-list',
+    'tags-detail',
+    'ingredients-list',
+    'ingredients-detail',
+    'subscriptions',
+}
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_VIEW_THREADS,
+    thread_name_prefix='async-views'
+)
+
+
+def call_view(view, request, *args, **kwargs):
+    check_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_view(view):
+    run = SyncToAsync(call_view, thread_sensitive=False, executor=executor)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await run(view, request, *args, **kwargs)
+
+    return wrapper
+
+
+def asyncify(patterns, names=ASYNC_ROUTES):
+    result = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            pattern = URLResolver(
+                pattern.pattern,
+                asyncify(pattern.url_patterns, names),
+                pattern.default_kwargs,
+                pattern.app_name,
+                pattern.namespace
+            )
+        elif pattern.name in names:
+            pattern = URLPattern(
+                pattern.pattern,
+                async_view(pattern.callback),
+                pattern.default_args,
+                pattern.name
+            )
+        result.append(pattern)
+    return result
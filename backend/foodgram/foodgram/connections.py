@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+def mark_checked(connection, **kwargs):
+    connection.health_checked_at = time.monotonic()
+
+
+connection_created.connect(mark_checked,
+                           dispatch_uid='foodgram.connections')
+
+
+# Persistent connections can be dropped by the server, PgBouncer or a
+# firewall while idle. A connection idle for longer than
+# DB_HEALTH_CHECK_INTERVAL is pinged before reuse and reopened if it died,
+# instead of failing the first query of the request.
+def check_connections():
+    interval = settings.DB_HEALTH_CHECK_INTERVAL
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if now - getattr(connection, 'health_checked_at', 0) < interval:
+            continue
+        connection.health_checked_at = now
+        if not connection.is_usable():
+            connection.close()
+
+
+class ConnectionHealthMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        check_connections()
+        return self.get_response(request)
+
+    # The event loop thread holds no connections: async views check theirs
+    # in async_views.call_view on the pool thread that runs them.
+    async def __acall__(self, request):
+        return await self.get_response(request)
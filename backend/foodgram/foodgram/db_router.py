@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+current = ContextVar('db_routing', default=None)
+
+
+class Routing:
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+# Used around reads that fill caches and indexes: a lagging replica read
+# right after an invalidation would put stale rows back for the whole TTL.
+@contextmanager
+def primary():
+    routing = current.get()
+    if routing is None:
+        yield
+        return
+    use_replica = routing.use_replica
+    routing.use_replica = False
+    try:
+        yield
+    finally:
+        routing.use_replica = use_replica
+
+
+def get_cache():
+    return caches[settings.DATABASE_REPLICA_CACHE_ALIAS]
+
+
+def pin_key(request):
+    credentials = request.META.get('HTTP_AUTHORIZATION')
+    if not credentials:
+        return None
+    digest = hashlib.sha256(credentials.encode()).hexdigest()
+    return f'db:primary:{digest}'
+
+
+def is_replica_safe(request, pinned):
+    return request.method in SAFE_METHODS and not pinned
+
+
+def pin(key):
+    get_cache().set(key, True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+# Reads go to a replica only inside a request that PrimaryPinningMiddleware
+# marked as safe; management commands and background jobs always use the
+# primary.
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        routing = current.get()
+        replicas = settings.DATABASE_REPLICAS
+        if routing is not None and routing.use_replica and replicas:
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        routing = current.get()
+        if routing is not None:
+            routing.wrote = True
+            routing.use_replica = False
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+# Some endpoints write on GET (subscribe, favorite), so pinning follows the
+# writes the router actually saw rather than the request method.
+class PrimaryPinningMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        key = pin_key(request)
+        pinned = key and get_cache().get(key)
+        routing = Routing(is_replica_safe(request, pinned))
+        token = current.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        if routing.wrote and key:
+            pin(key)
+        return response
+
+    # The cache client blocks, so under ASGI it runs in a worker thread
+    # instead of the event loop.
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        key = pin_key(request)
+        pinned = key and await sync_to_async(
+            get_cache().get, thread_sensitive=False
+        )(key)
+        routing = Routing(is_replica_safe(request, pinned))
+        token = current.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        if routing.wrote and key:
+            await sync_to_async(pin, thread_sensitive=False)(key)
+        return response
@@ -0,0 +1,343 @@
+import asyncio
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNRESOLVED = '<unresolved>'
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+NUMBER = re.compile(r'\b\d+\b')
+SPACES = re.compile(r'\s+')
+
+current = ContextVar('profile', default=None)
+
+
+def fingerprint(sql):
+    sql = IN_LIST.sub('IN (...)', sql)
+    sql = NUMBER.sub('?', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+class Profile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []
+        self.db_time = 0.0
+        self.view_started = None
+        self.render_started = None
+        self.render_time = 0.0
+        self.total = 0.0
+
+    def record(self, sql, duration):
+        self.queries.append(sql)
+        self.db_time += duration
+
+    def rendered(self, response):
+        if self.render_started is not None:
+            self.render_time = time.perf_counter() - self.render_started
+
+    @property
+    def view_time(self):
+        if self.view_started is None:
+            return 0.0
+        end = self.render_started or self.started + self.total
+        return end - self.view_started
+
+    def repeated(self, limit=5):
+        counts = Counter(fingerprint(sql) for sql in self.queries)
+        return [(sql, count) for sql, count in counts.most_common(limit)
+                if count > 1]
+
+
+def record_query(execute, sql, params, many, context):
+    profile = current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record(sql, time.perf_counter() - started)
+
+
+def install(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# Views served by foodgram.async_views run in a thread pool, where each
+# thread opens its own connections; the context variable follows them there.
+connection_created.connect(install, dispatch_uid='foodgram.profiling')
+
+
+class Stats:
+    FIELDS = ('count', 'seconds', 'db_seconds', 'queries', 'render_seconds',
+              'slow')
+
+    def __init__(self, values=None):
+        values = values or [0] * (len(self.FIELDS) + len(BUCKETS))
+        self.values = list(values)
+
+    def add(self, other):
+        self.values = [a + b for a, b in zip(self.values, other.values)]
+
+    def observe(self, profile, slow):
+        values = [1, profile.total, profile.db_time, len(profile.queries),
+                  profile.render_time, int(slow)]
+        values += [int(profile.total <= bound) for bound in BUCKETS]
+        self.add(Stats(values))
+
+    def __getattr__(self, name):
+        try:
+            return self.values[self.FIELDS.index(name)]
+        except ValueError:
+            raise AttributeError(name)
+
+    @property
+    def buckets(self):
+        return self.values[len(self.FIELDS):]
+
+
+def escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.flushed = 0.0
+
+    def observe(self, view, method, status, profile, slow):
+        key = (view, method, str(status))
+        with self.lock:
+            self.stats.setdefault(key, Stats()).observe(profile, slow)
+        directory = settings.PROFILING_METRICS_DIR
+        interval = settings.PROFILING_METRICS_FLUSH_INTERVAL
+        if directory and time.monotonic() - self.flushed > interval:
+            self.flush(Path(directory))
+
+    def snapshot(self):
+        with self.lock:
+            return [[*key, stats.values] for key, stats in self.stats.items()]
+
+    def flush(self, directory):
+        self.flushed = time.monotonic()
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'{os.getpid()}.json'
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(json.dumps(self.snapshot()))
+        temporary.replace(path)
+
+    # Every gunicorn worker keeps its own counters; with
+    # PROFILING_METRICS_DIR set, /metrics adds up the snapshots of all of them.
+    def collect(self):
+        snapshots = {os.getpid(): self.snapshot()}
+        directory = settings.PROFILING_METRICS_DIR
+        if directory:
+            for path in Path(directory).glob('*.json'):
+                pid = int(path.stem)
+                if pid in snapshots:
+                    continue
+                try:
+                    snapshots[pid] = json.loads(path.read_text())
+                except (OSError, ValueError):
+                    continue
+        merged = {}
+        for rows in snapshots.values():
+            for view, method, status, values in rows:
+                merged.setdefault(
+                    (view, method, status), Stats()
+                ).add(Stats(values))
+        return merged
+
+    def render(self):
+        families = (
+            ('foodgram_http_requests_total', 'counter',
+             'Запросы по представлениям', 'count'),
+            ('foodgram_http_request_db_seconds_total', 'counter',
+             'Время SQL-запросов', 'db_seconds'),
+            ('foodgram_http_request_queries_total', 'counter',
+             'Число SQL-запросов', 'queries'),
+            ('foodgram_http_request_render_seconds_total', 'counter',
+             'Время сериализации ответа', 'render_seconds'),
+            ('foodgram_http_slow_requests_total', 'counter',
+             'Медленные запросы', 'slow'),
+        )
+        stats = sorted(self.collect().items())
+        lines = []
+        for name, kind, description, field in families:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (view, method, status), values in stats:
+                labels = (f'view="{escape(view)}",method="{method}",'
+                          f'status="{status}"')
+                lines.append(f'{name}{{{labels}}} {getattr(values, field)}')
+        name = 'foodgram_http_request_duration_seconds'
+        lines.append(f'# HELP {name} Время обработки запроса')
+        lines.append(f'# TYPE {name} histogram')
+        for (view, method, status), values in stats:
+            labels = (f'view="{escape(view)}",method="{method}",'
+                      f'status="{status}"')
+            for bound, count in zip(BUCKETS, values.buckets):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} '
+                         f'{values.count}')
+            lines.append(f'{name}_sum{{{labels}}} {values.seconds}')
+            lines.append(f'{name}_count{{{labels}}} {values.count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = Metrics()
+
+
+# Closed unless PROFILING_METRICS_TOKEN is set: the view is served by every
+# worker, so keeping it private can not be left to nginx.
+def metrics(request):
+    token = settings.PROFILING_METRICS_TOKEN
+    if not token or not constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        metrics_registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNRESOLVED
+    return match.view_name or match._func_path
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Lets Django call the middleware without a thread hop.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.PROFILING_ENABLED:
+            return self.get_response(request)
+        profile, token = self.start(request)
+        profiler = None
+        if random.random() * 100 < settings.PROFILING_SAMPLE_PERCENT:
+            profiler = cProfile.Profile()
+        try:
+            if profiler is None:
+                response = self.get_response(request)
+            else:
+                response = profiler.runcall(self.get_response, request)
+        finally:
+            self.stop(profile, token)
+        return self.finish(request, response, profile, profiler)
+
+    # cProfile would only see the event loop, not the thread pool that runs
+    # the view, so ASGI requests are not sampled.
+    async def __acall__(self, request):
+        if not settings.PROFILING_ENABLED:
+            return await self.get_response(request)
+        profile, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(profile, token)
+        return self.finish(request, response, profile, None)
+
+    def start(self, request):
+        for connection in connections.all():
+            install(connection)
+        profile = Profile()
+        request.profile = profile
+        return profile, current.set(profile)
+
+    def stop(self, profile, token):
+        current.reset(token)
+        profile.total = time.perf_counter() - profile.started
+
+    def finish(self, request, response, profile, profiler):
+        view = view_name(request)
+        slow = profile.total * 1000 >= settings.PROFILING_SLOW_REQUEST_MS
+        metrics_registry.observe(view, request.method, response.status_code,
+                                 profile, slow)
+        response['Server-Timing'] = self.server_timing(profile)
+        if slow:
+            self.log_slow(request, view, profile)
+        if profiler is not None:
+            self.save_profile(request, view, profiler)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            profile.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            profile.render_started = time.perf_counter()
+            response.add_post_render_callback(profile.rendered)
+        return response
+
+    def server_timing(self, profile):
+        return ', '.join((
+            f'db;dur={profile.db_time * 1000:.1f};'
+            f'desc="{len(profile.queries)} SQL"',
+            f'view;dur={profile.view_time * 1000:.1f}',
+            f'render;dur={profile.render_time * 1000:.1f}',
+            f'total;dur={profile.total * 1000:.1f}',
+        ))
+
+    def log_slow(self, request, view, profile):
+        lines = [
+            f'Медленный запрос {request.method} {request.path} ({view}): '
+            f'{profile.total * 1000:.0f} мс, '
+            f'{len(profile.queries)} SQL за {profile.db_time * 1000:.0f} мс, '
+            f'сериализация {profile.render_time * 1000:.0f} мс'
+        ]
+        for sql, count in profile.repeated():
+            lines.append(f'  {count} × {sql}')
+        logger.warning('\n'.join(lines))
+
+    def save_profile(self, request, view, profiler):
+        directory = settings.PROFILING_PROFILE_DIR
+        if directory:
+            name = re.sub(r'[^\w.-]', '_', view)
+            path = Path(directory) / f'{time.time():.6f}-{name}.prof'
+            path.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(path)
+            return
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats(
+            'cumulative'
+        ).print_stats(25)
+        logger.info('Профиль %s %s:\n%s', request.method, request.path,
+                    output.getvalue())
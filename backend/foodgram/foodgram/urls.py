@@ -16,8 +16,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from .profiling import metrics
+
 urlpatterns = [
+    path('metrics', metrics, name='metrics'),
     path('admin/', admin.site.urls),
     path('api/', include('recipes.urls')),
     path('api/', include('users.urls')),
+    path('api/', include('jobs.urls')),
 ]
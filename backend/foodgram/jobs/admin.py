@@ -0,0 +1,13 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['task', 'status', 'priority', 'attempts', 'run_at',
+                    'finished']
+    list_filter = ('status', 'task')
+    search_fields = ('task',)
+
+
+admin.site.register(Job, JobAdmin)
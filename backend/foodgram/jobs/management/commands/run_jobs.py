@@ -0,0 +1,43 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs import queue
+
+PURGE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Завершиться, когда очередь опустеет'
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        processed = 0
+        purged_at = 0
+        while not self.stopping:
+            if time.monotonic() - purged_at > PURGE_INTERVAL:
+                queue.purge()
+                purged_at = time.monotonic()
+            job = queue.run_next()
+            if job is not None:
+                processed += 1
+                self.stdout.write(f'{job}: {job.attempts} попытка')
+                continue
+            if options['burst']:
+                break
+            time.sleep(settings.JOBS_POLL_INTERVAL)
+        self.stdout.write(f'Выполнено задач: {processed}')
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,104 @@
+from django.contrib.auth import get_user_model
+from django.db import models
+from django.utils import timezone
+
+User = get_user_model()
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    task = models.CharField(
+        max_length=200,
+        verbose_name='Задача'
+    )
+    args = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='Аргументы'
+    )
+    kwargs = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='Именованные аргументы'
+    )
+    user = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        verbose_name='Пользователь'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED,
+        verbose_name='Статус'
+    )
+    priority = models.SmallIntegerField(
+        default=0,
+        verbose_name='Приоритет'
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Попытки'
+    )
+    max_attempts = models.PositiveSmallIntegerField(
+        default=1,
+        verbose_name='Максимум попыток'
+    )
+    timeout = models.PositiveIntegerField(
+        default=300,
+        verbose_name='Таймаут, с'
+    )
+    run_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Запустить после'
+    )
+    locked_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Заблокирована до'
+    )
+    result = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name='Результат'
+    )
+    error = models.TextField(
+        blank=True,
+        verbose_name='Ошибка'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создана'
+    )
+    finished = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Завершена'
+    )
+
+    class Meta:
+        ordering = ('-created',)
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(
+                fields=['status', '-priority', 'run_at'],
+                name='job_queue_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.task} #{self.pk} ({self.status})'
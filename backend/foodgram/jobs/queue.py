@@ -0,0 +1,148 @@
+import logging
+import traceback
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from foodgram.connections import check_connections
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+@dataclass(frozen=True)
+class Task:
+    name: str
+    func: object
+    priority: int = 0
+    max_attempts: int = None
+    timeout: int = None
+
+
+def task(name, priority=0, max_attempts=None, timeout=None):
+    def decorator(func):
+        registry[name] = Task(name, func, priority, max_attempts, timeout)
+        return func
+    return decorator
+
+
+def enqueue(name, args=(), kwargs=None, user=None, priority=None,
+            run_at=None):
+    registered = registry[name]
+    job = Job.objects.create(
+        task=name,
+        args=list(args),
+        kwargs=kwargs or {},
+        user=user,
+        priority=registered.priority if priority is None else priority,
+        max_attempts=registered.max_attempts or settings.JOBS_MAX_ATTEMPTS,
+        timeout=registered.timeout or settings.JOBS_TIMEOUT,
+        run_at=run_at or timezone.now()
+    )
+    if settings.JOBS_BACKEND == 'immediate':
+        transaction.on_commit(lambda: run_now(job))
+    return job
+
+
+def expired(now):
+    return Q(status=Job.RUNNING, locked_until__lt=now)
+
+
+def due(now):
+    queued = Q(status=Job.QUEUED, run_at__lte=now)
+    retried = expired(now) & Q(attempts__lt=F('max_attempts'))
+    return queued | retried
+
+
+# A job that crashed or hung its worker on the last attempt never reaches
+# execute(), so it is failed here instead of being reclaimed forever.
+def fail_expired(now):
+    return Job.objects.filter(
+        expired(now), attempts__gte=F('max_attempts')
+    ).update(
+        status=Job.FAILED,
+        locked_until=None,
+        finished=now,
+        error='Задача не завершилась за отведённое время'
+    )
+
+
+def claim():
+    now = timezone.now()
+    fail_expired(now)
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            due(now)
+        ).order_by('-priority', 'run_at', 'id').first()
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.locked_until = now + timedelta(seconds=job.timeout)
+        job.save(update_fields=['status', 'attempts', 'locked_until'])
+    return job
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.JOBS_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def execute(job, claimed=True):
+    registered = registry.get(job.task)
+    changes = {'locked_until': None}
+    jobs = Job.objects.filter(pk=job.pk)
+    if claimed:
+        jobs = jobs.filter(attempts=job.attempts)
+    else:
+        changes['attempts'] = job.attempts
+    try:
+        if registered is None:
+            raise LookupError(f'Неизвестная задача {job.task}')
+        result = registered.func(*job.args, **job.kwargs)
+    except Exception:
+        logger.exception('Задача %s завершилась с ошибкой', job)
+        changes['error'] = traceback.format_exc()
+        if registered is None or job.attempts >= job.max_attempts:
+            changes.update(status=Job.FAILED, finished=timezone.now())
+        else:
+            changes.update(
+                status=Job.QUEUED,
+                run_at=timezone.now() + retry_delay(job.attempts)
+            )
+    else:
+        changes.update(status=Job.DONE, result=result,
+                       finished=timezone.now())
+    jobs.update(**changes)
+    for field, value in changes.items():
+        setattr(job, field, value)
+    return job
+
+
+def run_now(job):
+    job.status = Job.RUNNING
+    job.attempts += 1
+    return execute(job, claimed=False)
+
+
+def run_next():
+    close_old_connections()
+    check_connections()
+    job = claim()
+    if job is not None:
+        execute(job)
+    close_old_connections()
+    return job
+
+
+def purge():
+    return Job.objects.filter(
+        status__in=[Job.DONE, Job.FAILED],
+        finished__lt=timezone.now() - timedelta(days=settings.JOBS_KEEP_DAYS)
+    ).delete()[0]
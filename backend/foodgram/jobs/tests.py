@@ -0,0 +1,174 @@
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from recipes import exports
+
+from . import queue
+from .models import Job
+
+User = get_user_model()
+
+calls = []
+
+
+@queue.task('tests.record', priority=1)
+def record(value):
+    calls.append(value)
+    return value
+
+
+@queue.task('tests.fail', max_attempts=2)
+def fail():
+    raise RuntimeError('boom')
+
+
+class QueueTest(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_jobs_run_by_priority(self):
+        queue.enqueue('tests.record', ['low'], priority=0)
+        queue.enqueue('tests.record', ['high'], priority=5)
+        queue.enqueue('tests.record', ['later'],
+                      run_at=timezone.now() + timedelta(hours=1))
+        while queue.run_next():
+            pass
+        self.assertEqual(calls, ['high', 'low'])
+        self.assertEqual(
+            Job.objects.filter(status=Job.DONE).count(), 2
+        )
+        self.assertEqual(Job.objects.get(result='high').attempts, 1)
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = queue.enqueue('tests.fail')
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            queue.run_next()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('boom', job.error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            queue.run_next()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNone(queue.run_next())
+
+    def test_expired_lock_is_reclaimed(self):
+        job = queue.enqueue('tests.record', ['again'])
+        claimed = queue.claim()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertIsNone(queue.claim())
+        Job.objects.filter(pk=job.pk).update(
+            locked_until=timezone.now() - timedelta(seconds=1)
+        )
+        queue.run_next()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.attempts, 2)
+
+        queue.execute(claimed)
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(calls, ['again', 'again'])
+
+    def test_expired_job_fails_after_last_attempt(self):
+        job = queue.enqueue('tests.record', ['hung'])
+        for _ in range(job.max_attempts):
+            self.assertEqual(queue.claim().pk, job.pk)
+            Job.objects.filter(pk=job.pk).update(
+                locked_until=timezone.now() - timedelta(seconds=1)
+            )
+        self.assertIsNone(queue.claim())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, job.max_attempts)
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(calls, [])
+
+    @override_settings(JOBS_BACKEND='immediate')
+    def test_immediate_backend_runs_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = queue.enqueue('tests.record', ['now'])
+            self.assertEqual(calls, [])
+        job.refresh_from_db()
+        self.assertEqual(calls, ['now'])
+        self.assertEqual(job.status, Job.DONE)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(),
+                   EXPORTS_ROOT=tempfile.mkdtemp(),
+                   JOBS_BACKEND='immediate')
+class ShoppingListExportJobTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader',
+            email='reader@foodgram.ru',
+            password='password'
+        )
+        cls.other = User.objects.create_user(
+            username='other',
+            email='other@foodgram.ru',
+            password='password'
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def export(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/recipes/download_shopping_cart/export/',
+                {'format': 'csv'}
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], Job.QUEUED)
+        return self.client.get(response['Location'])
+
+    def test_export_is_generated_in_background(self):
+        response = self.export()
+        self.assertEqual(response.data['status'], Job.DONE)
+        result = response.data['result']
+        self.assertFalse(default_storage.exists(result['file']))
+        download = self.client.get(result['url'])
+        self.assertEqual(download.status_code, 200)
+        self.assertIn('wishlist.csv', download['Content-Disposition'])
+        self.assertTrue(
+            b''.join(download.streaming_content).startswith(b'section,recipe')
+        )
+
+        self.client.force_authenticate(self.other)
+        self.assertEqual(
+            self.client.get(f'/api/jobs/{response.data["id"]}/').status_code,
+            404
+        )
+        self.assertEqual(self.client.get(result['url']).status_code, 404)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(result['url']).status_code, 401)
+
+    def test_purge_deletes_export_file(self):
+        name = self.export().data['result']['file']
+        storage = exports.get_storage()
+        self.assertTrue(storage.exists(name))
+        Job.objects.update(finished=timezone.now() - timedelta(days=30))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(queue.purge(), 1)
+        self.assertFalse(storage.exists(name))
+
+    def test_unknown_format(self):
+        response = self.client.post(
+            '/api/recipes/download_shopping_cart/export/',
+            {'format': 'doc'}
+        )
+        self.assertEqual(response.status_code, 400)
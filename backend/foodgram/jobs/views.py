@@ -0,0 +1,12 @@
+from rest_framework import generics, permissions
+
+from .models import Job
+from .serializers import JobSerializer
+
+
+class JobDetailView(generics.RetrieveAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = JobSerializer
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
@@ -1,4 +1,7 @@
 from django.contrib import admin
+from django.db import transaction
+from . import search, shopping_list
+from .pantry import pantry_index
 from .models import (
     Ingredient,
     Tag,
@@ -26,8 +29,17 @@ class MembershipInline(admin.TabularInline):
 
 class RecipeAdmin(admin.ModelAdmin):
     inlines = [MembershipInline]
-    list_display = ['author', 'name']
+    list_display = ['author', 'name', 'favorites_count', 'in_carts_count']
     list_filter = ('name', 'author', 'tags')
+    readonly_fields = ('favorites_count', 'in_carts_count')
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        search.update_vectors([form.instance.id])
+        recipe_id = form.instance.id
+        transaction.on_commit(lambda: pantry_index.refresh(recipe_id))
+        if change:
+            shopping_list.refresh_recipe(recipe_id)
 
 
 class FavoriteRecipeAdmin(admin.ModelAdmin):
@@ -42,6 +54,23 @@ class IngredientInRecipeAdmin(admin.ModelAdmin):
     list_display = ['recipe', 'ingredient', 'amount']
     list_filter = ('recipe', 'ingredient')
 
+    def refresh_shopping_lists(self, recipe_ids):
+        for recipe_id in set(recipe_ids) - {None}:
+            shopping_list.refresh_recipe(recipe_id)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.refresh_shopping_lists([obj.recipe_id, form.initial.get('recipe')])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.refresh_shopping_lists([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = list(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self.refresh_shopping_lists(recipe_ids)
+
 
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Tag, TagAdmin)
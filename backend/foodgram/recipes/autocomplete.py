@@ -0,0 +1,80 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from foodgram.db_router import primary
+
+from .models import Ingredient
+
+WORD_START = re.compile(r'(?<=[^\w])\w')
+
+
+def normalize(value):
+    return value.casefold().replace('ё', 'е').strip()
+
+
+class IngredientIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._built_at = 0
+
+    def invalidate(self):
+        self._state = None
+
+    def build(self):
+        with primary():
+            entries = list(Ingredient.objects.order_by(
+                'name', 'measurement_unit'
+            ).values('id', 'name', 'measurement_unit'))
+        names = []
+        words = []
+        for position, entry in enumerate(entries):
+            name = normalize(entry['name'])
+            names.append((name, position))
+            for match in WORD_START.finditer(name):
+                words.append((name[match.start():], position))
+        names.sort()
+        words.sort()
+        return entries, names, words
+
+    def get_state(self):
+        state = self._state
+        age = time.monotonic() - self._built_at
+        if state is not None and age < settings.INGREDIENT_INDEX_TTL:
+            return state
+        with self._lock:
+            if self._state is state:
+                self._state = self.build()
+                self._built_at = time.monotonic()
+            return self._state
+
+    @staticmethod
+    def scan(keys, prefix, found, limit):
+        position = bisect_left(keys, (prefix,))
+        hits = []
+        while position < len(keys) and len(found) < limit:
+            if not keys[position][0].startswith(prefix):
+                break
+            entry = keys[position][1]
+            if entry not in found:
+                found.add(entry)
+                hits.append(entry)
+            position += 1
+        return hits
+
+    def search(self, query, limit):
+        prefix = normalize(query)
+        entries, names, words = self.get_state()
+        if not prefix:
+            return entries[:limit]
+        found = set()
+        prefix_hits = self.scan(names, prefix, found, limit)
+        substring_hits = sorted(self.scan(words, prefix, found, limit))
+        return [entries[i] for i in prefix_hits + substring_hits]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,449 @@
+import csv
+import json
+import random
+import statistics
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import counters, shopping_list
+from .models import (
+    Ingredient,
+    Tag,
+    Recipe,
+    IngredientInRecipe,
+    FavoriteRecipe,
+    ShoppingCart,
+    Subscribe
+)
+
+User = get_user_model()
+
+INGREDIENTS_CSV = Path(settings.BASE_DIR).parent.parent / 'data' / 'ingredients.csv'
+BASELINE_PATH = Path(settings.BASE_DIR) / 'benchmark_baseline.json'
+BATCH_SIZE = 1000
+PASSWORD = 'benchmark-password'
+IMAGE = (
+    'data:image/png;base64,'
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg=='
+)
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F5B041', 'dessert'),
+)
+
+
+@dataclass
+class Dataset:
+    users: int = 2000
+    recipes: int = 20000
+    ingredients_per_recipe: int = 8
+    favorites_per_user: int = 5
+    carts_per_user: int = 3
+    subscriptions_per_user: int = 5
+    seed: int = 1994
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{key: data[key] for key in cls.__dataclass_fields__
+                      if key in data})
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__dataclass_fields__}
+
+
+@dataclass
+class Measurement:
+    name: str
+    status_codes: set = field(default_factory=set)
+    queries: list = field(default_factory=list)
+    times: list = field(default_factory=list)
+    sizes: list = field(default_factory=list)
+
+    def as_dict(self):
+        return {
+            'queries': max(self.queries),
+            'time_ms': round(statistics.median(self.times), 2),
+            'bytes': max(self.sizes),
+        }
+
+
+def read_ingredients(path=INGREDIENTS_CSV):
+    if not Path(path).exists():
+        return [(f'ингредиент {i}', 'г') for i in range(2000)]
+    with open(path, encoding='utf-8') as csv_file:
+        return [tuple(row) for row in csv.reader(csv_file) if len(row) == 2]
+
+
+def chunked_create(model, objects):
+    model.objects.bulk_create(objects, batch_size=BATCH_SIZE,
+                              ignore_conflicts=True)
+
+
+@transaction.atomic
+def seed(dataset, stdout=None):
+    rnd = random.Random(dataset.seed)
+    password = make_password(PASSWORD)
+
+    chunked_create(Ingredient, [
+        Ingredient(name=name, measurement_unit=unit)
+        for name, unit in read_ingredients()
+    ])
+    ingredient_ids = list(Ingredient.objects.order_by('id').values_list(
+        'id', flat=True
+    ))
+    for name, color, slug in TAGS:
+        Tag.objects.get_or_create(name=name, color=color, slug=slug)
+    tag_ids = list(Tag.objects.order_by('id').values_list(
+        'id', flat=True
+    ))
+
+    chunked_create(User, [
+        User(
+            username=f'user{i}',
+            email=f'user{i}@foodgram.ru',
+            first_name='Имя',
+            last_name='Фамилия',
+            password=password
+        )
+        for i in range(dataset.users)
+    ])
+    user_ids = list(User.objects.order_by('id').values_list(
+        'id', flat=True
+    ))
+    author_ids = user_ids[:max(1, len(user_ids) // 10)]
+
+    chunked_create(Recipe, [
+        Recipe(
+            author_id=rnd.choice(author_ids),
+            name=f'Рецепт {i}',
+            text='Нарезать, смешать, подать к столу. ' * rnd.randint(1, 20),
+            cooking_time=rnd.randint(1, 180),
+            image='recipe.png'
+        )
+        for i in range(dataset.recipes)
+    ])
+    recipe_ids = list(Recipe.objects.order_by('id').values_list(
+        'id', flat=True
+    ))
+
+    through = Recipe.tags.through
+    chunked_create(through, [
+        through(recipe_id=recipe_id, tag_id=tag_id)
+        for recipe_id in recipe_ids
+        for tag_id in rnd.sample(tag_ids, rnd.randint(1, 2))
+    ])
+    per_recipe = min(dataset.ingredients_per_recipe, len(ingredient_ids))
+    chunked_create(IngredientInRecipe, [
+        IngredientInRecipe(
+            recipe_id=recipe_id,
+            ingredient_id=ingredient_id,
+            amount=rnd.randint(1, 500)
+        )
+        for recipe_id in recipe_ids
+        for ingredient_id in rnd.sample(ingredient_ids, per_recipe)
+    ])
+
+    for model, per_user in (
+        (FavoriteRecipe, dataset.favorites_per_user),
+        (ShoppingCart, dataset.carts_per_user),
+    ):
+        chunked_create(model, [
+            model(user_id=user_id, recipe_id=recipe_id)
+            for user_id in user_ids
+            for recipe_id in rnd.sample(recipe_ids,
+                                        min(per_user, len(recipe_ids)))
+        ])
+    chunked_create(Subscribe, [
+        Subscribe(user_id=user_id, author_id=author_id)
+        for user_id in user_ids
+        for author_id in rnd.sample(
+            author_ids,
+            min(dataset.subscriptions_per_user, len(author_ids))
+        )
+        if user_id != author_id
+    ])
+    counters.rebuild()
+    shopping_list.rebuild()
+    if stdout is not None:
+        stdout.write(
+            f'Seeded {len(user_ids)} users, {len(recipe_ids)} recipes, '
+            f'{len(ingredient_ids)} ingredients'
+        )
+
+
+class Scenario:
+    def __init__(self):
+        self.user = User.objects.order_by('id').first()
+        self.other = User.objects.exclude(
+            pk=self.user.pk
+        ).exclude(
+            following__user=self.user
+        ).order_by('id').first()
+        self.recipe = Recipe.objects.exclude(
+            favorited_recipe__user=self.user
+        ).exclude(
+            recipe_in_shopping_cart__user=self.user
+        ).order_by('id').first()
+        self.batch = {'recipes': list(Recipe.objects.exclude(
+            favorited_recipe__user=self.user
+        ).exclude(
+            recipe_in_shopping_cart__user=self.user
+        ).order_by('id').values_list('id', flat=True)[:20])}
+        self.ingredient = Ingredient.objects.order_by('id').first()
+        self.tag = Tag.objects.order_by('id').first()
+        self.client = APIClient()
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.anonymous = APIClient()
+        self.ingredient_ids = list(Ingredient.objects.order_by(
+            'id'
+        ).values_list('id', flat=True)[:10])
+        self.pantry_ids = list(IngredientInRecipe.objects.filter(
+            recipe=self.recipe
+        ).order_by('ingredient_id').values_list('ingredient_id', flat=True))
+        self.created_recipe_id = None
+        self.job_id = None
+        self.counter = 0
+
+    def recipe_payload(self):
+        return {
+            'name': 'Рецепт для замеров',
+            'text': 'Описание',
+            'cooking_time': 15,
+            'image': IMAGE,
+            'tags': [self.tag.id],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10}
+                for ingredient_id in self.ingredient_ids
+            ],
+        }
+
+    def steps(self):
+        prefix = self.ingredient.name[:2]
+        return [
+            ('ingredients-list', lambda: self.anonymous.get(
+                '/api/ingredients/', {'name': prefix})),
+            ('ingredients-detail', lambda: self.anonymous.get(
+                f'/api/ingredients/{self.ingredient.id}/')),
+            ('tags-list', lambda: self.anonymous.get('/api/tags/')),
+            ('tags-detail', lambda: self.anonymous.get(
+                f'/api/tags/{self.tag.id}/')),
+            ('recipes-list', lambda: self.client.get(
+                '/api/recipes/', {'limit': 6})),
+            ('recipes-list-anonymous', lambda: self.anonymous.get(
+                '/api/recipes/', {'limit': 6})),
+            ('recipes-list-filtered', lambda: self.client.get(
+                '/api/recipes/',
+                {'tags': self.tag.slug, 'is_favorited': 1, 'limit': 6})),
+            ('recipes-list-all-tags', lambda: self.anonymous.get(
+                '/api/recipes/',
+                {'tags': ['breakfast', 'lunch'], 'tags_mode': 'all',
+                 'limit': 6})),
+            ('recipes-search', lambda: self.client.get(
+                '/api/recipes/',
+                {'search': self.ingredient.name, 'limit': 6})),
+            ('recipes-what-to-cook', lambda: self.client.get(
+                '/api/recipes/what_to_cook/',
+                {'ingredients': ','.join(map(str, self.pantry_ids))})),
+            ('recipes-detail', lambda: self.client.get(
+                f'/api/recipes/{self.recipe.id}/')),
+            ('recipes-create', self.create_recipe),
+            ('recipes-update', lambda: self.client.patch(
+                f'/api/recipes/{self.created_recipe_id}/',
+                self.recipe_payload(), format='json')),
+            ('recipes-delete', lambda: self.client.delete(
+                f'/api/recipes/{self.created_recipe_id}/')),
+            ('favorite-add', lambda: self.client.get(
+                f'/api/recipes/{self.recipe.id}/favorite/')),
+            ('favorite-remove', lambda: self.client.delete(
+                f'/api/recipes/{self.recipe.id}/favorite/')),
+            ('shopping-cart-add', lambda: self.client.get(
+                f'/api/recipes/{self.recipe.id}/shopping_cart/')),
+            ('shopping-list', lambda: self.client.get(
+                '/api/recipes/shopping_cart/')),
+            ('shopping-cart-remove', lambda: self.client.delete(
+                f'/api/recipes/{self.recipe.id}/shopping_cart/')),
+            ('favorite-batch-add', lambda: self.client.post(
+                '/api/recipes/favorite/batch/', self.batch, format='json')),
+            ('favorite-batch-remove', lambda: self.client.delete(
+                '/api/recipes/favorite/batch/', self.batch, format='json')),
+            ('shopping-cart-batch-add', lambda: self.client.post(
+                '/api/recipes/shopping_cart/batch/', self.batch,
+                format='json')),
+            ('shopping-cart-batch-remove', lambda: self.client.delete(
+                '/api/recipes/shopping_cart/batch/', self.batch,
+                format='json')),
+            ('download-shopping-cart', lambda: self.client.get(
+                '/api/recipes/download_shopping_cart/')),
+            ('shopping-cart-export', self.export_shopping_cart),
+            ('job-detail', lambda: self.client.get(
+                f'/api/jobs/{self.job_id}/')),
+            ('subscriptions', lambda: self.client.get(
+                '/api/users/subscriptions/', {'recipes_limit': 3})),
+            ('subscribe', lambda: self.client.get(
+                f'/api/users/{self.other.id}/subscribe/')),
+            ('unsubscribe', lambda: self.client.delete(
+                f'/api/users/{self.other.id}/subscribe/')),
+            ('users-list', lambda: self.client.get(
+                '/api/users/', {'limit': 6})),
+            ('users-detail', lambda: self.client.get(
+                f'/api/users/{self.other.id}/')),
+            ('users-me', lambda: self.client.get('/api/users/me/')),
+            ('users-create', self.create_user),
+            ('token-login', self.login),
+            ('token-logout', self.logout),
+        ]
+
+    def create_recipe(self):
+        response = self.client.post('/api/recipes/', self.recipe_payload(),
+                                    format='json')
+        self.created_recipe_id = response.data.get('id')
+        return response
+
+    def export_shopping_cart(self):
+        response = self.client.post(
+            '/api/recipes/download_shopping_cart/export/',
+            {'format': 'csv'}
+        )
+        self.job_id = response.data.get('id')
+        return response
+
+    def create_user(self):
+        self.counter += 1
+        return self.anonymous.post('/api/users/', {
+            'username': f'benchmark{self.counter}',
+            'email': f'benchmark{self.counter}@foodgram.ru',
+            'first_name': 'Имя',
+            'last_name': 'Фамилия',
+            'password': PASSWORD,
+        })
+
+    def login(self):
+        response = self.anonymous.post('/api/auth/token/login/', {
+            'email': self.other.email,
+            'password': PASSWORD,
+        })
+        self.other_token = response.data.get('auth_token')
+        return response
+
+    def logout(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.other_token}')
+        return client.post('/api/auth/token/logout/')
+
+
+def access_paths():
+    user = User.objects.order_by('id').first()
+    authors = list(User.objects.filter(
+        following__user=user
+    ).values_list('id', flat=True))
+    page = list(Recipe.objects.order_by('pub_date', 'id').values_list(
+        'id', flat=True
+    )[:6])
+    tag_ids = list(Tag.objects.filter(
+        slug__in=['breakfast', 'lunch']
+    ).values_list('id', flat=True))
+    recipes = Recipe.objects.order_by('pub_date', 'id')
+    return (
+        ('recipes-by-any-tag',
+         recipes.with_tags(tag_ids)[:6]),
+        ('recipes-by-all-tags',
+         recipes.with_tags(tag_ids, match_all=True)[:6]),
+        ('recipes-by-author',
+         recipes.filter(author=authors[0])[:6]),
+        ('recipes-favorited',
+         recipes.filter(favorited_recipe__user=user)[:6]),
+        ('recipes-in-shopping-cart',
+         recipes.filter(recipe_in_shopping_cart__user=user)[:6]),
+        ('recipes-user-flags',
+         Recipe.objects.for_fragments(user).filter(pk__in=page)),
+        ('recipe-ingredients',
+         IngredientInRecipe.objects.filter(recipe__in=page)),
+        ('latest-by-authors',
+         Recipe.objects.filter(author__in=authors).order_by(
+             '-pub_date', '-id'
+         )[:10]),
+        ('subscriptions',
+         User.objects.filter(following__user=user).order_by('id')[:6]),
+    )
+
+
+def response_size(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def run(repeat=5):
+    scenario = Scenario()
+    measurements = {}
+    for _ in range(repeat):
+        for name, request in scenario.steps():
+            measurement = measurements.setdefault(name, Measurement(name))
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = request()
+                size = response_size(response)
+                elapsed = time.perf_counter() - start
+            measurement.status_codes.add(response.status_code)
+            measurement.queries.append(len(queries))
+            measurement.times.append(elapsed * 1000)
+            measurement.sizes.append(size)
+    return measurements
+
+
+def compare(results, baseline, time_tolerance=1.5, size_tolerance=0.1,
+            time_slack_ms=5):
+    failures = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            failures.append(
+                f'{name}: {result["queries"]} queries, '
+                f'baseline {expected["queries"]}'
+            )
+        time_limit = expected['time_ms'] * time_tolerance + time_slack_ms
+        if result['time_ms'] > time_limit:
+            failures.append(
+                f'{name}: {result["time_ms"]} ms, '
+                f'baseline {expected["time_ms"]} ms'
+            )
+        if result['bytes'] > expected['bytes'] * (1 + size_tolerance):
+            failures.append(
+                f'{name}: {result["bytes"]} bytes, '
+                f'baseline {expected["bytes"]} bytes'
+            )
+    return failures
+
+
+def load_baseline(path=BASELINE_PATH):
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, encoding='utf-8') as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(dataset, results, path=BASELINE_PATH):
+    with open(path, 'w', encoding='utf-8') as baseline_file:
+        json.dump(
+            {'dataset': dataset.as_dict(), 'endpoints': results},
+            baseline_file,
+            ensure_ascii=False,
+            indent=2,
+            sort_keys=True
+        )
+        baseline_file.write('\n')
@@ -0,0 +1,104 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from foodgram.db_router import primary
+
+STATS_KEYS = {
+    'hits': 'catalogue:stats:hits',
+    'misses': 'catalogue:stats:misses',
+}
+
+
+def get_cache():
+    return caches[settings.CATALOGUE_CACHE_ALIAS]
+
+
+def version_key(model):
+    return f'catalogue:{model._meta.label_lower}:version'
+
+
+def get_version(model):
+    cache = get_cache()
+    version = cache.get(version_key(model))
+    if version is None:
+        version = invalidate(model)
+    return version
+
+
+def invalidate(model):
+    version = {'token': uuid.uuid4().hex, 'modified': int(time.time())}
+    get_cache().set(version_key(model), version, None)
+    return version
+
+
+def entry_key(model, version, request):
+    path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+    return f'catalogue:{model._meta.label_lower}:{version["token"]}:{path}'
+
+
+def count(name):
+    cache = get_cache()
+    key = STATS_KEYS[name]
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def stats():
+    values = get_cache().get_many(STATS_KEYS.values())
+    return {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
+
+
+class CatalogueCacheMixin:
+    def list(self, request, *args, **kwargs):
+        return self.cached(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(request, super().retrieve, *args, **kwargs)
+
+    def cached(self, request, view, *args, **kwargs):
+        model = self.queryset.model
+        version = get_version(model)
+        key = entry_key(model, version, request)
+        cache = get_cache()
+        entry = cache.get(key)
+        if entry is None:
+            count('misses')
+            with primary():
+                response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = JSONRenderer().render(response.data)
+            entry = {
+                'content': content,
+                'etag': quote_etag(hashlib.sha1(content).hexdigest()),
+                'modified': version['modified'],
+            }
+            cache.set(key, entry, settings.CATALOGUE_CACHE_TIMEOUT)
+            status = 'MISS'
+        else:
+            count('hits')
+            status = 'HIT'
+        response = get_conditional_response(
+            request,
+            etag=entry['etag'],
+            last_modified=entry['modified']
+        )
+        if response is None:
+            response = HttpResponse(entry['content'],
+                                    content_type='application/json')
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(entry['modified'])
+        response['X-Cache'] = status
+        patch_cache_control(response, public=True,
+                            max_age=settings.CATALOGUE_CACHE_MAX_AGE)
+        return response
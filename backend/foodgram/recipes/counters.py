@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import FavoriteRecipe, Recipe, ShoppingCart, Subscribe
+
+User = get_user_model()
+
+COUNTERS = (
+    (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscribe, 'author'),
+)
+
+
+def adjust(model, pks, field, delta):
+    if not isinstance(pks, (list, tuple, set)):
+        pks = [pks]
+    return model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, Value(0))}
+    )
+
+
+def actual(source, relation):
+    return Coalesce(
+        Subquery(
+            source.objects.filter(**{relation: OuterRef('pk')}).order_by()
+            .values(relation).annotate(total=Count('pk')).values('total')
+        ),
+        Value(0)
+    )
+
+
+def rebuild(dry_run=False):
+    drift = {}
+    for model, field, source, relation in COUNTERS:
+        stale = model.objects.annotate(
+            actual=actual(source, relation)
+        ).filter(~Q(**{field: F('actual')}))
+        drift[f'{model._meta.label}.{field}'] = stale.count()
+        if not dry_run:
+            model.objects.update(**{field: actual(source, relation)})
+    return drift
@@ -0,0 +1,28 @@
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
+
+TASK = 'recipes.export_shopping_list'
+
+
+# Exports are kept outside MEDIA_ROOT, which nginx serves publicly, and
+# are only handed out by ShoppingListExportFileView to the job's owner.
+def get_storage():
+    return FileSystemStorage(location=settings.EXPORTS_ROOT)
+
+
+def save(content, export_format):
+    name = get_storage().save(
+        f'wishlist-{uuid.uuid4().hex}.{export_format}', ContentFile(content)
+    )
+    return {
+        'file': name,
+        'url': reverse('export_shopping_cart_file', args=[name]),
+    }
+
+
+def delete(name):
+    get_storage().delete(name)
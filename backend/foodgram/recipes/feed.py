@@ -0,0 +1,119 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef, Q
+
+from .models import FeedEntry, Recipe, Subscribe
+from .pagination import keyset_filter
+
+User = get_user_model()
+
+ORDERING = ('-pub_date', '-id')
+ENTRY_ORDERING = ('-pub_date', '-recipe_id')
+
+
+def is_popular(author):
+    return author.followers_count > settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def write(entries):
+    FeedEntry.objects.bulk_create([
+        FeedEntry(user_id=user_id, recipe_id=recipe_id, author_id=author_id,
+                  pub_date=pub_date)
+        for user_id, recipe_id, author_id, pub_date in entries
+    ], batch_size=settings.FEED_BATCH_SIZE, ignore_conflicts=True)
+
+
+# Recipes of authors with more than FEED_FANOUT_MAX_FOLLOWERS followers are
+# not copied into timelines; page() reads them straight from Recipe.
+def fan_out(recipe_ids):
+    recipes = defaultdict(list)
+    for recipe_id, author_id, pub_date in Recipe.objects.filter(
+        pk__in=recipe_ids,
+        author__followers_count__gt=0,
+        author__followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).values_list('id', 'author_id', 'pub_date'):
+        recipes[author_id].append((recipe_id, pub_date))
+    followers = Subscribe.objects.filter(
+        author_id__in=recipes
+    ).values_list('user_id', 'author_id')
+    entries = [
+        (user_id, recipe_id, author_id, pub_date)
+        for user_id, author_id in followers.iterator()
+        for recipe_id, pub_date in recipes[author_id]
+    ]
+    write(entries)
+    return len(entries)
+
+
+def latest(author_id):
+    return Recipe.objects.filter(author_id=author_id).order_by(
+        *ORDERING
+    ).values_list('id', 'pub_date')[:settings.FEED_BACKFILL_SIZE]
+
+
+def backfill(user_id, author):
+    if not is_popular(author):
+        write([
+            (user_id, recipe_id, author.id, pub_date)
+            for recipe_id, pub_date in latest(author.id)
+        ])
+
+
+def prune(user_id, author_id):
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild():
+    subscribed = Exists(Subscribe.objects.filter(
+        user=OuterRef('user'), author=OuterRef('author')
+    ))
+    popular = Q(
+        author__followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+    )
+    FeedEntry.objects.filter(~subscribed | popular).delete()
+    authors = User.objects.filter(
+        followers_count__gt=0,
+        followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).values_list('id', flat=True)
+    for author_id in authors.iterator():
+        recipes = list(latest(author_id))
+        write([
+            (user_id, recipe_id, author_id, pub_date)
+            for user_id in Subscribe.objects.filter(
+                author_id=author_id
+            ).values_list('user_id', flat=True)
+            for recipe_id, pub_date in recipes
+        ])
+    return FeedEntry.objects.count()
+
+
+def page(user, position, size):
+    entries = FeedEntry.objects.filter(user=user)
+    pulled = Recipe.objects.filter(
+        author__following__user=user,
+        author__followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+    )
+    if position is not None:
+        entries = entries.filter(keyset_filter(ENTRY_ORDERING, position))
+        pulled = pulled.filter(keyset_filter(ORDERING, position))
+    rows = {
+        recipe_id: pub_date
+        for recipe_id, pub_date in entries.order_by(
+            *ENTRY_ORDERING
+        ).values_list('recipe_id', 'pub_date')[:size + 1]
+    }
+    rows.update(pulled.order_by(*ORDERING).values_list(
+        'id', 'pub_date'
+    )[:size + 1])
+    ordered = sorted(
+        ((pub_date, recipe_id) for recipe_id, pub_date in rows.items()),
+        reverse=True
+    )
+    next_position = None
+    if len(ordered) > size:
+        next_position = list(ordered[size - 1])
+    ordered = [recipe_id for _, recipe_id in ordered[:size]]
+    recipes = Recipe.objects.for_fragments(user).in_bulk(ordered)
+    return [recipes[pk] for pk in ordered if pk in recipes], next_position
@@ -1,12 +1,24 @@
 from django_filters import rest_framework as filters
+from . import search
 from .models import Recipe, Tag
 
 
+TAGS_MODES = (
+    ('any', 'Любой из тегов'),
+    ('all', 'Все теги'),
+)
+
+
 class CustomFilter(filters.FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         queryset=Tag.objects.all(),
-        to_field_name='slug'
+        to_field_name='slug',
+        method='get_tags'
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=TAGS_MODES,
+        method='get_tags_mode'
     )
     is_favorited = filters.BooleanFilter(
         method='get_favorite'
@@ -14,15 +26,32 @@ class CustomFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_shopping_cart'
     )
+    search = filters.CharFilter(
+        method='get_search'
+    )
 
     class Meta:
         model = Recipe
         fields = ('tags',
                   'author',
                   'is_favorited',
-                  'is_in_shopping_cart'
+                  'is_in_shopping_cart',
+                  'search',
+                  'tags_mode'
                   )
 
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.with_tags(
+            [tag.id for tag in value],
+            match_all=self.form.cleaned_data.get('tags_mode') == 'all'
+        )
+
+    # Applied together with tags in get_tags.
+    def get_tags_mode(self, queryset, name, value):
+        return queryset
+
     def get_favorite(self, queryset, name, value):
         if value:
             return queryset.filter(
@@ -40,3 +69,6 @@ class CustomFilter(filters.FilterSet):
         return queryset.exclude(
             recipe_in_shopping_cart__user=self.request.user
         )
+
+    def get_search(self, queryset, name, value):
+        return search.search(queryset, value)
@@ -0,0 +1,128 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Prefetch
+
+from foodgram.db_router import primary
+
+from .models import IngredientInRecipe, Recipe
+from .serializers import RecipeSerializer
+
+VERSION_KEY = 'recipe:fragment:version'
+
+
+def get_cache():
+    return caches[settings.RECIPE_CACHE_ALIAS]
+
+
+def get_version():
+    version = get_cache().get(VERSION_KEY)
+    if version is None:
+        version = rotate()
+    return version
+
+
+def rotate():
+    version = uuid.uuid4().hex
+    get_cache().set(VERSION_KEY, version, None)
+    return version
+
+
+# Rotated again after commit for the same reason as invalidate() below.
+def invalidate_all():
+    version = rotate()
+    transaction.on_commit(rotate)
+    return version
+
+
+def fragment_key(version, recipe_id):
+    return f'recipe:fragment:{version}:{recipe_id}'
+
+
+def delete(recipe_ids):
+    version = get_version()
+    get_cache().delete_many(
+        [fragment_key(version, recipe_id) for recipe_id in recipe_ids]
+    )
+
+
+# Dropped right away and once more after commit, so a reader that cached the
+# old rows while the transaction was open does not keep them.
+def invalidate(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        delete(recipe_ids)
+        transaction.on_commit(lambda: delete(recipe_ids))
+
+
+def build(recipe_ids):
+    recipes = Recipe.objects.filter(pk__in=recipe_ids).select_related(
+        'author'
+    ).defer('search_vector').prefetch_related(
+        'tags',
+        Prefetch(
+            'recipe',
+            queryset=IngredientInRecipe.objects.select_related('ingredient')
+        )
+    )
+    fragments = {}
+    with primary():
+        recipes = list(recipes)
+    for recipe in recipes:
+        recipe.is_favorited = False
+        recipe.is_in_shopping_cart = False
+        recipe.author_is_subscribed = False
+        fragments[recipe.pk] = RecipeSerializer(
+            recipe, context={'request': None}
+        ).data
+    return fragments
+
+
+def get_many(recipe_ids):
+    version = get_version()
+    keys = {fragment_key(version, pk): pk for pk in recipe_ids}
+    cache = get_cache()
+    fragments = {
+        keys[key]: fragment for key, fragment in cache.get_many(keys).items()
+    }
+    missing = [pk for pk in recipe_ids if pk not in fragments]
+    if missing:
+        built = build(missing)
+        cache.set_many(
+            {fragment_key(version, pk): dict(data)
+             for pk, data in built.items()},
+            settings.RECIPE_CACHE_TIMEOUT
+        )
+        fragments.update(built)
+    return fragments
+
+
+def absolute(request, url):
+    if url and request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def render(recipe, fragment, request):
+    data = dict(fragment)
+    data['author'] = dict(data['author'])
+    data['author']['is_subscribed'] = recipe.author_is_subscribed
+    data['is_favorited'] = recipe.is_favorited
+    data['is_in_shopping_cart'] = recipe.is_in_shopping_cart
+    data['favorites_count'] = recipe.favorites_count
+    data['image'] = absolute(request, data['image'])
+    data['image_srcset'] = {
+        width: absolute(request, url)
+        for width, url in data['image_srcset'].items()
+    }
+    return data
+
+
+def serialize(recipes, request):
+    fragments = get_many([recipe.pk for recipe in recipes])
+    return [
+        render(recipe, fragments[recipe.pk], request)
+        for recipe in recipes if recipe.pk in fragments
+    ]
@@ -0,0 +1,83 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def get_cache():
+    return caches[settings.IDEMPOTENCY_CACHE_ALIAS]
+
+
+def entry_key(request, key):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f'idempotency:{request.user.pk}:{digest}'
+
+
+def fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(
+        f'{request.method}:{request.path}:{payload}'.encode()
+    ).hexdigest()
+
+
+def replay(entry, digest):
+    if entry['fingerprint'] != digest:
+        return Response(
+            {'errors': f'{HEADER} уже использован для другого запроса'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if entry['status'] is None:
+        return Response(
+            {'errors': f'Запрос с этим {HEADER} ещё выполняется'},
+            status=status.HTTP_409_CONFLICT
+        )
+    return Response(
+        entry['data'],
+        status=entry['status'],
+        headers={'Idempotent-Replayed': 'true'}
+    )
+
+
+def idempotent(method):
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return method(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'errors': f'{HEADER} длиннее {MAX_KEY_LENGTH} символов'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        cache = get_cache()
+        cache_key = entry_key(request, key)
+        digest = fingerprint(request)
+        timeout = settings.IDEMPOTENCY_KEY_TIMEOUT
+        pending = {'fingerprint': digest, 'status': None, 'data': None}
+        if not cache.add(cache_key, pending, timeout):
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return replay(entry, digest)
+            cache.set(cache_key, pending, timeout)
+        try:
+            response = method(view, request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500:
+            cache.delete(cache_key)
+        else:
+            cache.set(cache_key, {
+                'fingerprint': digest,
+                'status': response.status_code,
+                'data': response.data,
+            }, timeout)
+        return response
+    return wrapper
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+from jobs.queue import enqueue
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def get_storage():
+    return Recipe._meta.get_field('image').storage
+
+
+def output_format():
+    image_format = settings.RECIPE_IMAGE_FORMAT.upper()
+    if image_format == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return image_format
+
+
+def dimensions(file):
+    position = file.tell()
+    try:
+        with Image.open(file) as image:
+            return image.size
+    finally:
+        file.seek(position)
+
+
+def encode(image, image_format):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, 'white')
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background.paste(image, mask=image.getchannel('A'))
+        else:
+            background.paste(image.convert('RGB'))
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=settings.RECIPE_IMAGE_QUALITY)
+    return buffer.getvalue()
+
+
+def store(data, image_format):
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    name = f'{digest}.{EXTENSIONS[image_format]}'
+    storage = get_storage()
+    if not storage.exists(name):
+        storage.save(name, ContentFile(data))
+    return name
+
+
+def resize(image, width):
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def process(recipe_id):
+    recipe = Recipe.objects.filter(pk=recipe_id).only('image').first()
+    if recipe is None or not recipe.image:
+        return None
+    original = recipe.image.name
+    storage = get_storage()
+    try:
+        with storage.open(original) as source:
+            image = Image.open(source)
+            image.load()
+    except (OSError, Image.DecompressionBombError) as error:
+        logger.warning('Не удалось обработать %s: %s', original, error)
+        return None
+
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail(
+        (settings.RECIPE_IMAGE_MAX_SIZE, settings.RECIPE_IMAGE_MAX_SIZE),
+        Image.LANCZOS
+    )
+    image_format = output_format()
+    name = store(encode(image, image_format), image_format)
+    thumbnails = {str(image.width): name}
+    for width in settings.RECIPE_THUMBNAIL_WIDTHS:
+        if width < image.width:
+            thumbnails[str(width)] = store(
+                encode(resize(image, width), image_format),
+                image_format
+            )
+
+    updated = Recipe.objects.filter(pk=recipe_id, image=original).update(
+        image=name,
+        thumbnails=thumbnails
+    )
+    if updated and original != name:
+        if not Recipe.objects.filter(image=original).exists():
+            storage.delete(original)
+    return thumbnails
+
+
+def delete_files(names):
+    storage = get_storage()
+    referenced = set()
+    for image, thumbnails in Recipe.objects.filter(
+        image__in=names
+    ).values_list('image', 'thumbnails'):
+        referenced.add(image)
+        referenced.update(thumbnails.values())
+    for name in set(names) - referenced:
+        storage.delete(name)
+
+
+def schedule(recipe_id):
+    enqueue('recipes.process_image', [recipe_id])
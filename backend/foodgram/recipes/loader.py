@@ -0,0 +1,533 @@
+import base64
+import binascii
+import csv
+import hashlib
+import io
+import json
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Q
+from PIL import Image
+
+from . import cache as catalogue_cache
+from . import counters, feed, fragments, images, search
+from .autocomplete import ingredient_index
+from .models import Ingredient, IngredientInRecipe, Recipe, Tag
+from .pantry import pantry_index
+
+User = get_user_model()
+
+FORMATS = ('csv', 'json', 'jsonl')
+CHUNK_SIZE = 1000
+READ_SIZE = 1 << 16
+INSERT_BATCH_SIZE = 2000
+MAX_NAME_LENGTH = 200
+COLOR = re.compile(r'^#(?:[0-9A-Fa-f]{3}){1,2}$')
+
+
+@dataclass
+class Report:
+    read: int = 0
+    created: int = 0
+    updated: int = 0
+    skipped: int = 0
+    errors: list = field(default_factory=list)
+    seconds: float = 0.0
+    images: int = 0
+
+    @property
+    def rate(self):
+        return round(self.read / self.seconds) if self.seconds else 0
+
+
+def detect_format(path):
+    suffix = Path(path).suffix.lstrip('.').lower()
+    if suffix == 'ndjson':
+        return 'jsonl'
+    return suffix if suffix in FORMATS else None
+
+
+def iter_csv(file, fields):
+    for row in csv.reader(file):
+        if not row or [value.strip() for value in row] == list(fields):
+            continue
+        yield dict(zip(fields, row))
+
+
+def iter_json(file):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if not started and position < len(buffer):
+            if buffer[position] != '[':
+                raise ValueError('Ожидался JSON-массив')
+            started = True
+            position += 1
+            continue
+        if started and buffer[position:position + 1] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = file.read(READ_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield value
+        position = end
+
+
+def iter_jsonl(file):
+    for line in file:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_records(path, data_format, fields):
+    with open(path, encoding='utf-8', newline='') as file:
+        if data_format == 'csv':
+            yield from iter_csv(file, fields)
+        elif data_format == 'json':
+            yield from iter_json(file)
+        else:
+            yield from iter_jsonl(file)
+
+
+def first(record, *keys):
+    for key in keys:
+        if record.get(key) not in (None, ''):
+            return record[key]
+    return None
+
+
+def clean_name(value, label):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f'Не заполнено поле {label}')
+    value = value.strip()
+    if len(value) > MAX_NAME_LENGTH:
+        raise ValueError(f'Поле {label} длиннее {MAX_NAME_LENGTH} символов')
+    return value
+
+
+def clean_positive(value, label):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Поле {label} должно быть целым числом')
+    if value < 1:
+        raise ValueError(f'Поле {label} должно быть больше 0')
+    return value
+
+
+def table_columns(model, fields):
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(model._meta.get_field(name).column) for name in fields
+    )
+    return quote(model._meta.db_table), columns
+
+
+# Link rows are plain integers, so they skip model instances and go out as
+# multi-row INSERTs: most of bulk_create's time here is spent building SQL.
+def insert_rows(model, fields, rows):
+    if not rows:
+        return
+    table, columns = table_columns(model, fields)
+    batch_size = min(INSERT_BATCH_SIZE, connection.ops.bulk_batch_size(
+        [model._meta.get_field(name) for name in fields], rows
+    ))
+    placeholder = f'({", ".join(["%s"] * len(fields))})'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES '
+                f'{", ".join([placeholder] * len(batch))}',
+                [value for row in batch for value in row]
+            )
+
+
+def copy_rows(model, fields, rows):
+    table, columns = table_columns(model, fields)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer
+        )
+
+
+class Loader:
+    fields = ()
+
+    def __init__(self, chunk_size=CHUNK_SIZE, use_copy=False, **options):
+        self.chunk_size = chunk_size
+        self.use_copy = use_copy
+        self.options = options
+
+    def run(self, records):
+        report = Report()
+        started = time.monotonic()
+        records = enumerate(records, start=1)
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                break
+            rows = []
+            for number, record in chunk:
+                report.read += 1
+                try:
+                    if not isinstance(record, dict):
+                        raise ValueError('Запись должна быть объектом')
+                    rows.append((number, self.clean(record)))
+                except ValueError as error:
+                    report.errors.append((number, str(error)))
+            if rows:
+                with transaction.atomic():
+                    self.write(rows, report)
+        self.finish(report)
+        report.seconds = time.monotonic() - started
+        return report
+
+    def clean(self, record):
+        raise NotImplementedError
+
+    def write(self, rows, report):
+        raise NotImplementedError
+
+    def finish(self, report):
+        pass
+
+
+class IngredientLoader(Loader):
+    fields = ('name', 'measurement_unit')
+
+    def clean(self, record):
+        return (
+            clean_name(first(record, 'name', 'title'), 'name'),
+            clean_name(first(record, 'measurement_unit', 'dimension'),
+                       'measurement_unit')
+        )
+
+    def write(self, rows, report):
+        keys = list(dict.fromkeys(key for _, key in rows))
+        report.skipped += len(rows) - len(keys)
+        if self.use_copy:
+            created = self.copy(keys)
+        else:
+            existing = set(Ingredient.objects.filter(
+                name__in={name for name, _ in keys}
+            ).values_list('name', 'measurement_unit'))
+            new = [key for key in keys if key not in existing]
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in new],
+                ignore_conflicts=True
+            )
+            created = len(new)
+        report.created += created
+        report.skipped += len(keys) - created
+
+    def copy(self, keys):
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(keys)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_import '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY ingredient_import FROM STDIN WITH (FORMAT csv)', buffer
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT name, measurement_unit FROM ingredient_import '
+                f'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            return cursor.rowcount
+
+    def finish(self, report):
+        if report.created:
+            ingredient_index.invalidate()
+            catalogue_cache.invalidate(Ingredient)
+
+
+class TagLoader(Loader):
+    fields = ('name', 'color', 'slug')
+
+    def clean(self, record):
+        color = first(record, 'color')
+        if color is not None and not COLOR.match(str(color)):
+            raise ValueError(f'{color} не является HEX-цветом')
+        slug = clean_name(first(record, 'slug'), 'slug')
+        if not re.match(r'^[-\w]+$', slug):
+            raise ValueError(f'{slug} не является слагом')
+        return {
+            'name': clean_name(first(record, 'name'), 'name'),
+            'color': color,
+            'slug': slug,
+        }
+
+    def write(self, rows, report):
+        data = {values['slug']: values for _, values in rows}
+        report.skipped += len(rows) - len(data)
+        existing = {}
+        for tag in Tag.objects.filter(slug__in=data).order_by('-id'):
+            existing[tag.slug] = tag
+        changed = []
+        for slug, values in data.items():
+            tag = existing.get(slug)
+            if tag is None:
+                continue
+            if (tag.name, tag.color) == (values['name'], values['color']):
+                report.skipped += 1
+                continue
+            tag.name = values['name']
+            tag.color = values['color']
+            changed.append(tag)
+        Tag.objects.bulk_update(changed, ['name', 'color'])
+        new = [Tag(**values) for slug, values in data.items()
+               if slug not in existing]
+        Tag.objects.bulk_create(new)
+        report.updated += len(changed)
+        report.created += len(new)
+
+    def finish(self, report):
+        if report.created or report.updated:
+            catalogue_cache.invalidate(Tag)
+        if report.updated:
+            fragments.invalidate_all()
+
+
+class RecipeLoader(Loader):
+    fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ingredients = {
+            (name, unit): pk for pk, name, unit in
+            Ingredient.objects.values_list('id', 'name', 'measurement_unit')
+        }
+        self.ingredient_ids = set(self.ingredients.values())
+        self.tags = {}
+        for pk, slug in Tag.objects.order_by('-id').values_list('id', 'slug'):
+            self.tags[slug] = pk
+        self.images_dir = Path(self.options.get('images_dir') or '.')
+        self.author = self.options.get('author')
+
+    def clean(self, record):
+        author = first(record, 'author') or self.author
+        if isinstance(author, dict):
+            author = first(author, 'username', 'email')
+        if not author:
+            raise ValueError('Не указан автор')
+        return {
+            'author': str(author),
+            'name': clean_name(first(record, 'name'), 'name'),
+            'text': self.clean_text(record.get('text')),
+            'cooking_time': clean_positive(record.get('cooking_time'),
+                                           'cooking_time'),
+            'tags': self.clean_tags(record.get('tags') or []),
+            'ingredients': self.clean_ingredients(
+                record.get('ingredients') or []
+            ),
+            'image': first(record, 'image'),
+        }
+
+    def clean_text(self, value):
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError('Не заполнено поле text')
+        return value.strip()
+
+    def clean_tags(self, values):
+        tag_ids = []
+        for value in values:
+            if isinstance(value, dict):
+                value = first(value, 'slug', 'id')
+            pk = self.tags.get(value)
+            if pk is None and value in self.tags.values():
+                pk = value
+            if pk is None:
+                raise ValueError(f'Тег {value} не найден')
+            tag_ids.append(pk)
+        return list(dict.fromkeys(tag_ids))
+
+    def clean_ingredients(self, values):
+        if not values:
+            raise ValueError('Нужен хотя бы один ингредиент')
+        amounts = {}
+        for value in values:
+            if not isinstance(value, dict):
+                raise ValueError('Ингредиент должен быть объектом')
+            pk = value.get('id')
+            if pk is None:
+                name = first(value, 'name', 'title') or ''
+                unit = first(value, 'measurement_unit', 'dimension') or ''
+                key = (str(name).strip(), str(unit).strip())
+                pk = self.ingredients.get(key)
+                if pk is None:
+                    raise ValueError(f'Ингредиент {", ".join(key)} не найден')
+            elif clean_positive(pk, 'id') not in self.ingredient_ids:
+                raise ValueError(f'Ингредиент {pk} не найден')
+            else:
+                pk = int(pk)
+            if pk in amounts:
+                raise ValueError('Ингредиенты не должны повторяться')
+            amounts[pk] = clean_positive(value.get('amount'), 'amount')
+        return amounts
+
+    def read_image(self, value):
+        if value.startswith('data:'):
+            try:
+                data = base64.b64decode(value.partition(';base64,')[2],
+                                        validate=True)
+            except binascii.Error:
+                raise ValueError('Изображение не является base64')
+        else:
+            path = self.images_dir / value
+            try:
+                data = path.read_bytes()
+            except OSError as error:
+                raise ValueError(f'Не удалось прочитать {path}: {error}')
+        if len(data) > settings.RECIPE_IMAGE_MAX_BYTES:
+            raise ValueError('Изображение слишком большое')
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image_format = image.format
+                width, height = image.size
+        except (OSError, Image.DecompressionBombError):
+            raise ValueError('Файл не является изображением')
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            raise ValueError('Изображение слишком большое')
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        name = f'{digest}.{image_format.lower()}'
+        storage = images.get_storage()
+        if not storage.exists(name):
+            storage.save(name, ContentFile(data))
+        return name
+
+    def resolve_authors(self, keys):
+        authors = {}
+        for pk, username, email in User.objects.filter(
+            Q(username__in=keys) | Q(email__in=keys)
+        ).values_list('id', 'username', 'email'):
+            authors[username] = authors[email] = pk
+        return authors
+
+    def create_recipes(self, recipes):
+        Recipe.objects.bulk_create(recipes)
+        if connection.features.can_return_rows_from_bulk_insert:
+            return
+        # Without RETURNING the ids are looked up by (author, name): write()
+        # only inserts pairs that did not exist, so each matches one new row
+        # unless another writer created the same recipe meanwhile.
+        ids = {}
+        for pk, author_id, name in Recipe.objects.filter(
+            author_id__in={recipe.author_id for recipe in recipes},
+            name__in={recipe.name for recipe in recipes}
+        ).values_list('id', 'author_id', 'name'):
+            ids.setdefault((author_id, name), []).append(pk)
+        for recipe in recipes:
+            found = ids.get((recipe.author_id, recipe.name), [])
+            if len(found) != 1:
+                raise ValueError(
+                    f'Рецепт {recipe.name} одновременно создан другим '
+                    f'процессом, повторите загрузку'
+                )
+            recipe.pk = found[0]
+
+    def write(self, rows, report):
+        authors = self.resolve_authors({data['author'] for _, data in rows})
+        existing = set(Recipe.objects.filter(
+            author_id__in=set(authors.values()),
+            name__in={data['name'] for _, data in rows}
+        ).values_list('author_id', 'name'))
+        pending = []
+        for number, data in rows:
+            author_id = authors.get(data['author'])
+            if author_id is None:
+                report.errors.append(
+                    (number, f'Автор {data["author"]} не найден')
+                )
+                continue
+            if (author_id, data['name']) in existing:
+                report.skipped += 1
+                continue
+            image = ''
+            if data['image']:
+                try:
+                    image = self.read_image(data['image'])
+                except ValueError as error:
+                    report.errors.append((number, str(error)))
+                    continue
+                report.images += 1
+            existing.add((author_id, data['name']))
+            pending.append((Recipe(
+                author_id=author_id,
+                name=data['name'],
+                text=data['text'],
+                cooking_time=data['cooking_time'],
+                image=image
+            ), data))
+        if not pending:
+            return
+        recipes = [recipe for recipe, _ in pending]
+        self.create_recipes(recipes)
+
+        amounts = [
+            (recipe.pk, ingredient_id, amount)
+            for recipe, data in pending
+            for ingredient_id, amount in data['ingredients'].items()
+        ]
+        tags = [
+            (recipe.pk, tag_id)
+            for recipe, data in pending for tag_id in data['tags']
+        ]
+        write_rows = copy_rows if self.use_copy else insert_rows
+        write_rows(IngredientInRecipe, ('recipe', 'ingredient', 'amount'),
+                   amounts)
+        write_rows(Recipe.tags.through, ('recipe', 'tag'), tags)
+
+        by_delta = {}
+        for author_id, delta in Counter(
+            recipe.author_id for recipe in recipes
+        ).items():
+            by_delta.setdefault(delta, []).append(author_id)
+        for delta, author_ids in by_delta.items():
+            counters.adjust(User, author_ids, 'recipes_count', delta)
+        search.update_vectors([recipe.pk for recipe in recipes])
+        feed.fan_out([recipe.pk for recipe in recipes])
+        report.created += len(recipes)
+
+    def finish(self, report):
+        if report.created:
+            pantry_index.invalidate()
+
+
+LOADERS = {
+    'ingredients': IngredientLoader,
+    'tags': TagLoader,
+    'recipes': RecipeLoader,
+}
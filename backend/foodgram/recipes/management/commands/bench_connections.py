@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+from foodgram.connections import check_connections
+from recipes.models import Tag
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время запроса с новым подключением к базе на '
+            'каждый запрос и с постоянным подключением')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--max-age', type=int, default=60)
+
+    def handle(self, *args, **options):
+        configured = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            for name, max_age in (('новое', 0),
+                                  ('постоянное', options['max_age'])):
+                elapsed, opened = self.run(max_age, options['requests'])
+                self.stdout.write(
+                    f'{name:<12}{elapsed * 1000 / options["requests"]:>8.3f}'
+                    f' мс/запрос{opened:>8} подключений'
+                )
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = configured
+            connection.close()
+
+    # Replays the request lifecycle Django runs around every view:
+    # close_old_connections on request_started/request_finished decides
+    # whether the connection survives to the next request.
+    def run(self, max_age, requests):
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        opened = []
+
+        def count(**kwargs):
+            opened.append(1)
+
+        connection_created.connect(count)
+        try:
+            start = time.perf_counter()
+            for _ in range(requests):
+                request_started.send(sender=self.__class__)
+                check_connections()
+                Tag.objects.filter(pk=0).exists()
+                request_finished.send(sender=self.__class__)
+            return time.perf_counter() - start, len(opened)
+        finally:
+            connection_created.disconnect(count)
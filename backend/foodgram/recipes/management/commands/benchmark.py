@@ -0,0 +1,103 @@
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    teardown_databases
+)
+
+from recipes import benchmark
+from recipes.models import Recipe
+
+DATASET_OPTIONS = (
+    'users',
+    'recipes',
+    'ingredients_per_recipe',
+    'favorites_per_user',
+    'carts_per_user',
+    'subscriptions_per_user',
+    'seed',
+)
+
+
+class Command(BaseCommand):
+    help = ('Заполняет тестовую базу и замеряет число запросов, время '
+            'и размер ответа для каждого эндпоинта API')
+
+    def add_arguments(self, parser):
+        for option in DATASET_OPTIONS:
+            parser.add_argument(f'--{option.replace("_", "-")}', type=int)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--baseline', default=benchmark.BASELINE_PATH)
+        parser.add_argument('--update-baseline', action='store_true')
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--time-tolerance', type=float, default=1.5)
+        parser.add_argument('--size-tolerance', type=float, default=0.1)
+
+    def get_dataset(self, baseline, options):
+        if baseline is not None:
+            dataset = benchmark.Dataset.from_dict(baseline['dataset'])
+        else:
+            dataset = benchmark.Dataset()
+        for option in DATASET_OPTIONS:
+            if options[option] is not None:
+                setattr(dataset, option, options[option])
+        return dataset
+
+    def handle(self, *args, **options):
+        baseline = benchmark.load_baseline(options['baseline'])
+        dataset = self.get_dataset(baseline, options)
+        old_config = setup_databases(
+            verbosity=0,
+            interactive=False,
+            keepdb=options['keepdb'],
+            aliases={'default'}
+        )
+        try:
+            # jobs run inline so response sizes stay stable
+            with tempfile.TemporaryDirectory() as media_root, \
+                    override_settings(MEDIA_ROOT=media_root,
+                                      EXPORTS_ROOT=media_root,
+                                      JOBS_BACKEND='immediate'):
+                if not Recipe.objects.exists():
+                    benchmark.seed(dataset, self.stdout)
+                measurements = benchmark.run(options['repeat'])
+        finally:
+            teardown_databases(old_config, verbosity=0,
+                               keepdb=options['keepdb'])
+
+        results = {}
+        errors = []
+        for name, measurement in measurements.items():
+            results[name] = measurement.as_dict()
+            if any(code >= 500 for code in measurement.status_codes):
+                errors.append(f'{name}: статус {measurement.status_codes}')
+            self.stdout.write(
+                f'{name:<26} {sorted(measurement.status_codes)!s:<12}'
+                f'{results[name]["queries"]:>6} запр.'
+                f'{results[name]["time_ms"]:>10} мс'
+                f'{results[name]["bytes"]:>10} байт'
+            )
+
+        if options['update_baseline']:
+            benchmark.save_baseline(dataset, results, options['baseline'])
+            self.stdout.write(
+                self.style.SUCCESS(f'Baseline сохранён в {options["baseline"]}')
+            )
+        elif baseline is None:
+            self.stdout.write('Baseline не найден, сравнение пропущено')
+        elif baseline['dataset'] != dataset.as_dict():
+            self.stdout.write(
+                'Параметры набора данных отличаются от baseline, '
+                'сравнение пропущено'
+            )
+        else:
+            errors += benchmark.compare(
+                results,
+                baseline['endpoints'],
+                time_tolerance=options['time_tolerance'],
+                size_tolerance=options['size_tolerance']
+            )
+        if errors:
+            raise CommandError('\n'.join(errors))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+
+from recipes import benchmark
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Заполняет тестовую базу набором данных benchmark и выводит '
+            'планы основных запросов к рецептам')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--users', type=int)
+        parser.add_argument('--recipes', type=int)
+
+    def handle(self, *args, **options):
+        baseline = benchmark.load_baseline()
+        if baseline is not None:
+            dataset = benchmark.Dataset.from_dict(baseline['dataset'])
+        else:
+            dataset = benchmark.Dataset()
+        for option in ('users', 'recipes'):
+            if options[option] is not None:
+                setattr(dataset, option, options[option])
+        old_config = setup_databases(
+            verbosity=0,
+            interactive=False,
+            keepdb=options['keepdb'],
+            aliases={'default'}
+        )
+        try:
+            if not Recipe.objects.exists():
+                benchmark.seed(dataset, self.stdout)
+            explain = {}
+            if connection.vendor == 'postgresql':
+                explain = {'analyze': True, 'buffers': True}
+            for name, queryset in benchmark.access_paths():
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                self.stdout.write(queryset.explain(**explain))
+                self.stdout.write('')
+        finally:
+            teardown_databases(old_config, verbosity=0,
+                               keepdb=options['keepdb'])
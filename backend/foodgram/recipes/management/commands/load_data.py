@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from recipes import loader
+
+MAX_ERRORS_SHOWN = 20
+
+
+class Command(BaseCommand):
+    help = ('Загружает ингредиенты, теги или рецепты из CSV, JSON '
+            'или JSONL')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(loader.LOADERS))
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format',
+            choices=loader.FORMATS,
+            help='Формат файла, по умолчанию определяется по расширению'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=loader.CHUNK_SIZE,
+            help='Сколько записей проверять и записывать за одну транзакцию'
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Записывать строки через COPY (только PostgreSQL)'
+        )
+        parser.add_argument(
+            '--author',
+            help='Автор (username или email) для рецептов без автора'
+        )
+        parser.add_argument(
+            '--images-dir',
+            help='Каталог, от которого отсчитываются пути к изображениям'
+        )
+
+    def handle(self, *args, **options):
+        data_format = options['format'] or loader.detect_format(
+            options['path']
+        )
+        if data_format is None:
+            raise CommandError('Не удалось определить формат, укажите --format')
+        if options['kind'] == 'recipes' and data_format == 'csv':
+            raise CommandError('Рецепты загружаются только из JSON или JSONL')
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy работает только с PostgreSQL')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должен быть больше 0')
+
+        data_loader = loader.LOADERS[options['kind']](
+            chunk_size=options['chunk_size'],
+            use_copy=options['copy'],
+            author=options['author'],
+            images_dir=options['images_dir']
+        )
+        try:
+            report = data_loader.run(loader.read_records(
+                options['path'], data_format, data_loader.fields
+            ))
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать {options["path"]}: '
+                               f'{error}')
+
+        for number, error in report.errors[:MAX_ERRORS_SHOWN]:
+            self.stderr.write(f'Запись {number}: {error}')
+        if len(report.errors) > MAX_ERRORS_SHOWN:
+            self.stderr.write(
+                f'... и ещё {len(report.errors) - MAX_ERRORS_SHOWN} ошибок'
+            )
+        self.stdout.write(
+            f'Прочитано: {report.read}, создано: {report.created}, '
+            f'обновлено: {report.updated}, пропущено: {report.skipped}, '
+            f'ошибок: {len(report.errors)} '
+            f'за {report.seconds:.1f} с ({report.rate} записей/с)'
+        )
+        if report.images:
+            self.stdout.write(
+                'Изображения сохранены без обработки, запустите '
+                'process_images, чтобы создать превью'
+            )
@@ -0,0 +1,202 @@
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+from rest_framework.authtoken.models import Token
+
+from recipes import benchmark
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+GUNICORN_CONF = Path(settings.BASE_DIR).parent / 'gunicorn.conf.py'
+STARTUP_TIMEOUT = 30
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест горячих эндпоинтов: пропускная способность '
+            'и задержки p50/p99 в режимах WSGI и ASGI')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=('wsgi', 'asgi', 'both'),
+                            default='both')
+        parser.add_argument('--url',
+                            help='Нагружать уже запущенный сервер')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--token',
+                            help='Токен для /api/users/subscriptions/ '
+                                 '(с --url)')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Путь для нагрузки, можно указать '
+                                 'несколько раз')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            # Default paths take recipe ids from the local database.
+            if not options['paths'] and not Recipe.objects.exists():
+                raise CommandError('База пуста: укажите пути через --path')
+            self.run(options['url'], options)
+            return
+        # The local server runs against a throwaway test database, so the
+        # seeded users with a known password never reach a real database.
+        with self.database(options['keepdb']) as name:
+            if not Recipe.objects.exists():
+                self.stdout.write('Заполняю тестовую базу')
+                benchmark.seed(benchmark.Dataset(users=200, recipes=2000),
+                               self.stdout)
+            if not options['token']:
+                user = User.objects.order_by('id').first()
+                options['token'] = Token.objects.get_or_create(
+                    user=user
+                )[0].key
+            self.run(None, options, database=name)
+
+    def run(self, url, options, database=None):
+        paths = options['paths'] or self.default_paths(options['token'])
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+
+        if url:
+            servers = {'server': url}
+        else:
+            modes = ('wsgi', 'asgi') if options['mode'] == 'both' else (
+                options['mode'],
+            )
+            servers = {mode: None for mode in modes}
+
+        for mode, url in servers.items():
+            with self.serve(mode, url, options, database) as base_url:
+                result = self.load(base_url, paths, headers, options)
+            self.stdout.write(
+                f'{mode:<8}{result["rps"]:>10.1f} запр/с'
+                f'{result["p50"]:>10.1f} мс p50'
+                f'{result["p99"]:>10.1f} мс p99'
+                f'{result["errors"]:>8} ошибок'
+            )
+
+    @contextmanager
+    def database(self, keepdb):
+        settings_dict = connection.settings_dict
+        if connection.vendor == 'sqlite' and not settings_dict['TEST']['NAME']:
+            # gunicorn needs a file, not the default in-memory test database
+            settings_dict['TEST']['NAME'] = os.path.join(
+                tempfile.gettempdir(), 'foodgram_loadtest.sqlite3'
+            )
+        old_config = setup_databases(
+            verbosity=0,
+            interactive=False,
+            keepdb=keepdb,
+            aliases={'default'}
+        )
+        try:
+            yield settings_dict['NAME']
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=keepdb)
+
+    def default_paths(self, token):
+        recipe = Recipe.objects.order_by('id').first()
+        tag = Tag.objects.order_by('id').first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        paths = [
+            '/api/recipes/?limit=6',
+            f'/api/recipes/{recipe.id}/',
+            '/api/tags/',
+            f'/api/tags/{tag.id}/',
+            f'/api/ingredients/?name={ingredient.name[:2]}',
+        ]
+        if token:
+            paths.append('/api/users/subscriptions/?recipes_limit=3')
+        return paths
+
+    @contextmanager
+    def serve(self, mode, url, options, database):
+        if url:
+            yield url.rstrip('/')
+            return
+        bind = f'127.0.0.1:{options["port"]}'
+        process = subprocess.Popen(
+            ['gunicorn', '-c', str(GUNICORN_CONF)],
+            env={
+                **os.environ,
+                'SERVER_MODE': mode,
+                'GUNICORN_BIND': bind,
+                'GUNICORN_WORKERS': str(options['workers']),
+                'POSTGRES_NAME': database,
+                'DB_REPLICA_URLS': '',
+            },
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        base_url = f'http://{bind}'
+        try:
+            self.wait_ready(base_url, process)
+            yield base_url
+        finally:
+            process.terminate()
+            process.wait()
+
+    def wait_ready(self, base_url, process):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError('gunicorn завершился при запуске')
+            try:
+                requests.get(f'{base_url}/api/tags/', timeout=5)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise CommandError('gunicorn не ответил за отведённое время')
+
+    def load(self, base_url, paths, headers, options):
+        def worker(offset, count):
+            session = requests.Session()
+            latencies = []
+            errors = 0
+            for number in range(offset, offset + count):
+                path = paths[number % len(paths)]
+                start = time.perf_counter()
+                try:
+                    response = session.get(base_url + path, headers=headers)
+                    failed = response.status_code >= 400
+                except requests.RequestException:
+                    failed = True
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors += failed
+            return latencies, errors
+
+        for path in paths:
+            requests.get(base_url + path, headers=headers)
+        concurrency = options['concurrency']
+        per_worker = max(1, options['requests'] // concurrency)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(
+                worker,
+                range(0, per_worker * concurrency, per_worker),
+                [per_worker] * concurrency
+            ))
+        elapsed = time.perf_counter() - start
+        latencies = [value for values, _ in results for value in values]
+        percentiles = statistics.quantiles(latencies, n=100)
+        return {
+            'rps': len(latencies) / elapsed,
+            'p50': percentiles[49],
+            'p99': percentiles[98],
+            'errors': sum(errors for _, errors in results),
+        }
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from recipes import fragments, images
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Пережимает изображения рецептов и создаёт превью '
+            'для рецептов, у которых их ещё нет')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Обработать все рецепты, а не только необработанные'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['force']:
+            recipes = recipes.filter(thumbnails={})
+        processed = skipped = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            if images.process(recipe_id) is None:
+                skipped += 1
+            else:
+                processed += 1
+                fragments.invalidate([recipe_id])
+        self.stdout.write(f'Обработано: {processed}, пропущено: {skipped}')
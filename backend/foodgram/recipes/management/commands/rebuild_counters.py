@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from jobs.queue import enqueue
+from recipes import counters
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного, корзин и рецептов автора '
+            'по фактическим данным')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать число расходящихся строк'
+        )
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Поставить пересчёт в очередь фоновых задач'
+        )
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            job = enqueue('recipes.rebuild_counters')
+            self.stdout.write(f'Задача {job.pk} поставлена в очередь')
+            return
+        with transaction.atomic():
+            drift = counters.rebuild(dry_run=options['dry_run'])
+        for name, stale in drift.items():
+            self.stdout.write(f'{name}: {stale}')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from jobs.queue import enqueue
+from recipes import feed
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ленты подписок пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Поставить пересборку в очередь фоновых задач'
+        )
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            job = enqueue('recipes.rebuild_feeds')
+            self.stdout.write(f'Задача {job.pk} поставлена в очередь')
+            return
+        entries = feed.rebuild()
+        self.stdout.write(f'Записей в лентах: {entries}')
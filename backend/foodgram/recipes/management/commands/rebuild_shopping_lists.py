@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from jobs.queue import enqueue
+from recipes import shopping_list
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает списки покупок пользователей по их корзинам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Поставить пересборку в очередь фоновых задач'
+        )
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            job = enqueue('recipes.rebuild_shopping_lists')
+            self.stdout.write(f'Задача {job.pk} поставлена в очередь')
+            return
+        items = shopping_list.rebuild()
+        self.stdout.write(f'Позиций в списках покупок: {items}')
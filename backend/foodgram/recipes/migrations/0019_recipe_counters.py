@@ -0,0 +1,50 @@
+# Generated by Django 3.2.5 on 2026-10-18 17:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FavoriteRecipe = apps.get_model('recipes', 'FavoriteRecipe')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    User = apps.get_model('users', 'FoodgramUser')
+
+    def actual(source, relation):
+        return Coalesce(
+            Subquery(
+                source.objects.filter(**{relation: OuterRef('pk')})
+                .order_by().values(relation)
+                .annotate(total=Count('pk')).values('total')
+            ),
+            Value(0)
+        )
+
+    Recipe.objects.update(
+        favorites_count=actual(FavoriteRecipe, 'recipe'),
+        in_carts_count=actual(ShoppingCart, 'recipe')
+    )
+    User.objects.update(recipes_count=actual(Recipe, 'author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_recipe_pub_date_id_index'),
+        ('users', '0007_foodgramuser_recipes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В корзинах'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
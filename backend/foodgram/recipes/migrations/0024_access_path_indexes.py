@@ -0,0 +1,116 @@
+# Generated by Django 3.2.5 on 2026-10-18 18:27
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+import django.db.models.deletion
+
+from recipes.operations import (
+    AddIndexConcurrently,
+    AddUniqueConstraintConcurrently,
+    AlterFieldIndexConcurrently
+)
+
+
+def remove_duplicates(apps, schema_editor):
+    Tag = apps.get_model('recipes', 'Tag')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    Tag.objects.filter(slug='').update(slug=None)
+    duplicates = Tag.objects.exclude(slug=None).values('slug').annotate(
+        first=Min('id'), total=Count('id')
+    ).filter(total__gt=1)
+    for row in duplicates:
+        for tag in Tag.objects.filter(slug=row['slug']).exclude(
+            pk=row['first']
+        ):
+            tag.slug = f'{tag.slug}-{tag.pk}'
+            tag.save(update_fields=['slug'])
+    duplicates = IngredientInRecipe.objects.values(
+        'recipe', 'ingredient'
+    ).annotate(
+        first=Min('id'), total=Count('id'), amount=Sum('amount')
+    ).filter(total__gt=1)
+    for row in duplicates:
+        IngredientInRecipe.objects.filter(pk=row['first']).update(
+            amount=row['amount']
+        )
+        IngredientInRecipe.objects.filter(
+            recipe=row['recipe'], ingredient=row['ingredient']
+        ).exclude(pk=row['first']).delete()
+
+
+# Indexes are built concurrently on PostgreSQL, so the migration is not
+# atomic. The new composite indexes are created before the single-column
+# foreign key indexes they make redundant are dropped.
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0023_feedentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        AlterFieldIndexConcurrently(
+            model_name='tag',
+            name='slug',
+            field=models.SlugField(blank=True, max_length=200, null=True, unique=True, verbose_name='Уникальный слаг'),
+        ),
+        AddIndexConcurrently(
+            model_name='favoriterecipe',
+            index=models.Index(fields=['user', 'recipe'], name='favorite_user_recipe_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='recipe',
+            index=models.Index(fields=['author', 'pub_date', 'id'], name='recipe_author_pub_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='shoppingcart',
+            index=models.Index(fields=['user', 'recipe'], name='shopping_cart_user_recipe_idx'),
+        ),
+        AddUniqueConstraintConcurrently(
+            model_name='ingredientinrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_ingredient_in_recipe'),
+        ),
+        AlterFieldIndexConcurrently(
+            model_name='favoriterecipe',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorited_recipe', to='recipes.recipe', verbose_name='Избранный рецепт'),
+        ),
+        AlterFieldIndexConcurrently(
+            model_name='favoriterecipe',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='users_favorited', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        AlterFieldIndexConcurrently(
+            model_name='feedentry',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='feed', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик'),
+        ),
+        AlterFieldIndexConcurrently(
+            model_name='ingredientinrecipe',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='recipe', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        AlterFieldIndexConcurrently(
+            model_name='recipe',
+            name='author',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Автор рецепта'),
+        ),
+        AlterFieldIndexConcurrently(
+            model_name='shoppingcart',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='recipe_in_shopping_cart', to='recipes.recipe', verbose_name='Рецепт в корзине'),
+        ),
+        AlterFieldIndexConcurrently(
+            model_name='shoppingcart',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='user_shopping_cart', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        AlterFieldIndexConcurrently(
+            model_name='subscribe',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='follower', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+from recipes.operations import drop_invalid_index, is_postgresql
+
+INDEX_NAME = 'recipe_tags_tag_recipe_idx'
+
+
+def index_sql(schema_editor, statement):
+    if is_postgresql(schema_editor):
+        return statement.replace('INDEX', 'INDEX CONCURRENTLY', 1)
+    return statement
+
+
+# The table behind Recipe.tags is created by Django, so the index is added
+# with SQL. It covers tag filters that start from the tag side: recipe ids
+# are read from the index without visiting the table.
+def add_index(apps, schema_editor):
+    through = apps.get_model('recipes', 'Recipe').tags.through
+    quote = schema_editor.quote_name
+    if is_postgresql(schema_editor):
+        drop_invalid_index(schema_editor, INDEX_NAME)
+    schema_editor.execute(index_sql(
+        schema_editor,
+        f'CREATE INDEX IF NOT EXISTS {quote(INDEX_NAME)} ON '
+        f'{quote(through._meta.db_table)} ('
+        f'{quote(through._meta.get_field("tag").column)}, '
+        f'{quote(through._meta.get_field("recipe").column)})'
+    ))
+
+
+def remove_index(apps, schema_editor):
+    schema_editor.execute(index_sql(
+        schema_editor,
+        f'DROP INDEX IF EXISTS {schema_editor.quote_name(INDEX_NAME)}'
+    ))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('recipes', '0024_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, remove_index, atomic=False),
+    ]
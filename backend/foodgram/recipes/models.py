@@ -1,5 +1,6 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection, models
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
@@ -14,6 +15,85 @@ def is_hex(value):
         )
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            false = models.Value(False, output_field=models.BooleanField())
+            return self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                author_is_subscribed=false
+            )
+        return self.annotate(
+            is_favorited=models.Exists(
+                FavoriteRecipe.objects.filter(
+                    recipe=models.OuterRef('pk'),
+                    user=user
+                )
+            ),
+            is_in_shopping_cart=models.Exists(
+                ShoppingCart.objects.filter(
+                    recipe=models.OuterRef('pk'),
+                    user=user
+                )
+            ),
+            author_is_subscribed=models.Exists(
+                Subscribe.objects.filter(
+                    author=models.OuterRef('author'),
+                    user=user
+                )
+            )
+        )
+
+    # One EXISTS probe per recipe instead of a join, so a recipe with
+    # several matching tags is returned once and no DISTINCT is needed.
+    def with_tags(self, tag_ids, match_all=False):
+        tagged = self.model.tags.through.objects.filter(
+            recipe=models.OuterRef('pk')
+        )
+        if not match_all:
+            return self.filter(
+                models.Exists(tagged.filter(tag_id__in=tag_ids))
+            )
+        queryset = self
+        for tag_id in set(tag_ids):
+            queryset = queryset.filter(
+                models.Exists(tagged.filter(tag_id=tag_id))
+            )
+        return queryset
+
+    def for_feed(self, user):
+        return self.select_related('author').defer(
+            'search_vector'
+        ).prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipe',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            )
+        ).with_user_flags(user)
+
+    def for_fragments(self, user):
+        return self.only(
+            'id', 'author', 'pub_date', 'favorites_count'
+        ).with_user_flags(user)
+
+    def latest_by_authors(self, author_ids, limit):
+        quote = connection.ops.quote_name
+        columns = 'id, author_id, name, image, thumbnails, cooking_time'
+        placeholders = ', '.join(['%s'] * len(author_ids))
+        return self.raw(
+            f'SELECT {columns} FROM (SELECT {columns}, ROW_NUMBER() '
+            f'OVER (PARTITION BY author_id ORDER BY pub_date DESC, id DESC) '
+            f'AS position FROM {quote(self.model._meta.db_table)} '
+            f'WHERE author_id IN ({placeholders})) AS ranked '
+            f'WHERE position <= %s ORDER BY author_id, position',
+            [*author_ids, limit]
+        )
+
+
 class Ingredient(models.Model):
     name = models.CharField(
         max_length=200,
@@ -34,6 +114,13 @@ class Ingredient(models.Model):
                 name='unique_ingredient_list'
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=['name'],
+                name='ingredient_name_like_idx',
+                opclasses=['varchar_pattern_ops']
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
@@ -56,6 +143,7 @@ class Tag(models.Model):
         null=True,
         max_length=200,
         blank=True,
+        unique=True,
         verbose_name='Уникальный слаг'
     )
 
@@ -73,6 +161,7 @@ class Recipe(models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Автор рецепта'
     )
     name = models.CharField(
@@ -99,16 +188,46 @@ class Recipe(models.Model):
         upload_to='',
         verbose_name='Изображение'
     )
+    thumbnails = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='Превью изображения'
+    )
     pub_date = models.DateTimeField(
         auto_now_add=True,
         db_index=True,
         verbose_name='Дата публикации'
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='В избранном'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='В корзинах'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('pub_date',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['pub_date', 'id'],
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', 'pub_date', 'id'],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name}'
@@ -118,6 +237,7 @@ class IngredientInRecipe(models.Model):
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='recipe',
         verbose_name='Рецепт'
     )
@@ -132,6 +252,12 @@ class IngredientInRecipe(models.Model):
     )
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='unique_ingredient_in_recipe'
+            ),
+        ]
         verbose_name = 'Ингредиенты в рецептах'
         verbose_name_plural = 'Ингредиенты в рецептах'
 
@@ -140,12 +266,14 @@ class FavoriteRecipe(models.Model):
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='favorited_recipe',
         verbose_name='Избранный рецепт'
     )
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='users_favorited',
         verbose_name='Пользователь'
     )
@@ -157,6 +285,12 @@ class FavoriteRecipe(models.Model):
                 name='unique_favorite_list'
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=['user', 'recipe'],
+                name='favorite_user_recipe_idx'
+            ),
+        ]
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
 
@@ -165,12 +299,14 @@ class ShoppingCart(models.Model):
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='recipe_in_shopping_cart',
         verbose_name='Рецепт в корзине'
     )
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='user_shopping_cart',
         verbose_name='Пользователь'
     )
@@ -182,14 +318,52 @@ class ShoppingCart(models.Model):
                 name='unique_shopping_cart_list'
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=['user', 'recipe'],
+                name='shopping_cart_user_recipe_idx'
+            ),
+        ]
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзины'
 
 
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество'
+    )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов в корзине'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            ),
+        ]
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+
+
 class Subscribe(models.Model):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='follower',
         verbose_name='Подписчик'
     )
@@ -212,3 +386,48 @@ class Subscribe(models.Model):
         ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+
+
+class FeedEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_index=False,
+        related_name='feed',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_entry_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_entry_user_author_idx'
+            ),
+        ]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
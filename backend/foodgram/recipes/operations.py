@@ -0,0 +1,156 @@
+from django.contrib.postgres.operations import (
+    AddIndexConcurrently as PostgresAddIndexConcurrently,
+    NotInTransactionMixin
+)
+from django.db import migrations
+from django.db.models import Index
+
+# Index operations that build and drop indexes without locking writes on
+# PostgreSQL and fall back to the plain operations elsewhere (SQLite in
+# tests). Migrations that use them must set atomic = False.
+
+
+def is_postgresql(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+# An interrupted CREATE INDEX CONCURRENTLY leaves an INVALID index behind,
+# which a rerun would otherwise keep (IF NOT EXISTS) or fail on.
+def drop_invalid_index(schema_editor, name):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT indisvalid FROM pg_index '
+            'WHERE indexrelid = to_regclass(%s)',
+            [name]
+        )
+        row = cursor.fetchone()
+    if row is not None and not row[0]:
+        schema_editor.execute(
+            f'DROP INDEX CONCURRENTLY {schema_editor.quote_name(name)}'
+        )
+
+
+# The unique index is built first and then attached as the constraint, so
+# the table is locked only for the ALTER TABLE.
+def add_unique(schema_editor, model, name, columns):
+    quote = schema_editor.quote_name
+    drop_invalid_index(schema_editor, name)
+    table = quote(model._meta.db_table)
+    columns = ', '.join(quote(column) for column in columns)
+    schema_editor.execute(
+        f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {quote(name)} '
+        f'ON {table} ({columns})'
+    )
+    schema_editor.execute(
+        f'ALTER TABLE {table} ADD CONSTRAINT {quote(name)} UNIQUE USING INDEX '
+        f'{quote(name)}'
+    )
+
+
+def drop_indexes(schema_editor, model, field, exclude=()):
+    for name in schema_editor._constraint_names(
+        model, [field.column], index=True, type_=Index.suffix
+    ):
+        if name not in exclude:
+            schema_editor.execute(schema_editor._delete_index_sql(
+                model, name, concurrently=True
+            ))
+
+
+class AddIndexConcurrently(PostgresAddIndexConcurrently):
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if is_postgresql(schema_editor):
+            self._ensure_not_in_transaction(schema_editor)
+            drop_invalid_index(schema_editor, self.index.name)
+            return super().database_forwards(app_label, schema_editor,
+                                             from_state, to_state)
+        return migrations.AddIndex.database_forwards(
+            self, app_label, schema_editor, from_state, to_state
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if is_postgresql(schema_editor):
+            return super().database_backwards(app_label, schema_editor,
+                                              from_state, to_state)
+        return migrations.AddIndex.database_backwards(
+            self, app_label, schema_editor, from_state, to_state
+        )
+
+
+class AddUniqueConstraintConcurrently(NotInTransactionMixin,
+                                      migrations.AddConstraint):
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if not is_postgresql(schema_editor):
+            return super().database_forwards(app_label, schema_editor,
+                                             from_state, to_state)
+        self._ensure_not_in_transaction(schema_editor)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        add_unique(schema_editor, model, self.constraint.name, [
+            model._meta.get_field(field).column
+            for field in self.constraint.fields
+        ])
+
+
+class AlterFieldIndexConcurrently(NotInTransactionMixin,
+                                  migrations.AlterField):
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if not is_postgresql(schema_editor):
+            return super().database_forwards(app_label, schema_editor,
+                                             from_state, to_state)
+        self._ensure_not_in_transaction(schema_editor)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        old_field = from_state.apps.get_model(
+            app_label, self.model_name
+        )._meta.get_field(self.name)
+        new_field = model._meta.get_field(self.name)
+        table = model._meta.db_table
+        like = schema_editor._create_index_name(
+            table, [new_field.column], suffix='_like'
+        )
+        if new_field.unique and not old_field.unique:
+            # Same constraint name as AlterField, so later migrations that
+            # drop the unique find it.
+            name = schema_editor._create_index_name(
+                table, [new_field.column], suffix='_uniq'
+            )
+            add_unique(schema_editor, model, name, [new_field.column])
+            drop_indexes(schema_editor, model, old_field, exclude={like})
+            if not old_field.db_index:
+                statement = schema_editor._create_like_index_sql(
+                    model, new_field
+                )
+                if statement is not None:
+                    schema_editor.execute(str(statement).replace(
+                        'INDEX', 'INDEX CONCURRENTLY IF NOT EXISTS', 1
+                    ))
+        elif old_field.unique and not new_field.unique:
+            if new_field.db_index:
+                schema_editor.execute(schema_editor._create_index_sql(
+                    model, fields=[new_field], concurrently=True
+                ))
+            for name in schema_editor._constraint_names(
+                model, [old_field.column], unique=True, primary_key=False,
+                exclude={
+                    constraint.name for constraint in model._meta.constraints
+                }
+            ):
+                schema_editor.execute(
+                    schema_editor._delete_unique_sql(model, name)
+                )
+            if not new_field.db_index:
+                drop_indexes(schema_editor, model, old_field)
+        elif old_field.db_index and not new_field.db_index:
+            drop_indexes(schema_editor, model, old_field)
+        elif new_field.db_index and not old_field.db_index:
+            schema_editor.execute(schema_editor._create_index_sql(
+                model, fields=[new_field], concurrently=True
+            ))
@@ -1,5 +1,127 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from operator import attrgetter
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+def encode_cursor(position, reverse=False):
+    payload = json.dumps({'p': position, 'r': int(reverse)}, default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(value):
+    if not value:
+        return None, False
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(value.encode()))
+        return payload['p'], bool(payload['r'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise NotFound('Неверный курсор')
+
+
+def keyset_filter(ordering, position, reverse=False):
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, position):
+        descending = field.startswith('-')
+        name = field.lstrip('-')
+        lookup = 'lt' if descending != reverse else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def reverse_ordering(ordering):
+    return [
+        field[1:] if field.startswith('-') else f'-{field}'
+        for field in ordering
+    ]
+
+
+class FeedPagination(CustomPageNumberPagination):
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    cursor_ordering = ('pub_date', 'id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.ordering = getattr(view, 'cursor_ordering', self.cursor_ordering)
+        self.page_size = self.get_page_size(request)
+        position, reverse = decode_cursor(
+            request.query_params[self.cursor_query_param]
+        )
+        self.total = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.total = queryset.count()
+
+        ordering = self.ordering
+        if reverse:
+            ordering = reverse_ordering(ordering)
+        if position is not None:
+            queryset = queryset.filter(
+                keyset_filter(self.ordering, position, reverse)
+            )
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.results = results
+        return results
+
+    def get_position(self, obj):
+        return [
+            attrgetter(field.lstrip('-'))(obj) for field in self.ordering
+        ]
+
+    def get_cursor_link(self, obj, reverse):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url,
+            self.cursor_query_param,
+            encode_cursor(self.get_position(obj), reverse)
+        )
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if not self.has_next or not self.results:
+            return None
+        return self.get_cursor_link(self.results[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if not self.has_previous or not self.results:
+            return None
+        return self.get_cursor_link(self.results[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        response = OrderedDict()
+        if self.total is not None:
+            response['count'] = self.total
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
@@ -0,0 +1,270 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+
+from foodgram.db_router import primary
+
+from .models import IngredientInRecipe, Recipe
+
+
+def to_bitmap(positions, length):
+    data = bytearray((length + 7) // 8)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+def iter_positions(bitmap):
+    bits = bin(bitmap)[:1:-1]
+    position = bits.find('1')
+    while position != -1:
+        yield position
+        position = bits.find('1', position + 1)
+
+
+def add_position(posting, position):
+    if isinstance(posting, int):
+        return posting | 1 << position
+    posting = array('I', posting or ())
+    posting.append(position)
+    return posting
+
+
+def remove_position(posting, position):
+    if isinstance(posting, int):
+        return posting & ~(1 << position)
+    posting = array('I', posting)
+    index = bisect_left(posting, position)
+    if index < len(posting) and posting[index] == position:
+        del posting[index]
+    return posting
+
+
+# Recipes are numbered by (cooking_time, id) at build time, so set bits come
+# out fastest first; recipes written later are appended past `boundary`.
+class State:
+    def __init__(self, recipes, rows):
+        self.ids = array('Q')
+        self.times = array('I')
+        self.positions = {}
+        for recipe_id, cooking_time in recipes:
+            self.positions[recipe_id] = len(self.ids)
+            self.ids.append(recipe_id)
+            self.times.append(cooking_time)
+        self.boundary = length = len(self.ids)
+
+        members = defaultdict(list)
+        postings = defaultdict(list)
+        for recipe_id, ingredient_id in rows:
+            position = self.positions.get(recipe_id)
+            if position is not None:
+                members[position].append(ingredient_id)
+                postings[ingredient_id].append(position)
+
+        self.offsets = array('I', [0])
+        self.flat = array('Q')
+        sizes = defaultdict(list)
+        for position in range(length):
+            ingredients = members.pop(position, ())
+            self.flat.extend(ingredients)
+            self.offsets.append(len(self.flat))
+            if ingredients:
+                sizes[len(ingredients)].append(position)
+
+        dense = {}
+        for ingredient_id, positions in postings.items():
+            positions.sort()
+            if len(positions) * 32 > length:
+                dense[ingredient_id] = to_bitmap(positions, length)
+            else:
+                dense[ingredient_id] = array('I', positions)
+        buckets = {
+            size: to_bitmap(positions, length)
+            for size, positions in sizes.items()
+        }
+        self.view = (dense, buckets, length)
+
+    def ingredients(self, position):
+        return self.flat[self.offsets[position]:self.offsets[position + 1]]
+
+    def apply(self, recipe_id, entry):
+        postings, buckets, length = self.view
+        postings = dict(postings)
+        buckets = dict(buckets)
+        old = self.positions.pop(recipe_id, None)
+        if old is not None:
+            ingredients = self.ingredients(old)
+            for ingredient_id in ingredients:
+                postings[ingredient_id] = remove_position(
+                    postings[ingredient_id], old
+                )
+            if ingredients:
+                buckets[len(ingredients)] &= ~(1 << old)
+        if entry is not None:
+            ingredients, cooking_time = entry
+            position = len(self.ids)
+            self.ids.append(recipe_id)
+            self.times.append(cooking_time)
+            self.flat.extend(ingredients)
+            self.offsets.append(len(self.flat))
+            self.positions[recipe_id] = position
+            for ingredient_id in ingredients:
+                postings[ingredient_id] = add_position(
+                    postings.get(ingredient_id), position
+                )
+            if ingredients:
+                size = len(ingredients)
+                buckets[size] = buckets.get(size, 0) | 1 << position
+            length = position + 1
+        self.view = (postings, buckets, length)
+
+    def take(self, group, need):
+        head = group & ((1 << self.boundary) - 1)
+        hits = []
+        for position in iter_positions(head):
+            if len(hits) == need:
+                break
+            hits.append(position)
+        tail = [
+            position + self.boundary
+            for position in iter_positions(group >> self.boundary)
+        ]
+        if tail:
+            hits.extend(tail)
+            hits.sort(key=lambda position: (self.times[position],
+                                            self.ids[position]))
+        return hits[:need]
+
+    def search(self, ingredient_ids, limit, max_missing):
+        postings, buckets, length = self.view
+        bitmaps = []
+        for ingredient_id in set(ingredient_ids):
+            posting = postings.get(ingredient_id)
+            if isinstance(posting, int):
+                bitmaps.append(posting)
+            elif posting:
+                bitmaps.append(to_bitmap(posting, length))
+        if not bitmaps:
+            return []
+
+        slices = []
+        for bitmap in bitmaps:
+            carry = bitmap
+            for bit, counter in enumerate(slices):
+                slices[bit], carry = counter ^ carry, counter & carry
+                if not carry:
+                    break
+            if carry:
+                slices.append(carry)
+
+        full = (1 << length) - 1
+        matches = {}
+
+        def matched(count):
+            if count not in matches:
+                result = full if count < 1 << len(slices) else 0
+                for bit, counter in enumerate(slices):
+                    if not result:
+                        break
+                    result &= counter if count >> bit & 1 else counter ^ full
+                matches[count] = result
+            return matches[count]
+
+        results = []
+        supplied = len(bitmaps)
+        for missing in range(max_missing + 1):
+            sizes = sorted(
+                (size for size in buckets
+                 if missing < size <= supplied + missing),
+                reverse=True
+            )
+            for size in sizes:
+                group = matched(size - missing) & buckets[size]
+                if not group:
+                    continue
+                for position in self.take(group, limit - len(results)):
+                    results.append((self.ids[position], size - missing, size))
+                if len(results) == limit:
+                    return results
+        return results
+
+
+class PantryIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._built_at = 0
+        self._building = False
+        self._dirty = set()
+
+    def invalidate(self):
+        self._state = None
+
+    def build(self):
+        recipes = Recipe.objects.order_by(
+            'cooking_time', 'id'
+        ).values_list('id', 'cooking_time')
+        rows = IngredientInRecipe.objects.order_by().values_list(
+            'recipe_id', 'ingredient_id'
+        )
+        with primary():
+            return State(recipes.iterator(),
+                         rows.iterator(chunk_size=10000))
+
+    def rebuild(self):
+        try:
+            self._dirty = set()
+            state = self.build()
+            with self._lock:
+                self._state = state
+                self._built_at = time.monotonic()
+            for recipe_id in self._dirty:
+                self.refresh(recipe_id)
+        finally:
+            self._building = False
+            connections.close_all()
+
+    def get_state(self):
+        state = self._state
+        if state is None:
+            with self._lock:
+                if self._state is None:
+                    self._state = self.build()
+                    self._built_at = time.monotonic()
+                return self._state
+        age = time.monotonic() - self._built_at
+        if age > settings.WHAT_TO_COOK_INDEX_TTL and not self._building:
+            self._building = True
+            threading.Thread(target=self.rebuild, daemon=True).start()
+        return state
+
+    def refresh(self, recipe_id):
+        if self._building:
+            self._dirty.add(recipe_id)
+        if self._state is None:
+            return
+        cooking_time = Recipe.objects.filter(pk=recipe_id).values_list(
+            'cooking_time', flat=True
+        ).first()
+        entry = None
+        if cooking_time is not None:
+            entry = (
+                list(IngredientInRecipe.objects.filter(
+                    recipe_id=recipe_id
+                ).values_list('ingredient_id', flat=True)),
+                cooking_time
+            )
+        with self._lock:
+            if self._state is not None:
+                self._state.apply(recipe_id, entry)
+
+    def search(self, ingredient_ids, limit, max_missing):
+        return self.get_state().search(ingredient_ids, limit, max_missing)
+
+
+pantry_index = PantryIndex()
@@ -0,0 +1,199 @@
+import zlib
+from functools import lru_cache
+from pathlib import Path
+
+from PIL import ImageFont
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+FONT_SIZE = 11
+LEADING = 15
+ENCODING = 'cp1251'
+FIRST_CHAR = 32
+LAST_CHAR = 255
+
+CATALOG_ID = 1
+PAGES_ID = 2
+FONT_ID = 3
+
+
+class Font:
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        if self.path is not None and self.path.exists():
+            metrics = ImageFont.truetype(str(self.path), 1000)
+            self.widths = [
+                round(metrics.getlength(self.decode(code)))
+                for code in range(FIRST_CHAR, LAST_CHAR + 1)
+            ]
+            self.ascent, self.descent = metrics.getmetrics()
+        else:
+            self.path = None
+            self.widths = [556] * (LAST_CHAR - FIRST_CHAR + 1)
+
+    @staticmethod
+    def decode(code):
+        try:
+            return bytes([code]).decode(ENCODING)
+        except UnicodeDecodeError:
+            return '?'
+
+    @property
+    def embedded(self):
+        return self.path is not None
+
+    def encode(self, text):
+        if self.embedded:
+            return text.encode(ENCODING, 'replace')
+        return text.encode('latin-1', 'replace')
+
+    def width(self, text):
+        return sum(
+            self.widths[code - FIRST_CHAR] if code >= FIRST_CHAR else 0
+            for code in self.encode(text)
+        ) * FONT_SIZE / 1000
+
+    def objects(self):
+        if not self.embedded:
+            yield FONT_ID, (
+                b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+                b'/Encoding /WinAnsiEncoding >>'
+            )
+            return
+        differences = ' '.join(
+            f'/uni{ord(self.decode(code)):04X}'
+            if self.decode(code) != '?' else '/question'
+            for code in range(128, LAST_CHAR + 1)
+        )
+        yield FONT_ID, (
+            f'<< /Type /Font /Subtype /TrueType /BaseFont /{self.name} '
+            f'/FirstChar {FIRST_CHAR} /LastChar {LAST_CHAR} '
+            f'/Widths [{" ".join(map(str, self.widths))}] '
+            f'/FontDescriptor {FONT_ID + 1} 0 R '
+            f'/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding '
+            f'/Differences [128 {differences}] >> >>'
+        ).encode()
+        yield FONT_ID + 1, (
+            f'<< /Type /FontDescriptor /FontName /{self.name} /Flags 32 '
+            f'/FontBBox [-1000 -{self.descent} 2000 {self.ascent}] '
+            f'/ItalicAngle 0 /Ascent {self.ascent} /Descent -{self.descent} '
+            f'/CapHeight {self.ascent} /StemV 80 '
+            f'/FontFile2 {FONT_ID + 2} 0 R >>'
+        ).encode()
+        data = self.path.read_bytes()
+        yield FONT_ID + 2, stream(data, f'/Length1 {len(data)}')
+
+    @property
+    def name(self):
+        return ''.join(char for char in self.path.stem if char.isalnum())
+
+    @property
+    def object_count(self):
+        return 3 if self.embedded else 1
+
+
+@lru_cache(maxsize=None)
+def get_font(path):
+    return Font(path)
+
+
+def stream(data, extra=''):
+    data = zlib.compress(data)
+    return (
+        f'<< /Length {len(data)} /Filter /FlateDecode {extra}>>\nstream\n'
+    ).encode() + data + b'\nendstream'
+
+
+def wrap(font, line, width):
+    indent = len(line) - len(line.lstrip())
+    prefix = line[:indent]
+    current = prefix
+    for word in line.split():
+        candidate = f'{current} {word}' if current.strip() else prefix + word
+        if font.width(candidate) > width and current.strip():
+            yield current
+            current = prefix + '  ' + word
+        else:
+            current = candidate
+    yield current
+
+
+def page_content(font, lines, number):
+    commands = [
+        f'BT /F1 {FONT_SIZE} Tf {LEADING} TL '
+        f'{MARGIN} {PAGE_HEIGHT - MARGIN} Td'.encode()
+    ]
+    for line in lines:
+        commands.append(b'<' + font.encode(line).hex().encode() + b'> Tj T*')
+    commands.append(b'ET')
+    page_number = font.encode(str(number)).hex()
+    commands.append((
+        f'BT /F1 {FONT_SIZE - 2} Tf {PAGE_WIDTH - MARGIN - 20} '
+        f'{MARGIN / 2} Td <{page_number}> Tj ET'
+    ).encode())
+    return b'\n'.join(commands)
+
+
+def paginate(font, lines):
+    per_page = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+    page = []
+    pages = 0
+    for line in lines:
+        for part in wrap(font, line, PAGE_WIDTH - 2 * MARGIN):
+            page.append(part)
+            if len(page) == per_page:
+                yield page
+                pages += 1
+                page = []
+    if page or not pages:
+        yield page
+
+
+def render(lines, font_path=None):
+    font = get_font(font_path)
+    offsets = {}
+    position = 0
+
+    def write_object(object_id, body):
+        nonlocal position
+        offsets[object_id] = position
+        chunk = f'{object_id} 0 obj\n'.encode() + body + b'\nendobj\n'
+        position += len(chunk)
+        return chunk
+
+    header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    position += len(header)
+    yield header
+    yield write_object(
+        CATALOG_ID,
+        f'<< /Type /Catalog /Pages {PAGES_ID} 0 R >>'.encode()
+    )
+    for object_id, body in font.objects():
+        yield write_object(object_id, body)
+
+    kids = []
+    next_id = FONT_ID + font.object_count
+    for number, page in enumerate(paginate(font, lines), start=1):
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        yield write_object(content_id, stream(page_content(font, page, number)))
+        yield write_object(page_id, (
+            f'<< /Type /Page /Parent {PAGES_ID} 0 R '
+            f'/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 {FONT_ID} 0 R >> >> '
+            f'/Contents {content_id} 0 R >>'
+        ).encode())
+        kids.append(f'{page_id} 0 R')
+    yield write_object(PAGES_ID, (
+        f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'
+    ).encode())
+
+    xref = [f'xref\n0 {next_id}\n', '0000000000 65535 f \n']
+    xref += [f'{offsets[object_id]:010d} 00000 n \n'
+             for object_id in range(1, next_id)]
+    yield ''.join(xref).encode()
+    yield (
+        f'trailer\n<< /Size {next_id} /Root {CATALOG_ID} 0 R >>\n'
+        f'startxref\n{position}\n%%EOF\n'
+    ).encode()
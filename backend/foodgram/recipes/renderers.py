@@ -0,0 +1,44 @@
+from django.conf import settings
+from rest_framework import renderers
+
+from . import pdf, shopping_list
+
+
+def error_message(data):
+    if isinstance(data, dict) and 'detail' in data:
+        return str(data['detail'])
+    return str(data)
+
+
+class ShoppingListTextRenderer(renderers.BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+    stream = staticmethod(shopping_list.as_text)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return error_message(data).encode(self.charset)
+
+
+class ShoppingListCSVRenderer(ShoppingListTextRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    stream = staticmethod(shopping_list.as_csv)
+
+
+class ShoppingListJSONRenderer(renderers.JSONRenderer):
+    stream = staticmethod(shopping_list.as_json)
+
+
+class ShoppingListPDFRenderer(renderers.BaseRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    render_style = 'binary'
+    stream = staticmethod(shopping_list.as_pdf)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''.join(pdf.render(
+            [error_message(data)],
+            settings.SHOPPING_LIST_PDF_FONT
+        ))
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramSimilarity
+)
+from django.db import connection
+from django.db.models import (
+    Exists,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    TextField,
+    Value
+)
+from django.db.models.functions import Coalesce
+
+from .models import IngredientInRecipe, Recipe
+
+
+def is_supported():
+    return connection.vendor == 'postgresql'
+
+
+def ingredient_names():
+    return Coalesce(
+        Subquery(
+            IngredientInRecipe.objects.filter(
+                recipe=OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                names=StringAgg('ingredient__name', ' ')
+            ).values('names'),
+            output_field=TextField()
+        ),
+        Value(''),
+        output_field=TextField()
+    )
+
+
+def search_vector():
+    config = settings.RECIPE_SEARCH_CONFIG
+    name = SearchVector('name', weight='A', config=config)
+    text = SearchVector('text', weight='B', config=config)
+    ingredients = SearchVector(ingredient_names(), weight='C', config=config)
+    return name + text + ingredients
+
+
+def update_vectors(recipes=None):
+    if not is_supported():
+        return 0
+    if recipes is None:
+        recipes = Recipe.objects.all()
+    elif not hasattr(recipes, 'update'):
+        recipes = Recipe.objects.filter(pk__in=recipes)
+    return recipes.update(search_vector=search_vector())
+
+
+def search(queryset, text):
+    text = text.strip()
+    if not text:
+        return queryset
+    if not is_supported():
+        has_ingredient = Exists(IngredientInRecipe.objects.filter(
+            recipe=OuterRef('pk'),
+            ingredient__name__icontains=text
+        ))
+        return queryset.filter(
+            Q(name__icontains=text) | Q(text__icontains=text) | has_ingredient
+        )
+    query = SearchQuery(
+        text,
+        config=settings.RECIPE_SEARCH_CONFIG,
+        search_type='websearch'
+    )
+    return queryset.annotate(
+        rank=SearchRank(F('search_vector'), query),
+        similarity=TrigramSimilarity('name', text)
+    ).filter(
+        Q(search_vector=query) | Q(name__trigram_similar=text)
+    ).order_by('-rank', '-similarity', '-pub_date', '-id')
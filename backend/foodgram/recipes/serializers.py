@@ -1,12 +1,16 @@
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.db import transaction
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
+from . import fragments, images, search, shopping_list
+from .pantry import pantry_index
 from .models import (
     Ingredient,
     Tag,
     Recipe,
     FavoriteRecipe,
     ShoppingCart,
+    ShoppingListItem,
     IngredientInRecipe,
     Subscribe
 )
@@ -16,6 +20,16 @@ from django.contrib.auth import get_user_model
 User = get_user_model()
 
 
+def image_srcset(recipe, request):
+    storage = recipe.image.storage
+    srcset = {}
+    for width, name in sorted(recipe.thumbnails.items(),
+                              key=lambda item: int(item[0])):
+        url = storage.url(name)
+        srcset[width] = request.build_absolute_uri(url) if request else url
+    return srcset
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredient
@@ -34,6 +48,13 @@ class IngredientForRecipeSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'measurement_unit', 'amount']
 
 
+class ShoppingListItemSerializer(IngredientForRecipeSerializer):
+    class Meta:
+        model = ShoppingListItem
+        fields = ['id', 'name', 'measurement_unit', 'amount',
+                  'recipes_count']
+
+
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tag
@@ -46,16 +67,31 @@ class RecipeSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        exclude = ('pub_date',)
+        exclude = ('pub_date', 'in_carts_count', 'thumbnails',
+                   'search_vector')
+        read_only_fields = ('favorites_count',)
+
+    def to_representation(self, recipe):
+        if hasattr(recipe, 'author_is_subscribed'):
+            recipe.author.is_subscribed = recipe.author_is_subscribed
+        return super().to_representation(recipe)
+
+    def get_image_srcset(self, recipe):
+        return image_srcset(recipe, self.context.get('request'))
 
     def get_ingredients(self, recipe):
-        qs = IngredientInRecipe.objects.filter(recipe=recipe)
-        return IngredientForRecipeSerializer(qs, many=True).data
+        return IngredientForRecipeSerializer(
+            recipe.recipe.all(),
+            many=True
+        ).data
 
     def get_is_favorited(self, recipe):
+        if hasattr(recipe, 'is_favorited'):
+            return recipe.is_favorited
         request = self.context.get('request')
         user = request.user
         if user.is_anonymous:
@@ -63,6 +99,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         return FavoriteRecipe.objects.filter(recipe=recipe, user=user).exists()
 
     def get_is_in_shopping_cart(self, recipe):
+        if hasattr(recipe, 'is_in_shopping_cart'):
+            return recipe.is_in_shopping_cart
         request = self.context.get('request')
         user = request.user
         if user.is_anonymous:
@@ -70,6 +108,15 @@ class RecipeSerializer(serializers.ModelSerializer):
         return ShoppingCart.objects.filter(recipe=recipe, user=user).exists()
 
 
+def set_prefetched(instance, cache_name, objects):
+    queryset = getattr(instance, cache_name).all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[cache_name] = queryset
+
+
 class IngredientForCreateRecipeSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField()
     amount = serializers.IntegerField()
@@ -79,14 +126,29 @@ class IngredientForCreateRecipeSerializer(serializers.ModelSerializer):
         fields = ['id', 'amount']
 
 
+class RecipeImageField(Base64ImageField):
+    def to_internal_value(self, data):
+        max_bytes = settings.RECIPE_IMAGE_MAX_BYTES
+        if isinstance(data, str) and len(data) * 3 // 4 > max_bytes:
+            raise serializers.ValidationError(
+                f'Изображение больше {max_bytes // 1024 // 1024} МБ'
+            )
+        image = super().to_internal_value(data)
+        width, height = images.dimensions(image)
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            raise serializers.ValidationError(
+                f'Слишком большое изображение: {width}x{height}'
+            )
+        return image
+
+
 class CreateRecipeSerializer(serializers.ModelSerializer):
     ingredients = IngredientForCreateRecipeSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
         required=True
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
@@ -99,56 +161,144 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             'cooking_time'
         )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.written = {}
+
     def validate_cooking_time(self, value):
         if value < 1:
             raise serializers.ValidationError('Время приготовления должно быть больше 0')
         return value
 
+    def validate_tags(self, tag_ids):
+        if not tag_ids:
+            raise serializers.ValidationError('Нужно выбрать хотя бы один тег')
+        if len(tag_ids) != len(set(tag_ids)):
+            raise serializers.ValidationError('Теги не должны повторяться')
+        tags = Tag.objects.in_bulk(tag_ids)
+        missing = [tag_id for tag_id in tag_ids if tag_id not in tags]
+        if missing:
+            raise serializers.ValidationError(f'Теги не найдены: {missing}')
+        return [tags[tag_id] for tag_id in tag_ids]
+
+    def validate_ingredients(self, ingredients):
+        if not ingredients:
+            raise serializers.ValidationError('Нужен хотя бы один ингредиент')
+        ingredient_ids = [ingredient['id'] for ingredient in ingredients]
+        if len(ingredient_ids) != len(set(ingredient_ids)):
+            raise serializers.ValidationError('Ингредиенты не должны повторяться')
+        if any(ingredient['amount'] < 1 for ingredient in ingredients):
+            raise serializers.ValidationError(
+                'Количество ингредиента должно быть больше 0'
+            )
+        found = Ingredient.objects.in_bulk(ingredient_ids)
+        missing = [pk for pk in ingredient_ids if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {missing}'
+            )
+        return [
+            {'ingredient': found[ingredient['id']],
+             'amount': ingredient['amount']}
+            for ingredient in ingredients
+        ]
+
+    def write_tags(self, recipe, tags, existing_ids=()):
+        through = Recipe.tags.through
+        new_ids = {tag.id for tag in tags}
+        removed_ids = set(existing_ids) - new_ids
+        if removed_ids:
+            through.objects.filter(
+                recipe=recipe,
+                tag_id__in=removed_ids
+            ).delete()
+        through.objects.bulk_create([
+            through(recipe=recipe, tag=tag)
+            for tag in tags if tag.id not in existing_ids
+        ])
+        self.written['tags'] = tags
+
+    def write_ingredients(self, recipe, ingredients, existing=None):
+        existing = existing or {}
+        rows = []
+        created = []
+        changed = []
+        for ingredient in ingredients:
+            row = existing.pop(ingredient['ingredient'].id, None)
+            if row is None:
+                row = IngredientInRecipe(recipe=recipe, **ingredient)
+                created.append(row)
+            elif row.amount != ingredient['amount']:
+                row.amount = ingredient['amount']
+                changed.append(row)
+            row.ingredient = ingredient['ingredient']
+            rows.append(row)
+        if existing:
+            IngredientInRecipe.objects.filter(
+                pk__in=[row.pk for row in existing.values()]
+            ).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        IngredientInRecipe.objects.bulk_create(created)
+        self.written['recipe'] = rows
+        return [row.ingredient_id for row in created + changed] + list(
+            existing
+        )
+
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         author = self.context.get('request').user
         recipe = Recipe.objects.create(author=author, **validated_data)
-        for tag in tags:
-            recipe.tags.add(tag)
-        for ingredient in ingredients:
-            ingredient_id = ingredient['id']
-            ingredient_instance = get_object_or_404(
-                Ingredient,
-                id=ingredient_id
-            )
-            ingredient_amount = ingredient['amount']
-            IngredientInRecipe.objects.create(
-                recipe=recipe,
-                ingredient=ingredient_instance,
-                amount=ingredient_amount
-            )
+        images.schedule(recipe.id)
+        self.write_tags(recipe, tags)
+        self.write_ingredients(recipe, ingredients)
+        search.update_vectors([recipe.id])
+        transaction.on_commit(lambda: pantry_index.refresh(recipe.id))
+        recipe.is_favorited = False
+        recipe.is_in_shopping_cart = False
+        recipe.author_is_subscribed = False
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        new_tags = validated_data.pop('tags')
-        instance.tags.set(new_tags)
-
-        new_ingredients = validated_data.pop('ingredients')
-        IngredientInRecipe.objects.filter(recipe=instance).delete()
-        for new_ingredient in new_ingredients:
-            new_ingredient_id = new_ingredient['id']
-            ingredient_instance = get_object_or_404(
-                Ingredient,
-                id=new_ingredient_id
+        tags = validated_data.pop('tags', None)
+        if tags is not None:
+            self.write_tags(
+                instance,
+                tags,
+                set(instance.tags.values_list('id', flat=True))
             )
-            new_ingredient_amount = new_ingredient['amount']
-            IngredientInRecipe.objects.create(
-                recipe=instance,
-                ingredient=ingredient_instance,
-                amount=new_ingredient_amount
+        ingredients = validated_data.pop('ingredients', None)
+        if ingredients is not None:
+            changed = self.write_ingredients(
+                instance,
+                ingredients,
+                {row.ingredient_id: row
+                 for row in IngredientInRecipe.objects.filter(
+                     recipe=instance)}
             )
+            if changed:
+                shopping_list.refresh_recipe(instance.id, changed)
         for key, value in validated_data.items():
             setattr(instance, key, value)
-        instance.save()
+        # Only the edited columns are written: the counters loaded with the
+        # instance may have changed since, and ingredient rows are written
+        # without signals, so the fragment is dropped explicitly.
+        if validated_data:
+            instance.save(update_fields=list(validated_data))
+        else:
+            fragments.invalidate([instance.id])
+        search.update_vectors([instance.id])
+        transaction.on_commit(lambda: pantry_index.refresh(instance.id))
+        if 'image' in validated_data:
+            images.schedule(instance.id)
         return instance
 
     def to_representation(self, instance):
+        for cache_name, objects in self.written.items():
+            set_prefetched(instance, cache_name, objects)
         request = self.context.get('request')
         return RecipeSerializer(
             instance,
@@ -180,6 +330,17 @@ class FavoriteSerializer(serializers.ModelSerializer):
         ).data
 
 
+class RecipeBatchSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RECIPE_BATCH_MAX_SIZE
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
 class ShoppingCartSerializer(serializers.ModelSerializer):
     recipe = serializers.PrimaryKeyRelatedField(queryset=Recipe.objects.all())
     user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
@@ -216,15 +377,32 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
 
 
 class RecipeForSerializer(serializers.ModelSerializer):
+    image_srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
         fields = (
             'id',
             'name',
             'cooking_time',
-            'image'
+            'image',
+            'image_srcset'
         )
 
+    def get_image_srcset(self, recipe):
+        return image_srcset(recipe, self.context.get('request'))
+
+
+def get_recipes_limit(request):
+    try:
+        limit = int(request.query_params.get(
+            'recipes_limit',
+            settings.SUBSCRIPTION_RECIPES_LIMIT
+        ))
+    except ValueError:
+        limit = settings.SUBSCRIPTION_RECIPES_LIMIT
+    return max(0, min(limit, settings.SUBSCRIPTION_RECIPES_MAX_LIMIT))
+
 
 class SubscribeSerializer(serializers.ModelSerializer):
     recipes = serializers.SerializerMethodField()
@@ -245,15 +423,23 @@ class SubscribeSerializer(serializers.ModelSerializer):
         )
 
     def get_recipes(self, author):
-        qs = Recipe.objects.filter(author=author)
-        return RecipeForSerializer(qs, many=True).data
+        if hasattr(author, 'latest_recipes'):
+            recipes = author.latest_recipes
+        else:
+            recipes = author.recipe_set.order_by(
+                '-pub_date',
+                '-id'
+            )[:get_recipes_limit(self.context.get('request'))]
+        return RecipeForSerializer(recipes, many=True).data
 
     def get_recipes_count(self, author):
-        return Recipe.objects.filter(author=author).count()
+        return author.recipes_count
 
     def get_is_subscribed(self, author):
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
         user = self.context.get('request').user
-        return Subscribe.objects.filter(author=user, user=author).exists()
+        return Subscribe.objects.filter(user=user, author=author).exists()
 
 
 class SubscribeCreateSerializer(serializers.ModelSerializer):
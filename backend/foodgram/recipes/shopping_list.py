@@ -0,0 +1,166 @@
+import csv
+import json
+from itertools import groupby
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from . import pdf
+from .models import IngredientInRecipe, ShoppingCart, ShoppingListItem
+
+User = get_user_model()
+
+CHUNK_SIZE = 2000
+REBUILD_BATCH_SIZE = 500
+CSV_HEADER = ('section', 'recipe', 'ingredient', 'measurement_unit', 'amount')
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def carted_ingredients(user):
+    return IngredientInRecipe.objects.filter(
+        recipe__recipe_in_shopping_cart__user=user
+    )
+
+
+def refresh(users, ingredients=None):
+    users = sorted(set(users))
+    if not users:
+        return
+    items = ShoppingListItem.objects.filter(user__in=users)
+    source = IngredientInRecipe.objects.filter(
+        recipe__recipe_in_shopping_cart__user__in=users
+    )
+    if ingredients is not None:
+        items = items.filter(ingredient__in=ingredients)
+        source = source.filter(ingredient__in=ingredients)
+    rows = source.order_by().values(
+        'recipe__recipe_in_shopping_cart__user',
+        'ingredient'
+    ).annotate(
+        total=Sum('amount'),
+        recipes=Count('recipe', distinct=True)
+    ).values_list(
+        'recipe__recipe_in_shopping_cart__user',
+        'ingredient',
+        'total',
+        'recipes'
+    )
+    with transaction.atomic():
+        # Serializes concurrent refreshes of the same list, which would
+        # otherwise collide on (user, ingredient) when reinserting.
+        list(User.objects.select_for_update().filter(
+            pk__in=users
+        ).order_by('pk').values_list('pk', flat=True))
+        items.delete()
+        ShoppingListItem.objects.bulk_create([
+            ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                             amount=total, recipes_count=recipes)
+            for user_id, ingredient_id, total, recipes in rows
+        ], batch_size=CHUNK_SIZE)
+
+
+def refresh_recipe(recipe_id, ingredients=None):
+    refresh(
+        ShoppingCart.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('user_id', flat=True),
+        ingredients
+    )
+
+
+def rebuild():
+    users = ShoppingCart.objects.values_list('user_id', flat=True)
+    ShoppingListItem.objects.exclude(user__in=users).delete()
+    users = list(users.order_by('user_id').distinct())
+    for start in range(0, len(users), REBUILD_BATCH_SIZE):
+        refresh(users[start:start + REBUILD_BATCH_SIZE])
+    return ShoppingListItem.objects.count()
+
+
+def items(user):
+    return ShoppingListItem.objects.filter(user=user).order_by(
+        'ingredient__name',
+        'ingredient__measurement_unit'
+    )
+
+
+def totals(user):
+    rows = items(user).values_list(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'amount'
+    )
+    return rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+def recipes(user):
+    rows = carted_ingredients(user).order_by(
+        'recipe__name',
+        'recipe_id',
+        'ingredient__name'
+    ).values_list(
+        'recipe_id',
+        'recipe__name',
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'amount'
+    ).iterator(chunk_size=CHUNK_SIZE)
+    for (_, recipe_name), group in groupby(rows, key=lambda row: row[:2]):
+        yield recipe_name, [row[2:] for row in group]
+
+
+def lines(user):
+    yield 'Список покупок'
+    yield ''
+    for name, unit, amount in totals(user):
+        yield f'{name} - {amount} {unit}'
+    yield ''
+    yield 'По рецептам:'
+    for recipe_name, ingredients in recipes(user):
+        yield ''
+        yield recipe_name
+        for name, unit, amount in ingredients:
+            yield f'    {name} - {amount} {unit}'
+
+
+def as_text(user):
+    for line in lines(user):
+        yield f'{line}\n'
+
+
+def as_csv(user):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for name, unit, amount in totals(user):
+        yield writer.writerow(('total', '', name, unit, amount))
+    for recipe_name, ingredients in recipes(user):
+        for name, unit, amount in ingredients:
+            yield writer.writerow(('recipe', recipe_name, name, unit, amount))
+
+
+def as_json(user):
+    def ingredient(name, unit, amount):
+        return {'name': name, 'measurement_unit': unit, 'amount': amount}
+
+    yield '{"ingredients": ['
+    for position, row in enumerate(totals(user)):
+        separator = ', ' if position else ''
+        yield separator + json.dumps(ingredient(*row), ensure_ascii=False)
+    yield '], "recipes": ['
+    for position, (recipe_name, ingredients) in enumerate(recipes(user)):
+        separator = ', ' if position else ''
+        yield separator + json.dumps({
+            'name': recipe_name,
+            'ingredients': [ingredient(*row) for row in ingredients],
+        }, ensure_ascii=False)
+    yield ']}'
+
+
+def as_pdf(user):
+    return pdf.render(lines(user), settings.SHOPPING_LIST_PDF_FONT)
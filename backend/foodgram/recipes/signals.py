@@ -0,0 +1,242 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete
+)
+from django.db import transaction
+from django.dispatch import receiver
+
+from jobs.models import Job
+from jobs.queue import enqueue
+
+from . import cache as catalogue_cache
+from . import counters, exports, feed, fragments, search, shopping_list
+from .autocomplete import ingredient_index
+from .pantry import pantry_index
+from .models import (
+    FavoriteRecipe,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+    Subscribe,
+    Tag
+)
+
+User = get_user_model()
+
+AUTHOR_FIELDS = {'username', 'email', 'first_name', 'last_name'}
+
+deleting_recipes = ContextVar('deleting_recipes', default=frozenset())
+deleting_in_batch = ContextVar('deleting_in_batch', default=False)
+
+
+# RecipeBatchView deletes many favorite or cart rows at once and adjusts
+# the counters and the shopping list itself in a single pass.
+@contextmanager
+def batch_delete():
+    token = deleting_in_batch.set(True)
+    try:
+        yield
+    finally:
+        deleting_in_batch.reset(token)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_catalogue_cache(sender, **kwargs):
+    catalogue_cache.invalidate(sender)
+
+
+def counter_delta(signal, created):
+    if signal is post_delete:
+        return -1
+    return 1 if created else 0
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_delete, sender=FavoriteRecipe)
+def update_favorites_count(sender, instance, signal, created=False,
+                           **kwargs):
+    if signal is post_delete and deleting_in_batch.get():
+        return
+    delta = counter_delta(signal, created)
+    if delta:
+        counters.adjust(Recipe, instance.recipe_id, 'favorites_count', delta)
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def update_in_carts_count(sender, instance, signal, created=False,
+                          **kwargs):
+    if signal is post_delete and deleting_in_batch.get():
+        return
+    delta = counter_delta(signal, created)
+    if delta:
+        counters.adjust(Recipe, instance.recipe_id, 'in_carts_count', delta)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def update_recipes_count(sender, instance, signal, created=False,
+                         **kwargs):
+    delta = counter_delta(signal, created)
+    if delta:
+        counters.adjust(
+            counters.User, instance.author_id, 'recipes_count', delta
+        )
+
+
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def update_followers_count(sender, instance, signal, created=False,
+                           **kwargs):
+    delta = counter_delta(signal, created)
+    if delta:
+        counters.adjust(
+            counters.User, instance.author_id, 'followers_count', delta
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    if created:
+        enqueue('recipes.fan_out_recipes', [[instance.pk]])
+
+
+@receiver(post_save, sender=Subscribe)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        feed.backfill(instance.user_id, instance.author)
+
+
+@receiver(post_delete, sender=Subscribe)
+def prune_feed(sender, instance, **kwargs):
+    feed.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_image_files(sender, instance, **kwargs):
+    names = {instance.image.name, *instance.thumbnails.values()}
+    names.discard('')
+    if names:
+        enqueue('recipes.delete_image_files', [sorted(names)])
+
+
+@receiver(post_delete, sender=Job)
+def delete_export_file(sender, instance, **kwargs):
+    name = (instance.result or {}).get('file')
+    if instance.task == exports.TASK and name:
+        transaction.on_commit(lambda: exports.delete(name))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_search_vectors(sender, instance, created, **kwargs):
+    if not created and search.is_supported():
+        enqueue('recipes.update_search_vectors',
+                kwargs={'ingredient_id': instance.id})
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_pantry_index(sender, instance, **kwargs):
+    recipe_id = instance.id
+    transaction.on_commit(lambda: pantry_index.refresh(recipe_id))
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def update_shopping_list(sender, instance, signal, created=False, **kwargs):
+    if signal is post_save and not created:
+        return
+    if signal is post_delete and deleting_in_batch.get():
+        return
+    if instance.recipe_id in deleting_recipes.get():
+        return
+    shopping_list.refresh(
+        [instance.user_id],
+        IngredientInRecipe.objects.filter(
+            recipe_id=instance.recipe_id
+        ).values('ingredient')
+    )
+
+
+# Deleting a recipe cascades to its cart rows and ingredients in no fixed
+# order, so the affected lists are collected up front and refreshed once.
+@receiver(pre_delete, sender=Recipe)
+def collect_shopping_lists(sender, instance, **kwargs):
+    instance.shopping_list_users = list(ShoppingCart.objects.filter(
+        recipe=instance
+    ).values_list('user_id', flat=True))
+    if instance.shopping_list_users:
+        instance.shopping_list_ingredients = list(
+            IngredientInRecipe.objects.filter(
+                recipe=instance
+            ).values_list('ingredient_id', flat=True)
+        )
+        deleting_recipes.set(deleting_recipes.get() | {instance.pk})
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_shopping_lists(sender, instance, **kwargs):
+    users = getattr(instance, 'shopping_list_users', None)
+    if users:
+        deleting_recipes.set(deleting_recipes.get() - {instance.pk})
+        shopping_list.refresh(users, instance.shopping_list_ingredients)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_fragment(sender, instance, **kwargs):
+    fragments.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def invalidate_ingredients_fragment(sender, instance, **kwargs):
+    fragments.invalidate([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_tags_fragment(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        fragments.invalidate([instance.pk])
+    elif pk_set is not None:
+        fragments.invalidate(pk_set)
+    else:
+        fragments.invalidate_all()
+
+
+# Tags and ingredients are shared by many recipes and change rarely, so their
+# edits retire every cached fragment at once.
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_all_fragments(sender, **kwargs):
+    fragments.invalidate_all()
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_fragments(sender, instance, created, update_fields,
+                                **kwargs):
+    if created or (update_fields and not AUTHOR_FIELDS & set(update_fields)):
+        return
+    fragments.invalidate(
+        Recipe.objects.filter(author=instance).values_list('id', flat=True)
+    )
@@ -0,0 +1,73 @@
+from django.contrib.auth import get_user_model
+
+from jobs.queue import task
+
+from . import (
+    counters,
+    exports,
+    feed,
+    fragments,
+    images,
+    search,
+    shopping_list
+)
+from .models import Recipe
+
+User = get_user_model()
+
+EXPORT_FORMATS = {
+    'txt': shopping_list.as_text,
+    'csv': shopping_list.as_csv,
+    'json': shopping_list.as_json,
+    'pdf': shopping_list.as_pdf,
+}
+
+
+@task('recipes.process_image', priority=10, max_attempts=3)
+def process_image(recipe_id):
+    thumbnails = images.process(recipe_id)
+    fragments.invalidate([recipe_id])
+    return thumbnails
+
+
+@task('recipes.delete_image_files', max_attempts=3)
+def delete_image_files(names):
+    images.delete_files(names)
+
+
+@task('recipes.rebuild_counters', priority=-10, timeout=3600)
+def rebuild_counters():
+    return counters.rebuild()
+
+
+@task('recipes.rebuild_shopping_lists', priority=-10, timeout=3600)
+def rebuild_shopping_lists():
+    return {'items': shopping_list.rebuild()}
+
+
+@task('recipes.fan_out_recipes', priority=5)
+def fan_out_recipes(recipe_ids):
+    return {'entries': feed.fan_out(recipe_ids)}
+
+
+@task('recipes.rebuild_feeds', priority=-10, timeout=3600)
+def rebuild_feeds():
+    return {'entries': feed.rebuild()}
+
+
+@task('recipes.update_search_vectors', timeout=3600)
+def update_search_vectors(ingredient_id=None):
+    recipes = Recipe.objects.all()
+    if ingredient_id is not None:
+        recipes = recipes.filter(ingredients=ingredient_id)
+    return search.update_vectors(recipes)
+
+
+@task(exports.TASK, priority=5)
+def export_shopping_list(user_id, export_format):
+    user = User.objects.get(pk=user_id)
+    content = b''.join(
+        chunk.encode() if isinstance(chunk, str) else chunk
+        for chunk in EXPORT_FORMATS[export_format](user)
+    )
+    return exports.save(content, export_format)
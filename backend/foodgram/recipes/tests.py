@@ -0,0 +1,1701 @@
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import time
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient,
+    RequestFactory,
+    SimpleTestCase,
+    override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import re_path, resolve
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from foodgram import connections, db_router, profiling
+
+from . import benchmark, fragments, loader
+from .autocomplete import ingredient_index
+from .pantry import pantry_index
+from .serializers import CreateRecipeSerializer
+from .models import (
+    Ingredient,
+    Tag,
+    Recipe,
+    IngredientInRecipe,
+    FavoriteRecipe,
+    FeedEntry,
+    ShoppingCart,
+    ShoppingListItem,
+    Subscribe
+)
+
+User = get_user_model()
+
+
+class RecipeFeedTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader',
+            email='reader@foodgram.ru',
+            password='password'
+        )
+        cls.author = User.objects.create_user(
+            username='author',
+            email='author@foodgram.ru',
+            password='password'
+        )
+        tags = [
+            Tag.objects.create(name=name, color='#E26C2D', slug=slug)
+            for name, slug in (('Завтрак', 'breakfast'), ('Обед', 'lunch'))
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(3)
+        ]
+        for i in range(12):
+            recipe = Recipe.objects.create(
+                author=cls.author,
+                name=f'Рецепт {i}',
+                text='Описание',
+                cooking_time=10,
+                image='recipe.png'
+            )
+            recipe.tags.set(tags)
+            for ingredient in ingredients:
+                IngredientInRecipe.objects.create(
+                    recipe=recipe,
+                    ingredient=ingredient,
+                    amount=i + 1
+                )
+            if i % 2:
+                FavoriteRecipe.objects.create(recipe=recipe, user=cls.user)
+            if i % 3:
+                ShoppingCart.objects.create(recipe=recipe, user=cls.user)
+        Subscribe.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_recipes(self, limit):
+        response = self.client.get('/api/recipes/', {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        self.client.force_authenticate(self.user)
+        for limit in (1, 6, 12):
+            cache.clear()
+            with self.assertNumQueries(5):
+                self.get_recipes(limit)
+            with self.assertNumQueries(2):
+                self.get_recipes(limit)
+
+    def test_anonymous_list_query_count(self):
+        for limit in (1, 12):
+            cache.clear()
+            with self.assertNumQueries(5):
+                self.get_recipes(limit)
+            with self.assertNumQueries(2):
+                self.get_recipes(limit)
+
+    def test_list_flags_match_relations(self):
+        self.client.force_authenticate(self.user)
+        for recipe in self.get_recipes(12):
+            recipe_id = recipe['id']
+            self.assertEqual(
+                recipe['is_favorited'],
+                FavoriteRecipe.objects.filter(
+                    recipe_id=recipe_id, user=self.user
+                ).exists()
+            )
+            self.assertEqual(
+                recipe['is_in_shopping_cart'],
+                ShoppingCart.objects.filter(
+                    recipe_id=recipe_id, user=self.user
+                ).exists()
+            )
+            self.assertTrue(recipe['author']['is_subscribed'])
+            self.assertEqual(len(recipe['ingredients']), 3)
+            self.assertEqual(len(recipe['tags']), 2)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids += [item['id'] for item in response.data['results']]
+            url = response.data['next']
+            if len(ids) == 5:
+                Recipe.objects.create(
+                    author=self.author,
+                    name='Новый рецепт',
+                    text='Описание',
+                    cooking_time=10,
+                    image='recipe.png'
+                )
+        return ids
+
+    def test_cursor_pagination(self):
+        ids = self.walk('/api/recipes/?cursor=&limit=5')
+        expected = list(Recipe.objects.order_by(
+            'pub_date', 'id'
+        ).values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        response = self.client.get('/api/recipes/',
+                                   {'cursor': '', 'limit': 5, 'count': 1})
+        self.assertEqual(response.data['count'], len(expected))
+        self.assertIsNone(response.data['previous'])
+
+        last_page = self.client.get('/api/recipes/', {'cursor': '',
+                                                      'limit': 20})
+        self.assertIsNone(last_page.data['next'])
+        response = self.client.get(
+            '/api/recipes/', {'cursor': '', 'limit': 5}
+        )
+        response = self.client.get(response.data['next'])
+        back = self.client.get(response.data['previous'])
+        self.assertEqual([item['id'] for item in back.data['results']],
+                         expected[:5])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/', {'cursor': 'broken'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BenchmarkSuiteTest(APITestCase):
+
+    def test_every_endpoint_responds(self):
+        dataset = benchmark.Dataset(users=20, recipes=50, seed=1)
+        benchmark.seed(dataset)
+        measurements = benchmark.run(repeat=2)
+        for name, measurement in measurements.items():
+            for status_code in measurement.status_codes:
+                self.assertLess(status_code, 400, name)
+
+
+class IngredientSearchTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('яблочный сок', 'сок лимона', 'сахар', 'ёжевика',
+                     'апельсиновый сок', 'сокол'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+
+    def search(self, name, **params):
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/ingredients/', {'name': name, **params}
+            )
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_prefix_hits_go_before_word_hits(self):
+        ingredient_index.get_state()
+        self.assertEqual(
+            self.search('Сок'),
+            ['сок лимона', 'сокол', 'апельсиновый сок', 'яблочный сок']
+        )
+
+    def test_yo_is_matched_as_ye(self):
+        ingredient_index.get_state()
+        self.assertEqual(self.search('ЕЖ'), ['ёжевика'])
+
+    def test_limit(self):
+        ingredient_index.get_state()
+        self.assertEqual(len(self.search('со', limit=2)), 2)
+
+    def test_index_is_rebuilt_after_change(self):
+        ingredient_index.get_state()
+        Ingredient.objects.create(name='сода', measurement_unit='г')
+        response = self.client.get('/api/ingredients/', {'name': 'сод'})
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.data], ['сода']
+        )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeWriteTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author',
+            email='author@foodgram.ru',
+            password='password'
+        )
+        cls.tags = [
+            Tag.objects.create(name=name, color='#E26C2D', slug=slug)
+            for name, slug in (('Завтрак', 'breakfast'), ('Обед', 'lunch'))
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(30)
+        ]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def payload(self, ingredients, amount=10):
+        return {
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': benchmark.IMAGE,
+            'tags': [tag.id for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': amount}
+                for ingredient in ingredients
+            ],
+        }
+
+    def test_create_query_count_does_not_depend_on_ingredients(self):
+        for count in (1, 25):
+            with self.assertNumQueries(10):
+                response = self.client.post(
+                    '/api/recipes/',
+                    self.payload(self.ingredients[:count]),
+                    format='json'
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data['ingredients']), count)
+            self.assertEqual(len(response.data['tags']), 2)
+            self.assertFalse(response.data['is_favorited'])
+
+    def test_invalid_ingredients_are_rejected(self):
+        for ingredients in (
+            [{'id': self.ingredients[0].id, 'amount': 1}] * 2,
+            [{'id': self.ingredients[0].id, 'amount': 0}],
+            [{'id': 10 ** 6, 'amount': 1}],
+            [],
+        ):
+            payload = self.payload([])
+            payload['ingredients'] = ingredients
+            response = self.client.post('/api/recipes/', payload,
+                                        format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('ingredients', response.data)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_update_keeps_unchanged_rows(self):
+        response = self.client.post(
+            '/api/recipes/',
+            self.payload(self.ingredients[:3]),
+            format='json'
+        )
+        recipe_id = response.data['id']
+        kept = IngredientInRecipe.objects.get(
+            recipe_id=recipe_id, ingredient=self.ingredients[0]
+        )
+        payload = self.payload(self.ingredients[:1] + self.ingredients[3:5])
+        payload['tags'] = [self.tags[1].id]
+        response = self.client.patch(f'/api/recipes/{recipe_id}/', payload,
+                                     format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [ingredient['id'] for ingredient in response.data['ingredients']],
+            [self.ingredients[i].id for i in (0, 3, 4)]
+        )
+        self.assertEqual([tag['id'] for tag in response.data['tags']],
+                         [self.tags[1].id])
+        self.assertTrue(IngredientInRecipe.objects.filter(pk=kept.pk).exists())
+        self.assertEqual(
+            IngredientInRecipe.objects.filter(recipe_id=recipe_id).count(), 3
+        )
+
+    def test_update_does_not_overwrite_counters(self):
+        recipe_id = self.client.post(
+            '/api/recipes/',
+            self.payload(self.ingredients[:1]),
+            format='json'
+        ).data['id']
+        write_tags = CreateRecipeSerializer.write_tags
+
+        # A favorite committed by another request while the PATCH runs.
+        def concurrent_favorite(serializer, *args):
+            write_tags(serializer, *args)
+            Recipe.objects.filter(pk=recipe_id).update(
+                favorites_count=F('favorites_count') + 1
+            )
+
+        with patch.object(CreateRecipeSerializer, 'write_tags',
+                          concurrent_favorite):
+            response = self.client.patch(
+                f'/api/recipes/{recipe_id}/',
+                {'name': 'Новое название', 'tags': [self.tags[0].id]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        recipe = Recipe.objects.get(pk=recipe_id)
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.favorites_count, 1)
+
+
+class ShoppingListExportTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer',
+            email='buyer@foodgram.ru',
+            password='password'
+        )
+        flour = Ingredient.objects.create(name='мука', measurement_unit='г')
+        milk = Ingredient.objects.create(name='молоко', measurement_unit='мл')
+        eggs = Ingredient.objects.create(name='яйца', measurement_unit='шт')
+        for name, amounts in (
+            ('Блины', ((flour, 200), (milk, 500), (eggs, 2))),
+            ('Оладьи', ((flour, 300), (milk, 250))),
+            ('Омлет', ((eggs, 3), (milk, 100))),
+        ):
+            recipe = Recipe.objects.create(
+                author=cls.user,
+                name=name,
+                text='Описание',
+                cooking_time=10,
+                image='recipe.png'
+            )
+            for ingredient, amount in amounts:
+                IngredientInRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=amount
+                )
+            if name != 'Омлет':
+                ShoppingCart.objects.create(recipe=recipe, user=cls.user)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def download(self, **kwargs):
+        response = self.client.get('/api/recipes/download_shopping_cart/',
+                                   **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_text_totals(self):
+        response, content = self.download()
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        lines = content.decode().splitlines()
+        self.assertEqual(lines[2:5], [
+            'молоко - 750 мл',
+            'мука - 500 г',
+            'яйца - 2 шт',
+        ])
+        self.assertIn('Блины', lines)
+        self.assertNotIn('Омлет', lines)
+
+    def test_csv_by_query_parameter(self):
+        response, content = self.download(data={'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('wishlist.csv', response['Content-Disposition'])
+        rows = content.decode().splitlines()
+        self.assertEqual(rows[0],
+                         'section,recipe,ingredient,measurement_unit,amount')
+        self.assertIn('total,,мука,г,500', rows)
+        self.assertIn('recipe,Оладьи,мука,г,300', rows)
+
+    def test_json_by_accept_header(self):
+        response, content = self.download(HTTP_ACCEPT='application/json')
+        data = json.loads(content)
+        self.assertEqual(
+            data['ingredients'][0],
+            {'name': 'молоко', 'measurement_unit': 'мл', 'amount': 750}
+        )
+        self.assertEqual([recipe['name'] for recipe in data['recipes']],
+                         ['Блины', 'Оладьи'])
+
+    def test_pdf(self):
+        response, content = self.download(HTTP_ACCEPT='application/pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF-'))
+        self.assertTrue(content.rstrip().endswith(b'%%EOF'))
+
+
+class CatalogueCacheTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_second_request_is_served_from_cache(self):
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/tags/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(json.loads(response.content)[0]['slug'], 'breakfast')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertEqual(
+            self.client.get('/api/cache/stats/').status_code, 401
+        )
+
+    def test_conditional_requests(self):
+        response = self.client.get(f'/api/tags/{self.tag.id}/')
+        etag = response['ETag']
+        response = self.client.get(f'/api/tags/{self.tag.id}/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            f'/api/tags/{self.tag.id}/',
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_change_invalidates_cache(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        self.tag.name = 'Обед'
+        self.tag.save()
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(json.loads(response.content)[0]['name'], 'Обед')
+
+    def test_missing_objects_are_not_cached(self):
+        self.assertEqual(self.client.get('/api/tags/0/').status_code, 404)
+        self.assertEqual(self.client.get('/api/tags/0/').status_code, 404)
+
+
+class CounterTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader',
+            email='reader@foodgram.ru',
+            password='password'
+        )
+        cls.author = User.objects.create_user(
+            username='author',
+            email='author@foodgram.ru',
+            password='password'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author,
+            name='Рецепт',
+            text='Описание',
+            cooking_time=10,
+            image='recipe.png'
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_counters_follow_writes(self):
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+        favorite = f'/api/recipes/{self.recipe.id}/favorite/'
+        cart = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        self.client.get(favorite)
+        self.client.get(cart)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.recipe.in_carts_count, 1)
+        response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.data['favorites_count'], 1)
+        self.assertNotIn('in_carts_count', response.data)
+
+        self.client.delete(favorite)
+        self.client.delete(cart)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(self.recipe.in_carts_count, 0)
+        self.recipe.delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_rebuild_counters(self):
+        FavoriteRecipe.objects.create(recipe=self.recipe, user=self.user)
+        Recipe.objects.update(favorites_count=5, in_carts_count=2)
+        User.objects.update(recipes_count=0)
+        out = StringIO()
+        call_command('rebuild_counters', stdout=out)
+        self.assertIn('recipes.Recipe.favorites_count: 1', out.getvalue())
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.recipe.in_carts_count, 0)
+        self.assertEqual(self.author.recipes_count, 1)
+
+
+class SubscriptionListTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader',
+            email='reader@foodgram.ru',
+            password='password'
+        )
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{i}',
+                email=f'author{i}@foodgram.ru',
+                password='password'
+            )
+            for i in range(4)
+        ]
+        for author in cls.authors:
+            Subscribe.objects.create(user=cls.user, author=author)
+            for i in range(15):
+                Recipe.objects.create(
+                    author=author,
+                    name=f'Рецепт {i}',
+                    text='Описание',
+                    cooking_time=10,
+                    image='recipe.png'
+                )
+        Subscribe.objects.create(user=cls.authors[0], author=cls.user)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_query_count_does_not_depend_on_authors(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                '/api/users/subscriptions/?recipes_limit=2'
+            )
+        self.assertEqual(response.data['count'], 4)
+        for author in response.data['results']:
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(author['recipes_count'], 15)
+            self.assertEqual(
+                [recipe['name'] for recipe in author['recipes']],
+                ['Рецепт 14', 'Рецепт 13']
+            )
+
+    def test_recipes_limit_is_capped(self):
+        response = self.client.get('/api/users/subscriptions/')
+        self.assertEqual(
+            len(response.data['results'][0]['recipes']),
+            settings.SUBSCRIPTION_RECIPES_LIMIT
+        )
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=0'
+        )
+        self.assertEqual(response.data['results'][0]['recipes'], [])
+
+    def test_subscribe_response(self):
+        author = User.objects.create_user(
+            username='new',
+            email='new@foodgram.ru',
+            password='password'
+        )
+        Recipe.objects.create(author=author, name='Рецепт', text='Описание',
+                              cooking_time=10, image='recipe.png')
+        response = self.client.get(
+            f'/api/users/{author.id}/subscribe/?recipes_limit=1'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['is_subscribed'])
+        self.assertEqual(response.data['recipes_count'], 1)
+        self.assertEqual(len(response.data['recipes']), 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), JOBS_BACKEND='immediate')
+class RecipeImageTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author',
+            email='author@foodgram.ru',
+            password='password'
+        )
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(name='соль',
+                                                   measurement_unit='г')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def encode(self, width, height):
+        image = Image.new('RGB', (width, height), (200, 30, 30))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        data = base64.b64encode(buffer.getvalue()).decode()
+        return f'data:image/jpeg;base64,{data}'
+
+    def post(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/recipes/', {
+                'name': 'Рецепт',
+                'text': 'Описание',
+                'cooking_time': 5,
+                'image': image,
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+            }, format='json')
+
+    def test_image_is_resized_and_thumbnailed(self):
+        response = self.post(self.encode(2400, 1200))
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipe.objects.get()
+        self.assertEqual(sorted(recipe.thumbnails, key=int),
+                         ['320', '640', '800'])
+        with recipe.image.open() as file, Image.open(file) as image:
+            self.assertEqual(image.size, (800, 1600))
+            self.assertNotIn(0x0112, image.getexif())
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        srcset = response.data['image_srcset']
+        self.assertEqual(list(srcset), ['320', '640', '800'])
+        self.assertTrue(srcset['800'].endswith(recipe.image.name))
+
+    @override_settings(RECIPE_IMAGE_MAX_BYTES=1024)
+    def test_large_upload_is_rejected(self):
+        response = self.post(self.encode(400, 400))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    def test_backfill_command(self):
+        self.post(self.encode(100, 100))
+        Recipe.objects.update(thumbnails={})
+        out = StringIO()
+        call_command('process_images', stdout=out)
+        self.assertIn('Обработано: 1', out.getvalue())
+        self.assertEqual(list(Recipe.objects.get().thumbnails), ['100'])
+
+
+class AsyncRoutesTest(SimpleTestCase):
+
+    def test_hot_read_paths_are_async(self):
+        urlconf = 'foodgram.urls_async'
+        for path in ('/api/recipes/', '/api/recipes/1/', '/api/tags/',
+                     '/api/ingredients/1/', '/api/users/subscriptions/'):
+            self.assertTrue(
+                asyncio.iscoroutinefunction(resolve(path, urlconf).func),
+                path
+            )
+        for path in ('/api/recipes/1/favorite/', '/api/users/me/'):
+            self.assertFalse(
+                asyncio.iscoroutinefunction(resolve(path, urlconf).func),
+                path
+            )
+        self.assertFalse(
+            asyncio.iscoroutinefunction(resolve('/api/recipes/').func)
+        )
+
+
+class RecipeSearchTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author',
+            email='author@foodgram.ru',
+            password='password'
+        )
+        breakfast = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                       slug='breakfast')
+        lunch = Tag.objects.create(name='Обед', color='#49B64E',
+                                   slug='lunch')
+        beet = Ingredient.objects.create(name='свекла', measurement_unit='г')
+        for name, text, tag, ingredient in (
+            ('Борщ', 'Варить долго', lunch, beet),
+            ('Омлет', 'Взбить яйца', breakfast, None),
+            ('Винегрет', 'Нарезать кубиками', lunch, beet),
+            ('Сырники', 'Подавать с борщевым соусом', breakfast, None),
+        ):
+            recipe = Recipe.objects.create(author=author, name=name,
+                                           text=text, cooking_time=10,
+                                           image='recipe.png')
+            recipe.tags.set([tag])
+            if ingredient:
+                IngredientInRecipe.objects.create(recipe=recipe,
+                                                  ingredient=ingredient,
+                                                  amount=100)
+
+    def search(self, **params):
+        response = self.client.get('/api/recipes/', params)
+        return sorted(recipe['name'] for recipe in response.data['results'])
+
+    def test_search_by_name_text_and_ingredient(self):
+        self.assertEqual(self.search(search='Борщ'), ['Борщ'])
+        self.assertEqual(self.search(search='соус'), ['Сырники'])
+        self.assertEqual(self.search(search='свекла'), ['Борщ', 'Винегрет'])
+
+    def test_search_combines_with_filters(self):
+        self.assertEqual(self.search(search='свекла', tags='breakfast'), [])
+        self.assertEqual(self.search(search='а', tags='breakfast'),
+                         ['Омлет', 'Сырники'])
+
+    def test_search_rejects_cursor(self):
+        response = self.client.get('/api/recipes/',
+                                   {'search': 'свекла', 'cursor': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('errors', response.data)
+        self.assertEqual(self.search(search='свекла', page=1),
+                         ['Борщ', 'Винегрет'])
+
+
+class WhatToCookTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author',
+            email='author@foodgram.ru',
+            password='password'
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(6)
+        ]
+        cls.recipes = {}
+        for name, cooking_time, positions in (
+            ('Яичница', 10, (0, 1)),
+            ('Омлет', 5, (0, 1, 2)),
+            ('Салат', 15, (0, 1)),
+            ('Пирог', 60, (0, 3, 4, 5)),
+            ('Суп', 40, (5,)),
+        ):
+            cls.recipes[name] = cls.create_recipe(name, cooking_time,
+                                                  positions)
+
+    @classmethod
+    def create_recipe(cls, name, cooking_time, positions):
+        recipe = Recipe.objects.create(author=cls.author, name=name,
+                                       text='Описание',
+                                       cooking_time=cooking_time,
+                                       image='recipe.png')
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(recipe=recipe,
+                               ingredient=cls.ingredients[position],
+                               amount=1)
+            for position in positions
+        ])
+        return recipe
+
+    def setUp(self):
+        pantry_index.invalidate()
+
+    def what_to_cook(self, positions, **params):
+        ids = ','.join(str(self.ingredients[i].id) for i in positions)
+        response = self.client.get('/api/recipes/what_to_cook/',
+                                   {'ingredients': ids, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(recipe['name'], recipe['missing_ingredients'])
+                for recipe in response.data]
+
+    def test_recipes_are_ranked_by_coverage_and_time(self):
+        self.assertEqual(self.what_to_cook((0, 1, 2)), [
+            ('Омлет', 0),
+            ('Яичница', 0),
+            ('Салат', 0),
+            ('Пирог', 3),
+        ])
+        self.assertEqual(self.what_to_cook((0, 1, 2), max_missing=0,
+                                           limit=2),
+                         [('Омлет', 0), ('Яичница', 0)])
+        self.assertEqual(self.what_to_cook((3,), max_missing=0), [])
+
+    def test_index_follows_writes(self):
+        self.assertEqual(self.what_to_cook((5,), max_missing=0),
+                         [('Суп', 0)])
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = self.create_recipe('Бульон', 30, (5,))
+            pantry_index.refresh(recipe.id)
+            self.recipes['Суп'].delete()
+        self.assertEqual(self.what_to_cook((5,), max_missing=0),
+                         [('Бульон', 0)])
+
+    def test_recipes_are_serialized_in_one_batch(self):
+        self.what_to_cook((0, 1, 2))
+        counts = []
+        for limit in (1, 4):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(
+                    len(self.what_to_cook((0, 1, 2), limit=limit)), limit
+                )
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_ingredients(self):
+        response = self.client.get('/api/recipes/what_to_cook/',
+                                   {'ingredients': 'соль'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipeBatchTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader',
+            email='reader@foodgram.ru',
+            password='password'
+        )
+        cls.recipes = [
+            Recipe.objects.create(author=cls.user, name=f'Рецепт {i}',
+                                  text='Описание', cooking_time=10,
+                                  image='recipe.png')
+            for i in range(3)
+        ]
+        cls.ids = [recipe.id for recipe in cls.recipes]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_add_and_remove_favorites(self):
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipes[0])
+        url = '/api/recipes/favorite/batch/'
+        with self.assertNumQueries(6):
+            response = self.client.post(
+                url, {'recipes': self.ids + [self.ids[1], 0xFFFF]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'added': self.ids[1:],
+            'existing': self.ids[:1],
+            'not_found': [0xFFFF],
+        })
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', flat=True
+            )),
+            [1, 1, 1]
+        )
+
+        with self.assertNumQueries(7):
+            response = self.client.delete(
+                url, {'recipes': self.ids[:2] + [0xFFFF]}, format='json'
+            )
+        self.assertEqual(response.data, {
+            'removed': self.ids[:2],
+            'missing': [0xFFFF],
+        })
+        self.assertEqual(
+            list(FavoriteRecipe.objects.values_list('recipe_id', flat=True)),
+            self.ids[2:]
+        )
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', flat=True
+            )),
+            [0, 0, 1]
+        )
+
+    def test_idempotency_key_replays_response(self):
+        url = '/api/recipes/shopping_cart/batch/'
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'cart-1'}
+        first = self.client.post(url, {'recipes': self.ids}, format='json',
+                                 **headers)
+        ShoppingCart.objects.all().delete()
+        with self.assertNumQueries(0):
+            second = self.client.post(url, {'recipes': self.ids},
+                                      format='json', **headers)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertFalse(ShoppingCart.objects.exists())
+
+        response = self.client.post(url, {'recipes': self.ids[:1]},
+                                    format='json', **headers)
+        self.assertEqual(response.status_code, 422)
+
+    def test_invalid_batch(self):
+        url = '/api/recipes/favorite/batch/'
+        for payload in ({}, {'recipes': []}, {'recipes': ['соль']},
+                        {'recipes': list(range(1, 1000))}):
+            response = self.client.post(url, payload, format='json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_single_endpoint_accepts_post(self):
+        response = self.client.post(
+            f'/api/recipes/{self.ids[0]}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201)
+
+
+class ShoppingListTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer',
+            email='buyer@foodgram.ru',
+            password='password'
+        )
+        cls.flour = Ingredient.objects.create(name='мука',
+                                              measurement_unit='г')
+        cls.milk = Ingredient.objects.create(name='молоко',
+                                             measurement_unit='мл')
+        cls.eggs = Ingredient.objects.create(name='яйца',
+                                             measurement_unit='шт')
+        cls.recipes = {}
+        for name, amounts in (
+            ('Блины', ((cls.flour, 200), (cls.milk, 500), (cls.eggs, 2))),
+            ('Оладьи', ((cls.flour, 300), (cls.milk, 250))),
+        ):
+            recipe = Recipe.objects.create(author=cls.user, name=name,
+                                           text='Описание', cooking_time=10,
+                                           image='recipe.png')
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=amount)
+                for ingredient, amount in amounts
+            ])
+            cls.recipes[name] = recipe
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def preview(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/recipes/shopping_cart/')
+        self.assertEqual(response.status_code, 200)
+        return [(item['name'], item['amount'], item['recipes_count'])
+                for item in response.data]
+
+    def test_list_follows_cart(self):
+        pancakes = self.recipes['Блины']
+        fritters = self.recipes['Оладьи']
+        self.client.post(f'/api/recipes/{pancakes.id}/shopping_cart/')
+        self.client.post('/api/recipes/shopping_cart/batch/',
+                         {'recipes': [fritters.id]}, format='json')
+        self.assertEqual(self.preview(), [
+            ('молоко', 750, 2),
+            ('мука', 500, 2),
+            ('яйца', 2, 1),
+        ])
+
+        self.client.delete(f'/api/recipes/{pancakes.id}/shopping_cart/')
+        self.assertEqual(self.preview(), [('молоко', 250, 1),
+                                          ('мука', 300, 1)])
+        self.client.delete('/api/recipes/shopping_cart/batch/',
+                           {'recipes': [fritters.id]}, format='json')
+        self.assertEqual(self.preview(), [])
+
+    def test_list_follows_recipe_edits(self):
+        ShoppingCart.objects.create(user=self.user,
+                                    recipe=self.recipes['Блины'])
+        ShoppingCart.objects.create(user=self.user,
+                                    recipe=self.recipes['Оладьи'])
+        response = self.client.patch(
+            f'/api/recipes/{self.recipes["Оладьи"].id}/',
+            {'ingredients': [{'id': self.flour.id, 'amount': 100},
+                             {'id': self.eggs.id, 'amount': 1}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.preview(), [
+            ('молоко', 500, 1),
+            ('мука', 300, 2),
+            ('яйца', 3, 2),
+        ])
+
+        self.recipes['Блины'].delete()
+        self.assertEqual(self.preview(), [('мука', 100, 1),
+                                          ('яйца', 1, 1)])
+
+    def test_rebuild_shopping_lists(self):
+        ShoppingCart.objects.create(user=self.user,
+                                    recipe=self.recipes['Оладьи'])
+        ShoppingListItem.objects.all().delete()
+        ShoppingListItem.objects.create(user=self.user, ingredient=self.eggs,
+                                        amount=5, recipes_count=1)
+        out = StringIO()
+        call_command('rebuild_shopping_lists', stdout=out)
+        self.assertIn('Позиций в списках покупок: 2', out.getvalue())
+        self.assertEqual(self.preview(), [('молоко', 250, 1),
+                                          ('мука', 300, 1)])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class LoadDataTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author',
+            email='author@foodgram.ru',
+            password='password'
+        )
+
+    def write(self, suffix, content):
+        file = tempfile.NamedTemporaryFile('w', suffix=suffix,
+                                           encoding='utf-8', delete=False)
+        with file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    def load(self, *args):
+        out = StringIO()
+        err = StringIO()
+        call_command('load_data', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_ingredients_are_upserted(self):
+        path = self.write('.csv', 'name,measurement_unit\n'
+                                  'мука,г\nмолоко,мл\nмука,г\nсоль,\n')
+        out, err = self.load('ingredients', path)
+        self.assertIn('создано: 2', out)
+        self.assertIn('Запись 4: Не заполнено поле measurement_unit', err)
+        path = self.write('.json', json.dumps([
+            {'title': 'мука', 'dimension': 'г'},
+            {'title': 'яйца', 'dimension': 'шт'},
+        ]))
+        out, _ = self.load('ingredients', path, '--chunk-size', '1')
+        self.assertIn('создано: 1, обновлено: 0, пропущено: 1', out)
+        self.assertEqual(Ingredient.objects.count(), 3)
+
+    def test_tags_are_updated_by_slug(self):
+        Tag.objects.create(name='Завтрак', color='#000000', slug='breakfast')
+        path = self.write('.jsonl', '\n'.join(json.dumps(tag) for tag in (
+            {'name': 'Завтрак', 'color': '#E26C2D', 'slug': 'breakfast'},
+            {'name': 'Обед', 'color': '#49B64E', 'slug': 'lunch'},
+            {'name': 'Ужин', 'color': 'синий', 'slug': 'dinner'},
+        )))
+        out, _ = self.load('tags', path)
+        self.assertIn('создано: 1, обновлено: 1', out)
+        self.assertEqual(
+            dict(Tag.objects.values_list('slug', 'color')),
+            {'breakfast': '#E26C2D', 'lunch': '#49B64E'}
+        )
+
+    def test_recipes_with_ingredients_tags_and_images(self):
+        Ingredient.objects.create(name='мука', measurement_unit='г')
+        milk = Ingredient.objects.create(name='молоко', measurement_unit='мл')
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4)).save(buffer, 'PNG')
+        image_path = self.write('.png', '')
+        with open(image_path, 'wb') as file:
+            file.write(buffer.getvalue())
+        encoded = base64.b64encode(buffer.getvalue()).decode()
+        recipe = {
+            'author': 'author@foodgram.ru',
+            'name': 'Блины',
+            'text': 'Описание',
+            'cooking_time': 20,
+            'tags': ['breakfast'],
+            'ingredients': [
+                {'name': 'мука', 'measurement_unit': 'г', 'amount': 200},
+                {'id': milk.id, 'amount': 500},
+            ],
+            'image': f'data:image/png;base64,{encoded}',
+        }
+        path = self.write('.json', json.dumps([
+            recipe,
+            {**recipe, 'name': 'Оладьи', 'author': None,
+             'image': os.path.basename(image_path)},
+            {**recipe, 'name': 'Омлет', 'author': 'nobody'},
+            {**recipe, 'name': 'Каша', 'ingredients': [
+                {'name': 'крупа', 'measurement_unit': 'г', 'amount': 1}
+            ]},
+        ]))
+        with self.settings(RECIPE_IMAGE_MAX_BYTES=10 ** 6), \
+                patch.object(loader, 'READ_SIZE', 16):
+            out, err = self.load(
+                'recipes', path, '--author', 'author',
+                '--images-dir', os.path.dirname(image_path)
+            )
+        self.assertIn('создано: 2', out)
+        self.assertIn('process_images', out)
+        self.assertIn('Автор nobody не найден', err)
+        self.assertIn('Ингредиент крупа, г не найден', err)
+        recipes = Recipe.objects.order_by('id')
+        self.assertEqual([r.name for r in recipes], ['Блины', 'Оладьи'])
+        self.assertEqual(recipes[0].image.name, recipes[1].image.name)
+        self.assertEqual(
+            sorted(IngredientInRecipe.objects.values_list('amount',
+                                                          flat=True)),
+            [200, 200, 500, 500]
+        )
+        self.assertEqual(recipes[1].tags.get().slug, 'breakfast')
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 2)
+
+        out, _ = self.load('recipes', path, '--author', 'author')
+        self.assertIn('создано: 0', out)
+        self.assertIn('пропущено: 2', out)
+
+    def test_recipe_ids_survive_a_concurrent_insert(self):
+        Ingredient.objects.create(name='мука', measurement_unit='г')
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        manager = type(Recipe.objects)
+        bulk_create = manager.bulk_create
+
+        def bulk_create_then_insert(self, objs, *args, **kwargs):
+            created = bulk_create(self, objs, *args, **kwargs)
+            Recipe.objects.create(author=objs[0].author, name='Чужой',
+                                  text='Описание', cooking_time=1,
+                                  image='recipe.png')
+            return created
+
+        path = self.write('.json', json.dumps([
+            {'name': name, 'text': 'Описание', 'cooking_time': 20,
+             'tags': ['breakfast'], 'image': '',
+             'ingredients': [{'name': 'мука', 'measurement_unit': 'г',
+                              'amount': amount}]}
+            for name, amount in (('Блины', 100), ('Оладьи', 200))
+        ]))
+        with patch.object(manager, 'bulk_create', bulk_create_then_insert):
+            out, _ = self.load('recipes', path, '--author', 'author')
+        self.assertIn('создано: 2', out)
+        self.assertEqual(
+            dict(IngredientInRecipe.objects.values_list('recipe__name',
+                                                        'amount')),
+            {'Блины': 100, 'Оладьи': 200}
+        )
+        self.assertFalse(Recipe.objects.get(name='Чужой').tags.exists())
+
+
+class ProfilingTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author',
+            email='author@foodgram.ru',
+            password='password'
+        )
+        for i in range(3):
+            Recipe.objects.create(author=author, name=f'Рецепт {i}',
+                                  text='Описание', cooking_time=10,
+                                  image='recipe.png')
+
+    def test_server_timing_counts_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/')
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{len(queries)} SQL"', timing)
+        for name in ('db;dur=', 'view;dur=', 'render;dur=', 'total;dur='):
+            self.assertIn(name, timing)
+
+        with self.settings(PROFILING_METRICS_TOKEN='secret'):
+            response = self.client.get('/metrics',
+                                       HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'foodgram_http_requests_total{view="recipes-list",method="GET",'
+            'status="200"}',
+            response.content.decode()
+        )
+
+    def test_metrics_require_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with self.settings(PROFILING_METRICS_TOKEN='secret'):
+            for header in ('', 'Bearer wrong', 'Token secret'):
+                response = self.client.get('/metrics',
+                                           HTTP_AUTHORIZATION=header)
+                self.assertEqual(response.status_code, 403)
+
+    @override_settings(PROFILING_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('foodgram.profiling', 'WARNING') as logs:
+            self.client.get('/api/recipes/')
+        self.assertIn('Медленный запрос GET /api/recipes/ (recipes-list)',
+                      logs.output[0])
+
+    def test_repeated_queries_are_fingerprinted(self):
+        profile = profiling.Profile()
+        for pk in (1, 2, 3):
+            profile.record(
+                f'SELECT * FROM recipes_tag WHERE id IN (%s, %s) LIMIT {pk}',
+                0.001
+            )
+        profile.record('SELECT 1', 0.001)
+        self.assertEqual(profile.repeated(), [
+            ('SELECT * FROM recipes_tag WHERE id IN (...) LIMIT ?', 3)
+        ])
+
+    def test_sampled_profiles_are_saved(self):
+        directory = tempfile.mkdtemp()
+        with self.settings(PROFILING_SAMPLE_PERCENT=100,
+                           PROFILING_PROFILE_DIR=directory):
+            self.client.get('/api/recipes/')
+        self.assertEqual(len(list(Path(directory).glob('*-recipes-list.prof'))),
+                         1)
+
+    def test_metrics_of_all_workers_are_merged(self):
+        directory = tempfile.mkdtemp()
+        registry = profiling.Metrics()
+        profile = profiling.Profile()
+        profile.total = 0.2
+        with self.settings(PROFILING_METRICS_DIR=directory):
+            registry.observe('recipes-list', 'GET', 200, profile, False)
+            other = Path(directory) / '1.json'
+            other.write_text(json.dumps(
+                [['recipes-list', 'GET', '200', [2] + [0] * 16]]
+            ))
+            text = registry.render()
+        self.assertIn('foodgram_http_requests_total{view="recipes-list",'
+                      'method="GET",status="200"} 3', text)
+        self.assertIn('foodgram_http_request_duration_seconds_bucket{'
+                      'view="recipes-list",method="GET",status="200",'
+                      'le="0.25"} 1', text)
+
+
+class RecipeFragmentCacheTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author',
+            email='author@foodgram.ru',
+            password='password',
+            first_name='Иван'
+        )
+        cls.reader = User.objects.create_user(
+            username='reader',
+            email='reader@foodgram.ru',
+            password='password'
+        )
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(name='мука',
+                                                   measurement_unit='г')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author,
+            name='Блины',
+            text='Описание',
+            cooking_time=10,
+            image='recipe.png'
+        )
+        cls.recipe.tags.set([cls.tag])
+        IngredientInRecipe.objects.create(recipe=cls.recipe,
+                                          ingredient=cls.ingredient,
+                                          amount=100)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_recipe(self):
+        response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_detail_is_served_from_cache(self):
+        self.get_recipe()
+        with self.assertNumQueries(1):
+            data = self.get_recipe()
+        self.assertEqual(data['name'], 'Блины')
+        self.assertTrue(data['image'].startswith('http://testserver/'))
+
+    def test_user_flags_are_not_cached(self):
+        FavoriteRecipe.objects.create(recipe=self.recipe, user=self.reader)
+        Subscribe.objects.create(user=self.reader, author=self.author)
+        self.assertFalse(self.get_recipe()['is_favorited'])
+        self.client.force_authenticate(self.reader)
+        data = self.get_recipe()
+        self.assertTrue(data['is_favorited'])
+        self.assertTrue(data['author']['is_subscribed'])
+        self.assertEqual(data['favorites_count'], 1)
+        self.client.force_authenticate(self.author)
+        data = self.get_recipe()
+        self.assertFalse(data['is_favorited'])
+        self.assertFalse(data['author']['is_subscribed'])
+
+    def test_recipe_update_invalidates_fragment(self):
+        self.get_recipe()
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {
+                'name': 'Оладьи',
+                'text': 'Описание',
+                'cooking_time': 10,
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 200}],
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = self.get_recipe()
+        self.assertEqual(data['name'], 'Оладьи')
+        self.assertEqual(data['ingredients'][0]['amount'], 200)
+
+    def test_related_changes_invalidate_fragment(self):
+        self.get_recipe()
+        self.tag.name = 'Ужин'
+        self.tag.save()
+        self.assertEqual(self.get_recipe()['tags'][0]['name'], 'Ужин')
+        self.author.first_name = 'Пётр'
+        self.author.save()
+        self.assertEqual(self.get_recipe()['author']['first_name'], 'Пётр')
+        self.author.last_login = None
+        self.author.save(update_fields=['last_login'])
+        with self.assertNumQueries(1):
+            self.get_recipe()
+
+    def test_invalidate_all_rotates_version_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            version = fragments.invalidate_all()
+            self.assertEqual(fragments.get_version(), version)
+        self.assertNotEqual(fragments.get_version(), version)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), JOBS_BACKEND='immediate',
+                   FEED_FANOUT_MAX_FOLLOWERS=1)
+class SubscriptionFeedTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader',
+            email='reader@foodgram.ru',
+            password='password'
+        )
+        cls.other = User.objects.create_user(
+            username='other',
+            email='other@foodgram.ru',
+            password='password'
+        )
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{i}',
+                email=f'author{i}@foodgram.ru',
+                password='password'
+            )
+            for i in range(3)
+        ]
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(name='соль',
+                                                   measurement_unit='г')
+        for author in cls.authors:
+            for i in range(4):
+                Recipe.objects.create(
+                    author=author,
+                    name=f'{author.username} {i}',
+                    text='Описание',
+                    cooking_time=10,
+                    image='recipe.png'
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.reader)
+
+    def subscribe(self, user, author):
+        self.client.force_authenticate(user)
+        response = self.client.get(f'/api/users/{author.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        self.client.force_authenticate(self.reader)
+
+    def publish(self, author, name):
+        self.client.force_authenticate(author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', {
+                'name': name,
+                'text': 'Описание',
+                'cooking_time': 5,
+                'image': benchmark.IMAGE,
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.client.force_authenticate(self.reader)
+        return response.data['id']
+
+    def read_feed(self, limit=100):
+        names = []
+        url = f'/api/recipes/feed/?limit={limit}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            names += [recipe['name'] for recipe in response.data['results']]
+            url = response.data['next']
+        return names
+
+    def expected(self, authors):
+        return list(Recipe.objects.filter(author__in=authors).order_by(
+            '-pub_date', '-id'
+        ).values_list('name', flat=True))
+
+    def test_feed_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/recipes/feed/').status_code,
+                         401)
+
+    def test_subscription_backfills_and_fans_out(self):
+        self.subscribe(self.reader, self.authors[0])
+        self.subscribe(self.reader, self.authors[1])
+        self.assertEqual(FeedEntry.objects.filter(user=self.reader).count(),
+                         8)
+        self.publish(self.authors[0], 'Новый')
+        self.publish(self.authors[2], 'Чужой')
+        feed = self.read_feed()
+        self.assertEqual(feed[0], 'Новый')
+        self.assertEqual(feed, self.expected(self.authors[:2]))
+        self.assertEqual(self.read_feed(limit=3), feed)
+
+    def test_popular_authors_are_pulled_on_read(self):
+        self.subscribe(self.other, self.authors[0])
+        self.subscribe(self.reader, self.authors[0])
+        self.subscribe(self.reader, self.authors[1])
+        recipe_id = self.publish(self.authors[0], 'Популярный')
+        self.assertFalse(FeedEntry.objects.filter(recipe=recipe_id).exists())
+        self.assertEqual(self.read_feed(limit=2),
+                         self.expected(self.authors[:2]))
+        with self.assertNumQueries(3):
+            self.client.get('/api/recipes/feed/?limit=5')
+
+    def test_unsubscribe_and_delete_prune_feed(self):
+        self.subscribe(self.reader, self.authors[0])
+        self.subscribe(self.reader, self.authors[1])
+        response = self.client.delete(
+            f'/api/users/{self.authors[1].id}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.read_feed(), self.expected(self.authors[:1]))
+        Recipe.objects.filter(author=self.authors[0]).first().delete()
+        self.assertEqual(FeedEntry.objects.filter(user=self.reader).count(),
+                         3)
+
+    def test_rebuild_command(self):
+        self.subscribe(self.reader, self.authors[0])
+        FeedEntry.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_feeds', stdout=out)
+        self.assertIn('Записей в лентах: 4', out.getvalue())
+        self.assertEqual(self.read_feed(), self.expected(self.authors[:1]))
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0', 'replica_1'])
+class ReplicaRouterTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.router = db_router.ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route(self, method, write=False, token='abc'):
+        request = self.factory.generic(method, '/api/recipes/',
+                                       HTTP_AUTHORIZATION=f'Token {token}')
+        databases = []
+
+        def view(request):
+            databases.append(self.router.db_for_read(Recipe))
+            if write:
+                self.router.db_for_write(Recipe)
+                databases.append(self.router.db_for_read(Recipe))
+            return HttpResponse()
+
+        db_router.PrimaryPinningMiddleware(view)(request)
+        return databases
+
+    def test_safe_requests_read_from_replicas(self):
+        self.assertIn(self.route('GET')[0], ('replica_0', 'replica_1'))
+        self.assertEqual(self.route('POST'), ['default'])
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+        self.assertEqual(self.router.db_for_write(Recipe), 'default')
+        self.assertTrue(self.router.allow_migrate('default', 'recipes'))
+        self.assertFalse(self.router.allow_migrate('replica_0', 'recipes'))
+
+    def test_client_is_pinned_to_primary_after_write(self):
+        databases = self.route('GET', write=True)
+        self.assertNotEqual(databases[0], 'default')
+        self.assertEqual(databases[1], 'default')
+        self.assertEqual(self.route('GET'), ['default'])
+        self.assertNotEqual(self.route('GET', token='other'), ['default'])
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_subscribe_pins_token(self):
+        reader = User.objects.create_user(username='reader',
+                                          email='reader@foodgram.ru',
+                                          password='password')
+        author = User.objects.create_user(username='author',
+                                          email='author@foodgram.ru',
+                                          password='password')
+        token = Token.objects.create(user=reader)
+        credentials = f'Token {token.key}'
+        self.client.credentials(HTTP_AUTHORIZATION=credentials)
+        request = self.factory.get('/', HTTP_AUTHORIZATION=credentials)
+        self.client.get('/api/recipes/')
+        self.assertIsNone(cache.get(db_router.pin_key(request)))
+        response = self.client.get(f'/api/users/{author.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(cache.get(db_router.pin_key(request)))
+
+
+class FakeConnection:
+    def __init__(self, usable=True, open=True, atomic=False,
+                 checked_at=0):
+        self.connection = object() if open else None
+        self.in_atomic_block = atomic
+        self.health_checked_at = checked_at
+        self.usable = usable
+        self.pinged = False
+        self.closed = False
+
+    def is_usable(self):
+        self.pinged = True
+        return self.usable
+
+    def close(self):
+        self.closed = True
+
+
+@override_settings(DB_HEALTH_CHECK_INTERVAL=10)
+class ConnectionHealthTest(SimpleTestCase):
+
+    def check(self, *fakes):
+        with patch.object(connections.connections, 'all',
+                          return_value=list(fakes)):
+            connections.check_connections()
+
+    def test_dead_idle_connection_is_closed(self):
+        dead = FakeConnection(usable=False)
+        alive = FakeConnection()
+        self.check(dead, alive)
+        self.assertTrue(dead.closed)
+        self.assertTrue(alive.pinged)
+        self.assertFalse(alive.closed)
+
+    def test_recent_closed_and_atomic_connections_are_skipped(self):
+        recent = FakeConnection(usable=False,
+                                checked_at=connections.time.monotonic())
+        closed = FakeConnection(usable=False, open=False)
+        atomic = FakeConnection(usable=False, atomic=True)
+        self.check(recent, closed, atomic)
+        for fake in (recent, closed, atomic):
+            self.assertFalse(fake.pinged)
+            self.assertFalse(fake.closed)
+
+
+class RecipeTagFilterTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author',
+                                          email='author@foodgram.ru',
+                                          password='password')
+        tags = {
+            slug: Tag.objects.create(name=slug, color='#E26C2D', slug=slug)
+            for slug in ('breakfast', 'lunch', 'dinner')
+        }
+        cls.recipes = {}
+        for name, slugs in (('both', ('breakfast', 'lunch')),
+                            ('breakfast', ('breakfast',)),
+                            ('lunch', ('lunch',)),
+                            ('dinner', ('dinner',))):
+            recipe = Recipe.objects.create(author=author, name=name,
+                                           text='Описание', cooking_time=10,
+                                           image='recipe.png')
+            recipe.tags.set([tags[slug] for slug in slugs])
+            cls.recipes[name] = recipe
+
+    def setUp(self):
+        cache.clear()
+
+    def filter(self, **params):
+        response = self.client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+        names = [recipe['name'] for recipe in response.data['results']]
+        self.assertEqual(response.data['count'], len(names))
+        return sorted(names)
+
+    def test_any_tag_returns_each_recipe_once(self):
+        self.assertEqual(self.filter(tags=['breakfast', 'lunch']),
+                         ['both', 'breakfast', 'lunch'])
+        self.assertEqual(
+            self.filter(tags=['breakfast', 'lunch'], tags_mode='any'),
+            ['both', 'breakfast', 'lunch']
+        )
+
+    def test_all_tags(self):
+        self.assertEqual(
+            self.filter(tags=['breakfast', 'lunch'], tags_mode='all'),
+            ['both']
+        )
+        self.assertEqual(self.filter(tags=['dinner'], tags_mode='all'),
+                         ['dinner'])
+
+    def test_without_tags(self):
+        self.assertEqual(len(self.filter()), 4)
+        self.assertEqual(len(self.filter(tags_mode='all')), 4)
+
+    def test_invalid_values(self):
+        response = self.client.get('/api/recipes/', {'tags': 'unknown'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/recipes/', {'tags': 'lunch',
+                                                     'tags_mode': 'some'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_has_no_join_or_distinct(self):
+        queryset = Recipe.objects.with_tags(
+            [tag.id for tag in Tag.objects.all()], match_all=True
+        )
+        sql = str(queryset.query).upper()
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn('JOIN', sql)
+        self.assertEqual(queryset.count(), 0)
+
+
+async def slow_view(request):
+    await asyncio.sleep(0.3)
+    return HttpResponse()
+
+
+urlpatterns = [re_path(r'^slow/$', slow_view)]
+
+
+@override_settings(ROOT_URLCONF=__name__, DATABASE_REPLICAS=['default'])
+class AsyncMiddlewareTest(SimpleTestCase):
+
+    def test_project_middleware_is_async_capable(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        for middleware in (profiling.ProfilingMiddleware,
+                           connections.ConnectionHealthMiddleware,
+                           db_router.PrimaryPinningMiddleware):
+            self.assertTrue(asyncio.iscoroutinefunction(
+                middleware(get_response)
+            ), middleware)
+            self.assertFalse(asyncio.iscoroutinefunction(
+                middleware(lambda request: HttpResponse())
+            ), middleware)
+
+    def test_concurrent_requests_do_not_share_a_thread(self):
+        async def load():
+            client = AsyncClient()
+            started = time.perf_counter()
+            responses = await asyncio.gather(
+                *(client.get('/slow/') for _ in range(4))
+            )
+            return responses, time.perf_counter() - started
+
+        responses, elapsed = asyncio.run(load())
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertLess(elapsed, 0.9)
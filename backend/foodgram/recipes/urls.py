@@ -5,8 +5,14 @@ from .views import (
     TagsViewSet,
     RecipeViewSet,
     FavoriteRecipeView,
+    FavoriteBatchView,
     ShoppingCartView,
+    ShoppingCartBatchView,
+    ShoppingListView,
     ShoppingCartDownload,
+    ShoppingListExportView,
+    ShoppingListExportFileView,
+    CatalogueCacheStatsView,
     UserSubscribeListView,
     SubscribeView
 )
@@ -22,7 +28,31 @@ urlpatterns = [
          ShoppingCartDownload.as_view(),
          name='download_shopping_cart'
          ),
+    path('recipes/download_shopping_cart/export/',
+         ShoppingListExportView.as_view(),
+         name='export_shopping_cart'
+         ),
+    path('recipes/download_shopping_cart/export/<str:name>/',
+         ShoppingListExportFileView.as_view(),
+         name='export_shopping_cart_file'
+         ),
+    path('recipes/favorite/batch/',
+         FavoriteBatchView.as_view(),
+         name='favorite_batch'
+         ),
+    path('recipes/shopping_cart/batch/',
+         ShoppingCartBatchView.as_view(),
+         name='shopping_cart_batch'
+         ),
+    path('recipes/shopping_cart/',
+         ShoppingListView.as_view(),
+         name='shopping_list'
+         ),
     path('', include(recipes_api.urls)),
+    path('cache/stats/',
+         CatalogueCacheStatsView.as_view(),
+         name='catalogue_cache_stats'
+         ),
     path('recipes/<int:recipe_id>/favorite/',
          FavoriteRecipeView.as_view(),
          name='favorite_recipe'
@@ -1,17 +1,28 @@
+from collections import defaultdict
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework import (
     mixins,
     viewsets,
     status,
-    generics,
-    pagination
+    generics
 )
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from jobs.models import Job
+from jobs.queue import enqueue
+from jobs.serializers import JobSerializer
 from .models import (
     Ingredient,
+    IngredientInRecipe,
     Tag,
     Recipe,
     FavoriteRecipe,
@@ -22,13 +33,30 @@ from .serializers import (
     IngredientSerializer,
     TagSerializer, RecipeSerializer,
     FavoriteSerializer,
+    RecipeBatchSerializer,
     ShoppingCartSerializer,
+    ShoppingListItemSerializer,
     CreateRecipeSerializer,
     SubscribeSerializer,
-    SubscribeCreateSerializer
+    SubscribeCreateSerializer,
+    get_recipes_limit
 )
 from rest_framework import permissions, views
+from .pagination import FeedPagination, decode_cursor, encode_cursor
+from .tasks import EXPORT_FORMATS
 from .permissions import RecipePermissions
+from . import cache as catalogue_cache
+from . import counters, exports, feed, fragments, shopping_list, signals
+from .idempotency import idempotent
+from .autocomplete import ingredient_index
+from .pantry import pantry_index
+from .cache import CatalogueCacheMixin
+from .renderers import (
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer,
+    ShoppingListPDFRenderer
+)
 from django_filters.rest_framework import DjangoFilterBackend
 from .filters import CustomFilter
 
@@ -41,6 +69,14 @@ class ListRetrieveViewSet(mixins.ListModelMixin,
     pass
 
 
+def query_int(request, name, default, maximum, minimum=1):
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        value = default
+    return max(minimum, min(value, maximum))
+
+
 class ListCreateRetrieveUpdateDestroy(mixins.ListModelMixin,
                                       mixins.CreateModelMixin,
                                       mixins.RetrieveModelMixin,
@@ -50,40 +86,147 @@ class ListCreateRetrieveUpdateDestroy(mixins.ListModelMixin,
     pass
 
 
-class IngredientsViewSet(ListRetrieveViewSet):
-
+class IngredientsViewSet(CatalogueCacheMixin, ListRetrieveViewSet):
     serializer_class = IngredientSerializer
+    queryset = Ingredient.objects.all()
     pagination_class = None
 
-    def get_queryset(self):
-        queryset = Ingredient.objects.all()
-        ingredient_name = self.request.query_params.get('name')
-        if ingredient_name is not None:
-            queryset = Ingredient.objects.filter(
-                name__startswith=ingredient_name.lower()
-            )
-        return queryset
+    def list(self, request, *args, **kwargs):
+        ingredient_name = request.query_params.get('name')
+        if ingredient_name is None:
+            return super().list(request, *args, **kwargs)
+        limit = query_int(request, 'limit', settings.INGREDIENT_SEARCH_LIMIT,
+                          settings.INGREDIENT_SEARCH_MAX_LIMIT)
+        return Response(ingredient_index.search(ingredient_name, limit))
 
 
-class TagsViewSet(ListRetrieveViewSet):
+class TagsViewSet(CatalogueCacheMixin, ListRetrieveViewSet):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     pagination_class = None
 
 
+class CatalogueCacheStatsView(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(catalogue_cache.stats())
+
+
 class RecipeViewSet(ListCreateRetrieveUpdateDestroy):
     serializer_class = RecipeSerializer
-    queryset = Recipe.objects.all()
+    pagination_class = FeedPagination
     filter_backends = [DjangoFilterBackend]
     filterset_class = CustomFilter
     permission_classes = [RecipePermissions]
 
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return Recipe.objects.for_fragments(self.request.user)
+        if self.action in ('update', 'partial_update'):
+            return Recipe.objects.select_related(
+                'author'
+            ).with_user_flags(self.request.user)
+        return Recipe.objects.all()
+
     def get_serializer_class(self):
         if 'list' in self.action or 'retrieve' in self.action:
             return RecipeSerializer
         return CreateRecipeSerializer
 
+    # The cursor pages by (pub_date, id) and would drop the search ranking.
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        if self.paginator.cursor_query_param in params and params.get(
+            'search', ''
+        ).strip():
+            return Response(
+                {'errors': 'Результаты поиска листаются только по page'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(fragments.serialize(list(queryset), request))
+        return self.get_paginated_response(
+            fragments.serialize(page, request)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(
+            fragments.serialize([self.get_object()], request)[0]
+        )
+
+    @action(detail=False)
+    def what_to_cook(self, request):
+        try:
+            ingredient_ids = [
+                int(value)
+                for values in request.query_params.getlist('ingredients')
+                for value in values.split(',') if value
+            ]
+        except ValueError:
+            return Response(
+                {'errors': 'ingredients должен быть списком id'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = query_int(request, 'limit', settings.WHAT_TO_COOK_LIMIT,
+                          settings.WHAT_TO_COOK_MAX_LIMIT)
+        max_missing = query_int(request, 'max_missing',
+                                settings.WHAT_TO_COOK_MAX_MISSING,
+                                settings.WHAT_TO_COOK_MAX_MISSING, minimum=0)
+        matches = pantry_index.search(ingredient_ids, limit, max_missing)
+        recipes = Recipe.objects.for_fragments(request.user).in_bulk(
+            [recipe_id for recipe_id, _, _ in matches]
+        )
+        found = [
+            (recipes[recipe_id], matched, size)
+            for recipe_id, matched, size in matches if recipe_id in recipes
+        ]
+        serialized = {
+            data['id']: data for data in fragments.serialize(
+                [recipe for recipe, _, _ in found], request
+            )
+        }
+        results = []
+        for recipe, matched, size in found:
+            data = serialized.get(recipe.pk)
+            if data is None:
+                continue
+            data['matched_ingredients'] = matched
+            data['missing_ingredients'] = size - matched
+            data['coverage'] = round(matched / size, 3)
+            results.append(data)
+        return Response(results)
+
+    @action(detail=False,
+            permission_classes=[permissions.IsAuthenticated])
+    def feed(self, request):
+        position, reverse = decode_cursor(request.query_params.get('cursor'))
+        if reverse:
+            raise NotFound('Неверный курсор')
+        limit = query_int(request, 'limit', settings.FEED_LIMIT,
+                          settings.FEED_MAX_LIMIT)
+        recipes, next_position = feed.page(request.user, position, limit)
+        next_link = None
+        if next_position is not None:
+            next_link = replace_query_param(
+                request.build_absolute_uri(), 'cursor',
+                encode_cursor(next_position)
+            )
+        return Response({
+            'next': next_link,
+            'results': fragments.serialize(recipes, request),
+        })
+
+
+# Every favorite and cart write of a user takes this row lock, so the
+# counters are adjusted from a snapshot nobody else can change before the
+# write.
+def lock_user(user):
+    User.objects.select_for_update().filter(pk=user.pk).exists()
+
 
 class FavoriteRecipeView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -100,19 +243,25 @@ class FavoriteRecipeView(views.APIView):
                 'request': request
             }
         )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        with transaction.atomic():
+            lock_user(user)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
         return Response(
             serializer.data,
             status=status.HTTP_201_CREATED
         )
 
+    post = get
+
     def delete(self, request, recipe_id):
         user = request.user
         recipe = get_object_or_404(Recipe, pk=recipe_id)
         favorite = FavoriteRecipe.objects.filter(recipe=recipe, user=user)
-        if favorite.exists():
-            favorite.delete()
+        with transaction.atomic():
+            lock_user(user)
+            deleted, _ = favorite.delete()
+        if deleted:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'error': 'Этого рецепта нет в избранном'},
@@ -135,19 +284,25 @@ class ShoppingCartView(views.APIView):
                 'request': request
             }
         )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        with transaction.atomic():
+            lock_user(user)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
         return Response(
             serializer.data,
             status=status.HTTP_201_CREATED
         )
 
+    post = get
+
     def delete(self, request, recipe_id):
         user = request.user
         recipe = get_object_or_404(Recipe, pk=recipe_id)
         shopping_cart = ShoppingCart.objects.filter(user=user, recipe=recipe)
-        if shopping_cart.exists():
-            shopping_cart.delete()
+        with transaction.atomic():
+            lock_user(user)
+            deleted, _ = shopping_cart.delete()
+        if deleted:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'error': 'Этого рецепта нет в корзине'},
@@ -155,43 +310,194 @@ class ShoppingCartView(views.APIView):
         )
 
 
+class RecipeBatchView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    model = None
+    counter = None
+
+    def changed(self, user, recipe_ids):
+        pass
+
+    def get_recipe_ids(self, request):
+        serializer = RecipeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['recipes']
+
+    @idempotent
+    def post(self, request):
+        recipe_ids = self.get_recipe_ids(request)
+        with transaction.atomic():
+            lock_user(request.user)
+            found = dict(Recipe.objects.filter(pk__in=recipe_ids).annotate(
+                present=Exists(self.model.objects.filter(
+                    user=request.user,
+                    recipe=OuterRef('pk')
+                ))
+            ).values_list('pk', 'present'))
+            added = [pk for pk in recipe_ids if found.get(pk) is False]
+            if added:
+                self.model.objects.bulk_create(
+                    [self.model(user=request.user, recipe_id=pk)
+                     for pk in added],
+                    ignore_conflicts=True
+                )
+                counters.adjust(Recipe, added, self.counter, 1)
+                self.changed(request.user, added)
+        return Response({
+            'added': added,
+            'existing': [pk for pk in recipe_ids if found.get(pk)],
+            'not_found': [pk for pk in recipe_ids if pk not in found],
+        })
+
+    @idempotent
+    def delete(self, request):
+        recipe_ids = self.get_recipe_ids(request)
+        entries = self.model.objects.filter(
+            user=request.user,
+            recipe_id__in=recipe_ids
+        )
+        with transaction.atomic():
+            lock_user(request.user)
+            present = set(entries.values_list('recipe_id', flat=True))
+            removed = [pk for pk in recipe_ids if pk in present]
+            if removed:
+                # The counters and shopping list are updated once below
+                # instead of per row by the post_delete handlers.
+                with signals.batch_delete():
+                    entries.delete()
+                counters.adjust(Recipe, removed, self.counter, -1)
+                self.changed(request.user, removed)
+        return Response({
+            'removed': removed,
+            'missing': [pk for pk in recipe_ids if pk not in present],
+        })
+
+
+class FavoriteBatchView(RecipeBatchView):
+    model = FavoriteRecipe
+    counter = 'favorites_count'
+
+
+class ShoppingCartBatchView(RecipeBatchView):
+    model = ShoppingCart
+    counter = 'in_carts_count'
+
+    def changed(self, user, recipe_ids):
+        shopping_list.refresh(
+            [user.id],
+            IngredientInRecipe.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values('ingredient')
+        )
+
+
+class ShoppingListView(generics.ListAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = ShoppingListItemSerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        return shopping_list.items(self.request.user).select_related(
+            'ingredient'
+        )
+
+
 class ShoppingCartDownload(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [
+        ShoppingListTextRenderer,
+        ShoppingListCSVRenderer,
+        ShoppingListJSONRenderer,
+        ShoppingListPDFRenderer
+    ]
 
     def get(self, request):
-        ingredients = request.user.user_shopping_cart.select_related(
-            'recipe'
-        ).order_by(
-            'recipe__ingredients__name'
-        ).values(
-            'recipe__ingredients__name',
-            'recipe__ingredients__measurement_unit'
-        ).annotate(
-            amount=Sum('recipe__recipe__amount')
-        ).all()
-
-        wishlist = []
-        for ingredient in ingredients:
-            wishlist.append(
-                f'{ingredient["recipe__ingredients__name"]}'
-                f' - {ingredient["amount"]}'
-                f' {ingredient["recipe__ingredients__measurement_unit"]}'
-                f'\n')
-
-        response = HttpResponse(wishlist, 'Content-Type: text/plain')
-        response['Content-Disposition'] = 'attachment; filename="wishlist.txt"'
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            renderer.stream(request.user),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="wishlist.{renderer.format}"'
+        )
         return response
 
 
+class ShoppingListExportView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        export_format = request.data.get('format', 'txt')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'errors': f'Формат должен быть одним из: '
+                           f'{", ".join(EXPORT_FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        job = enqueue(
+            exports.TASK,
+            [request.user.id, export_format],
+            user=request.user
+        )
+        return Response(
+            JobSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse('job_detail', args=[job.pk])}
+        )
+
+
+class ShoppingListExportFileView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, name):
+        get_object_or_404(
+            Job, user=request.user, task=exports.TASK, status=Job.DONE,
+            result__file=name
+        )
+        storage = exports.get_storage()
+        if not storage.exists(name):
+            raise NotFound()
+        return FileResponse(
+            storage.open(name),
+            as_attachment=True,
+            filename=f'wishlist.{name.rsplit(".", 1)[-1]}'
+        )
+
+
 class UserSubscribeListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = SubscribeSerializer
     http_method_names = ['get']
-    pagination_class = pagination.PageNumberPagination
+    pagination_class = FeedPagination
+    cursor_ordering = ('id',)
 
     def get_queryset(self):
         follower = self.request.user
-        return User.objects.filter(following__user=follower)
+        return User.objects.filter(following__user=follower).annotate(
+            is_subscribed=Exists(Subscribe.objects.filter(
+                user=follower,
+                author=OuterRef('pk')
+            ))
+        )
+
+    def paginate_queryset(self, queryset):
+        authors = super().paginate_queryset(queryset)
+        if authors is None:
+            authors = list(queryset)
+        limit = get_recipes_limit(self.request)
+        recipes = defaultdict(list)
+        if authors and limit:
+            for recipe in Recipe.objects.latest_by_authors(
+                [author.id for author in authors],
+                limit
+            ):
+                recipes[recipe.author_id].append(recipe)
+        for author in authors:
+            author.latest_recipes = recipes[author.id]
+        return authors
 
 
 class SubscribeView(views.APIView):
@@ -6,7 +6,15 @@ User = get_user_model()
 
 
 class CustomUSerAdmin(UserAdmin):
+    list_display = (
+        'username',
+        'email',
+        'first_name',
+        'last_name',
+        'recipes_count'
+    )
     list_filter = ('username', 'email')
+    readonly_fields = ('recipes_count',)
 
 
 admin.site.register(User, CustomUSerAdmin)
@@ -0,0 +1,61 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from foodgram.db_router import primary
+
+
+# Maintained with queryset.update(), which sends no signals, so a cached
+# copy would go stale and a later user.save() would write it back.
+COUNTER_FIELDS = ('user__recipes_count', 'user__followers_count')
+
+
+def get_cache():
+    return caches[settings.TOKEN_CACHE_ALIAS]
+
+
+def cache_key(key):
+    if settings.TOKEN_CACHE_HASH_KEYS:
+        key = hashlib.sha256(key.encode()).hexdigest()
+    return f'auth:token:{key}'
+
+
+def delete(keys):
+    get_cache().delete_many([cache_key(key) for key in keys])
+
+
+def invalidate(keys):
+    keys = list(keys)
+    if keys:
+        delete(keys)
+        transaction.on_commit(lambda: delete(keys))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        cache = get_cache()
+        user = cache.get(cache_key(key))
+        if user is not None:
+            return (user, self.get_model()(key=key, user=user))
+        model = self.get_model()
+        # A token issued a moment ago may not have reached the replicas yet.
+        with primary():
+            try:
+                token = model.objects.select_related('user').defer(
+                    *COUNTER_FIELDS
+                ).get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        user = token.user
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        cache.set(cache_key(key), user, settings.TOKEN_CACHE_TIMEOUT)
+        return (user, token)
@@ -35,6 +35,8 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, following_user):
+        if hasattr(following_user, 'is_subscribed'):
+            return following_user.is_subscribed
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import authentication
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    authentication.invalidate([instance.key])
+
+
+# Covers password changes and deactivation. Logging in only touches
+# last_login, which nothing reads from the cached user.
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, update_fields,
+                           **kwargs):
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    authentication.invalidate(
+        Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
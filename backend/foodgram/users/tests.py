@@ -0,0 +1,87 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from .authentication import cache_key
+
+User = get_user_model()
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader',
+            email='reader@foodgram.ru',
+            password='password'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get_me(self):
+        return self.client.get('/api/users/me/')
+
+    def test_warm_request_does_not_query_token(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_me().status_code, 200)
+        with self.assertNumQueries(1):
+            response = self.get_me()
+        self.assertEqual(response.data['email'], 'reader@foodgram.ru')
+
+    def test_raw_token_is_not_stored(self):
+        self.get_me()
+        self.assertIsNotNone(cache.get(cache_key(self.token.key)))
+        self.assertNotIn(self.token.key, ''.join(cache._cache))
+        with self.settings(TOKEN_CACHE_HASH_KEYS=False):
+            self.assertIsNone(cache.get(cache_key(self.token.key)))
+
+    def test_logout_invalidates_token(self):
+        self.get_me()
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_me().status_code, 401)
+
+    def test_password_change_invalidates_token(self):
+        self.get_me()
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'password',
+            'new_password': 'Nfr0q-Gfhjkm',
+        })
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(cache.get(cache_key(self.token.key)))
+        self.get_me()
+        self.assertTrue(
+            cache.get(cache_key(self.token.key)).check_password('Nfr0q-Gfhjkm')
+        )
+
+    def test_password_change_keeps_counters(self):
+        self.get_me()
+        follower = User.objects.create_user(username='follower',
+                                            email='follower@foodgram.ru',
+                                            password='password')
+        client = APIClient()
+        client.force_authenticate(follower)
+        response = client.get(f'/api/users/{self.user.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.followers_count, 1)
+        self.assertEqual(self.get_me().status_code, 200)
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'password',
+            'new_password': 'Nfr0q-Gfhjkm',
+        })
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.followers_count, 1)
+        self.assertTrue(self.user.check_password('Nfr0q-Gfhjkm'))
+
+    def test_deactivation_invalidates_token(self):
+        self.get_me()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_me().status_code, 401)